@@ -4,30 +4,230 @@
 # Notes:
 #
 # Script for supplying Mini40 data on demand. The setup used used the controller box from ATI.
+# The ATISerialReader thread reads the serial port in bulk and parses whole batches of frames
+# into numpy blocks, so that the acquisition loop handles chunks instead of single lines.
+
+import threading
+import queue
+import warnings
+import numpy as np
+from Instrumented_Object_GUI_Clock import now
+
+# Controller counts per Newton and per Newton-metre
+FORCE_DIVISOR = 200
+TORQUE_DIVISOR = 8000
+# A frame is "status,fx,fy,fz,tx,ty,tz"
+FRAME_FIELDS = 7
+SCALE = np.array([FORCE_DIVISOR]*3 + [TORQUE_DIVISOR]*3, dtype=np.float64)
+# Largest count of a frame field, a larger value is line noise
+MAX_COUNT = 2**31
+# Smallest interval between the timestamps of two samples, in seconds
+MIN_STAMP_INTERVAL = 1e-6
+
+def parse_ati_counts(frames):
+   '''
+   Parses a list of complete frames (bytes, terminator removed) into an (N,6) integer array of
+   raw controller counts. Returns the array and the number of malformed frames that were dropped,
+   frames with a field out of +-MAX_COUNT are malformed.
+   '''
+   good = [f for f in frames if f.count(b',') == FRAME_FIELDS-1]
+   counts = None
+   if good:
+      # Parse the whole batch in one call, falls back to frame by frame parsing if one of them is corrupted
+      try:
+         with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            values = np.fromstring(b','.join(good), dtype=np.int64, sep=',')
+         # Fields too large for int64 are saturated, so they are out of range as well
+         if values.size == len(good)*FRAME_FIELDS and np.all(np.abs(values, dtype=np.float64) <= MAX_COUNT):
+            counts = values.reshape(-1, FRAME_FIELDS)
+      except ValueError:
+         pass
+      if counts is None:
+         rows = []
+         for f in good:
+            try:
+               row = [int(v) for v in f.split(b',')]
+            except ValueError:
+               continue
+            if max(abs(v) for v in row) <= MAX_COUNT:
+               rows.append(row)
+         counts = np.array(rows, dtype=np.int64).reshape(-1, FRAME_FIELDS)
+   else:
+      counts = np.zeros((0, FRAME_FIELDS), dtype=np.int64)
+   dropped = len(frames) - counts.shape[0]
+   return counts[:,1:], dropped
+
+def parse_ati_frames(frames):
+   '''
+   Parses a list of complete frames into an (N,6) array of forces [N] and torques [Nm].
+   Returns the array and the number of malformed frames that were dropped.
+   '''
+   counts, dropped = parse_ati_counts(frames)
+   return counts/SCALE, dropped
+
+def split_ati_frames(buffer):
+   '''
+   Splits the complete frames out of a bytearray. The trailing partial frame is left in the buffer.
+   The '>' prompt the controller writes after answering a command is removed from the next frame.
+   '''
+   end = buffer.rfind(b'\n')
+   if end < 0:
+      return []
+   frames = bytes(buffer[:end]).split(b'\n')
+   del buffer[:end+1]
+   return [f.rstrip(b'\r').lstrip(b'>') for f in frames if f.strip()]
 
 def ati_mini40_data_bank(ser):
-    
-   lineATI=ser.readline() #reading serial port   
-      
-   dec=lineATI.decode()
-      
-   sp=dec.split(',')
-    
-   if (len(sp) == 7):
-      fx = int(sp[1])/200;
-      fy = int(sp[2])/200;
-      fz = int(sp[3])/200;
-      tx = int(sp[4])/8000;
-      ty = int(sp[5])/8000;
-      tz = int(sp[6])/8000;
-              
-   else:         
-      fx = 'Nan';
-      fy = 'Nan';
-      fz = 'Nan';
-      tx = 'Nan';
-      ty = 'Nan';
-      tz = 'Nan';                                              
+
+   lineATI=ser.readline() #reading serial port
+
+   data, dropped = parse_ati_frames([lineATI.rstrip(b'\r\n')])
+
+   if dropped == 0:
+      fx,fy,fz,tx,ty,tz = data[0]
+   else:
+      fx = fy = fz = tx = ty = tz = np.nan
 
    return [fx,fy,fz,tx,ty,tz]
-                                
\ No newline at end of file
+
+class ATISerialReader(threading.Thread):
+   '''
+   Thread pulling whatever is available in the serial port buffer and parsing it in batches.
+   Each parsed batch is put in the blocks queue as an (N,7) array [Time,fx,fy,fz,tx,ty,tz].
+   Since a batch is read at once, the samples are timestamped backwards from the read time
+   using the nominal sample period of the controller. A batch that arrived sooner than that after
+   the last sample stamped is spread evenly since it, so that the timestamps always increase.
+   '''
+   def __init__(self, serial_port, sample_period=1/200, max_read=4096):
+      threading.Thread.__init__(self, daemon=True)
+      self.serial_port = serial_port
+      self.sample_period = sample_period
+      self.max_read = max_read
+      self.blocks = queue.Queue()
+      # Lines that are not data frames, answers of the controller to the commands, as (time, text)
+      self.replies = queue.Queue()
+      self.buffer = bytearray()
+      # Number of malformed frames (not counting the controller answers) and of partial frames discarded
+      self.dropped = 0
+      self.partial = 0
+      # Timestamp of the last sample of the previous batch
+      self.lastStamp = None
+      # Error that stopped the thread, checked by the acquisition process
+      self.error = None
+      self.alive = threading.Event()
+      self.alive.set()
+
+   def run(self):
+      try:
+         while self.alive.is_set():
+            # Blocks for at most the port timeout when nothing is waiting
+            waiting = self.serial_port.in_waiting
+            chunk = self.serial_port.read(min(max(waiting, 1), self.max_read))
+            # Stamped with the common clock right after the read returns
+            timestamp = now()
+            if not chunk:
+               continue
+            self.buffer += chunk
+            block = self.parse(timestamp)
+            if block is not None:
+               self.blocks.put(block)
+      except Exception as e:
+         self.error = "%s: %s" % (type(e).__name__, e)
+         print("ATI serial reader stopped, %s" % self.error)
+
+   def parse(self, timestamp):
+      ''' Parses the complete frames in the buffer, returns None if no valid frame was found '''
+      frames = split_ati_frames(self.buffer)
+      if len(self.buffer) > self.max_read:
+         # A frame can never be that long, the terminator has been lost
+         self.partial = self.partial + 1
+         del self.buffer[:]
+      if not frames:
+         return None
+      data, dropped = parse_ati_frames(frames)
+      if dropped:
+         # Data frames only hold digits, the answers echo the command letters
+         replies = [f for f in frames if f.lower() != f.upper()]
+         for f in replies:
+            self.replies.put((timestamp, f.decode('latin-1').strip()))
+         dropped = dropped - len(replies)
+      self.dropped = self.dropped + dropped
+      n = data.shape[0]
+      if n == 0:
+         return None
+      end = timestamp
+      step = self.sample_period
+      if self.lastStamp is not None:
+         end = max(timestamp, self.lastStamp + n*MIN_STAMP_INTERVAL)
+         step = min(step, (end - self.lastStamp)/n)
+      self.lastStamp = end
+      block = np.empty((n, 7))
+      block[:,0] = end - step*np.arange(n-1, -1, -1)
+      block[:,1:] = data
+      return block
+
+   def get_reply(self, timeout=None):
+      ''' Returns the next (time, text) answer of the controller, or None if nothing arrived before the timeout '''
+      try:
+         return self.replies.get(timeout=timeout)
+      except queue.Empty:
+         return None
+
+   def get(self, timeout=None):
+      ''' Returns the next parsed block, or None if nothing arrived before the timeout '''
+      try:
+         return self.blocks.get(timeout=timeout)
+      except queue.Empty:
+         return None
+
+   def stop(self, timeout=None):
+      self.alive.clear()
+      self.join(timeout)
+      # Whatever is left in the buffer is an incomplete frame
+      if self.buffer:
+         self.partial = self.partial + 1
+         del self.buffer[:]
+
+class SoftwareBias:
+   '''
+   Bias applied in software: the offset of the forces and torques is the mean of the samples of the
+   last window seconds, so it is computed at once from the recent samples without stopping the stream.
+   '''
+   def __init__(self, window=0.5, sample_rate=200):
+      self.capacity = max(int(window*sample_rate), 1)
+      self.recent = np.zeros((self.capacity, 6))
+      self.position = 0
+      self.count = 0
+      self.offset = np.zeros(6)
+
+   def add(self, block):
+      ''' Keeps the raw forces and torques of a block [Time,fx,fy,fz,tx,ty,tz] '''
+      values = block[-self.capacity:,1:]
+      index = (self.position + np.arange(len(values))) % self.capacity
+      self.recent[index] = values
+      self.position = (self.position + len(values)) % self.capacity
+      self.count = min(self.count + len(values), self.capacity)
+
+   def capture(self):
+      ''' Takes the mean of the recent samples as the new offset, returns it with their standard deviation '''
+      if self.count == 0:
+         return self.offset, None
+      window = self.recent[:self.count]
+      self.offset = window.mean(axis=0)
+      return self.offset, window.std(axis=0)
+
+   def metadata(self, raw_columns=None):
+      '''
+      Software bias entries of the metadata of a trial. raw_columns are the columns recorded without the
+      offset (the controller counts of the compressed files), load_trial removes it from them
+      '''
+      values = {'software_bias': self.offset.tolist()}
+      if raw_columns:
+         values['bias_columns'] = list(raw_columns)
+      return values
+
+   def apply(self, block):
+      ''' Removes the offset from a block [Time,fx,fy,fz,tx,ty,tz], in place '''
+      block[:,1:] -= self.offset
+      return block
@@ -0,0 +1,175 @@
+'''
+Index of a whole study in a SQLite database, so that trials can be selected across participants and
+experiments without opening the trial files, e.g. all the trials of an experiment with a peak fz above 10 N.
+Every trial file found in the study folders (named as in Instrumented_Object_Analysis_Session.py) gets a row
+with its names and numbers, the number of samples, duration, rate and frames dropped during the recording,
+and every channel gets its minimum, maximum, mean and peak (largest absolute value).
+The files are summarised in parallel, one file per worker process. Updating the index only summarises the
+files that are new or changed since the last update (size and modification time of the file and of its
+metadata), and forgets the files that were removed from the folders updated.
+
+Usage: python Instrumented_Object_Analysis_Index.py --db study.sqlite --update data_folder...
+       python Instrumented_Object_Analysis_Index.py --db study.sqlite --experiment E1 --channel fz --above 10
+'''
+import os
+import glob
+import sqlite3
+import argparse
+import multiprocessing
+import numpy as np
+from Instrumented_Object_GUI_Writer import load_trial, read_trial_metadata, trial_metadata_path, trial_has_records
+from Instrumented_Object_Analysis_Session import parse_trial_name, parse_csv
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, metadata_mtime INTEGER,
+    experiment TEXT, participant TEXT, sensor TEXT, trial INTEGER, repeat INTEGER,
+    samples INTEGER, duration REAL, rate REAL, dropped INTEGER);
+CREATE TABLE IF NOT EXISTS channels (path TEXT, name TEXT, min REAL, max REAL, mean REAL, peak REAL,
+    PRIMARY KEY (path, name));
+CREATE INDEX IF NOT EXISTS files_names ON files (experiment, participant, sensor);
+CREATE INDEX IF NOT EXISTS channels_peak ON channels (name, peak);
+'''
+
+def file_version(path):
+    ''' Size and modification time of a trial file and modification time of its metadata, 0 without metadata '''
+    stat = os.stat(path)
+    try:
+        metadata = os.stat(trial_metadata_path(path)).st_mtime_ns
+    except FileNotFoundError:
+        metadata = 0
+    return stat.st_size, stat.st_mtime_ns, metadata
+
+def load_columns(path):
+    ''' Names and float arrays of the columns of a CSV or binary trial file '''
+    if path.endswith('.inob'):
+        records, info = load_trial(path)
+        return list(records.dtype.names), [np.asarray(records[name], dtype=np.float64) for name in records.dtype.names]
+    header, data = parse_csv(path)
+    return header, [data[:,i] for i in range(len(header))]
+
+def summarise_file(path):
+    ''' Row of the files table and rows of the channels table of one trial file '''
+    experiment, participant, sensor, trial, repeat = parse_trial_name(path)
+    names, columns = load_columns(path)
+    # The camera frames are stamped in microseconds of the camera clock
+    times = columns[0] if names[0] == 'Time' else 1e-6*columns[names.index('timestamp')]
+    samples = len(times)
+    duration = float(times[-1] - times[0]) if samples > 1 else 0.0
+    rate = (samples - 1)/duration if duration > 0 else None
+    dropped = read_trial_metadata(path).get('stats', {}).get('malformed')
+    channels = []
+    for name, values in zip(names, columns):
+        if name in ('Time', 'index', 'timestamp', 'flag', 'position', 'key'):
+            continue
+        values = values[~np.isnan(values)]
+        if len(values):
+            channels.append((path, name, float(values.min()), float(values.max()), float(values.mean()),
+                             float(np.abs(values).max())))
+    size, mtime, metadataTime = file_version(path)
+    return ((path, size, mtime, metadataTime, experiment, participant, sensor, trial, repeat,
+             samples, duration, rate, dropped), channels)
+
+def summarise_worker(path):
+    try:
+        return summarise_file(path)
+    except (OSError, ValueError) as e:
+        return path, str(e)
+
+def find_trial_files(folders):
+    paths = []
+    for folder in folders:
+        for path in glob.glob(os.path.join(folder, '**', '*_*'), recursive=True):
+            # Files prepared for a trial that was never recorded are left behind by a crash
+            if parse_trial_name(path) is not None and trial_has_records(path):
+                paths.append(os.path.abspath(path))
+    return sorted(paths)
+
+class StudyIndex:
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def update(self, folders, workers=None):
+        ''' Summarises the new and changed trial files of the folders, returns the number of files summarised '''
+        known = {row[0]: tuple(row[1:]) for row in self.connection.execute("SELECT path, size, mtime, metadata_mtime FROM files")}
+        found = find_trial_files(folders)
+        changed = [path for path in found if known.get(path) != file_version(path)]
+        # Only the files of the folders scanned that no longer exist are forgotten, the other folders are left as they are
+        scanned = tuple(os.path.join(os.path.abspath(folder), '') for folder in folders)
+        removed = [path for path in known if path.startswith(scanned) and not os.path.exists(path)]
+        with self.connection:
+            for path in removed:
+                self.forget(path)
+        if changed:
+            with multiprocessing.Pool(workers) as pool:
+                for result in pool.imap_unordered(summarise_worker, changed, chunksize=4):
+                    if isinstance(result[1], str):
+                        print("%s: %s" % result)
+                        continue
+                    fileRow, channelRows = result
+                    with self.connection:
+                        self.forget(fileRow[0])
+                        self.connection.execute("INSERT INTO files VALUES (%s)" % ','.join('?'*len(fileRow)), fileRow)
+                        self.connection.executemany("INSERT INTO channels VALUES (?,?,?,?,?,?)", channelRows)
+        return len(changed)
+
+    def forget(self, path):
+        self.connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.connection.execute("DELETE FROM channels WHERE path = ?", (path,))
+
+    def find(self, experiment=None, participant=None, sensor=None, channel=None, above=None, below=None):
+        '''
+        Files matching the values given, as dicts of the files table. With channel, only the files where the
+        peak of the channel is above and/or below the values given, and the statistics of the channel are added
+        '''
+        columns = ["files.*"]
+        tables = "files"
+        conditions, values = [], []
+        for name, value in (('experiment', experiment), ('participant', participant), ('sensor', sensor)):
+            if value is not None:
+                conditions.append("files.%s = ?" % name)
+                values.append(value)
+        if channel is not None:
+            columns.append("channels.min AS channel_min, channels.max AS channel_max, channels.mean AS channel_mean, channels.peak AS channel_peak")
+            tables = "files JOIN channels ON channels.path = files.path"
+            conditions.append("channels.name = ?")
+            values.append(channel)
+            if above is not None:
+                conditions.append("channels.peak > ?")
+                values.append(above)
+            if below is not None:
+                conditions.append("channels.peak < ?")
+                values.append(below)
+        query = "SELECT %s FROM %s" % (', '.join(columns), tables)
+        if conditions:
+            query = query + " WHERE " + " AND ".join(conditions)
+        query = query + " ORDER BY files.experiment, files.participant, files.trial, files.repeat, files.sensor"
+        cursor = self.connection.execute(query, values)
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def close(self):
+        self.connection.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index the trials of a study and select trials from the index')
+    parser.add_argument('--db', required=True, help='SQLite index file')
+    parser.add_argument('--update', nargs='+', metavar='FOLDER', help='study folders to scan for new or changed trials')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, all cores by default')
+    parser.add_argument('--experiment')
+    parser.add_argument('--participant')
+    parser.add_argument('--sensor')
+    parser.add_argument('--channel', help='channel whose peak (largest absolute value) is compared with --above/--below')
+    parser.add_argument('--above', type=float)
+    parser.add_argument('--below', type=float)
+    args = parser.parse_args()
+
+    index = StudyIndex(args.db)
+    if args.update:
+        print("%i files indexed" % index.update(args.update, args.workers))
+    if not args.update or any(v is not None for v in (args.experiment, args.participant, args.sensor, args.channel)):
+        for row in index.find(args.experiment, args.participant, args.sensor, args.channel, args.above, args.below):
+            peak = ", peak %s %.3f" % (args.channel, row['channel_peak']) if args.channel else ""
+            print("%s: %i samples, %.2f s%s" % (row['path'], row['samples'], row['duration'], peak))
+    index.close()
@@ -0,0 +1,154 @@
+'''
+Offline detection of the synchronisation led pulse in recorded videos.
+The camera process turns the leds on at frame 30 and off at frame 60 of every video. This tool streams the
+decoded frames of a video from a frame source, computes the mean brightness of the led region of interest
+for whole batches of frames at once, and finds the on and off edges of the pulse with sub-frame precision
+by interpolating where the brightness crosses the middle between its dark (median) and lit (peak) levels.
+The edges are converted to common clock time with the frame timestamps and the camera clock mapping saved
+during the recording, and written with their offsets to the led commands in the trial metadata.
+Whole studies are processed in parallel, one video per worker process.
+
+Usage: python Instrumented_Object_Analysis_LED_Sync.py --roi x y width height folder_or_videos...
+'''
+import os
+import glob
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+from Instrumented_Object_GUI_Writer import load_trial, read_trial_metadata, update_trial_metadata
+from Instrumented_Object_GUI_Clock import device_to_host
+
+class ArrayFrameSource:
+    ''' Frame source over frames already in memory, an (N,height,width) array '''
+
+    def __init__(self, frames, batch=256):
+        self.frames = frames
+        self.batch = batch
+
+    def batches(self, roi):
+        x, y, w, h = roi
+        for start in range(0, len(self.frames), self.batch):
+            yield self.frames[start:start+self.batch, y:y+h, x:x+w]
+
+class FFmpegFrameSource:
+    ''' Frame source decoding a video with ffmpeg, only the region of interest is sent back in grey levels '''
+
+    def __init__(self, path, batch=256, ffmpeg='ffmpeg'):
+        self.path = path
+        self.batch = batch
+        self.ffmpeg = ffmpeg
+
+    def batches(self, roi):
+        x, y, w, h = roi
+        command = [self.ffmpeg, '-v', 'error', '-i', self.path, '-vf', 'crop=%i:%i:%i:%i' % (w, h, x, y),
+                   '-f', 'rawvideo', '-pix_fmt', 'gray', '-']
+        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        frameSize = w*h
+        try:
+            while True:
+                data = process.stdout.read(self.batch*frameSize)
+                n = len(data)//frameSize
+                if n == 0:
+                    break
+                yield np.frombuffer(data, dtype=np.uint8, count=n*frameSize).reshape(n, h, w)
+        finally:
+            process.stdout.close()
+            process.wait()
+
+def roi_brightness(source, roi):
+    ''' Mean brightness of the region of interest for every frame of the source '''
+    return np.concatenate([batch.reshape(len(batch), -1).mean(axis=1) for batch in source.batches(roi)])
+
+def find_edges(brightness, min_contrast=20):
+    '''
+    Returns the fractional frame positions of the first rising and the following falling edge of the
+    brightness, None for an edge that is not found. The dark level is the median of the brightness and the lit
+    level its peak, the pulse is short and lasts a few percent of the frames of a long video at most.
+    '''
+    if len(brightness) < 2:
+        return None, None
+    low, high = np.median(brightness), np.max(brightness)
+    if high - low < min_contrast:
+        return None, None
+    threshold = 0.5*(low + high)
+    above = brightness >= threshold
+    rising = np.flatnonzero(~above[:-1] & above[1:]) + 1
+    if len(rising) == 0:
+        return None, None
+    on = crossing(brightness, rising[0], threshold)
+    falling = np.flatnonzero(above[:-1] & ~above[1:]) + 1
+    falling = falling[falling > rising[0]]
+    off = crossing(brightness, falling[0], threshold) if len(falling) else None
+    return on, off
+
+def crossing(brightness, n, threshold):
+    # Linear interpolation between frame n-1 and n, the led switched during the exposure of the partly lit frame
+    b0, b1 = brightness[n-1], brightness[n]
+    return float(n - 1 + (threshold - b0)/(b1 - b0))
+
+def frames_path(videoPath):
+    ''' Finds the frame timestamps sidecar of a video, <exp>_<participant>_Camera_<n>[_<repeat>].inob '''
+    stem = os.path.splitext(videoPath)[0]
+    parts = stem.split('_')
+    for numbers in (1, 2):
+        candidate = '_'.join(parts[:-numbers] + ['Camera'] + parts[-numbers:]) + '.inob'
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def frame_times(framesPath, positions):
+    ''' Converts fractional frame positions to common clock time using the sidecar and the camera clock mapping '''
+    frames, info = load_trial(framesPath)
+    clock = read_trial_metadata(framesPath).get('camera_clock')
+    if clock is None or clock.get('offset') is None or len(frames) == 0:
+        return [None for p in positions]
+    times = device_to_host(frames['timestamp'], clock)
+    return [None if p is None else float(np.interp(p, np.arange(len(times)), times)) for p in positions]
+
+def process_video(videoPath, roi, source=None):
+    ''' Detects the led pulse of one video and saves it in the metadata of its trial '''
+    if source is None:
+        source = FFmpegFrameSource(videoPath)
+    on, off = find_edges(roi_brightness(source, roi))
+    result = {'video': videoPath, 'roi': list(roi), 'on_frame': on, 'off_frame': off}
+    framesPath = frames_path(videoPath)
+    if framesPath is not None:
+        result['on_time'], result['off_time'] = frame_times(framesPath, [on, off])
+        commands = read_trial_metadata(framesPath).get('led_commands', {})
+        for edge in ('on', 'off'):
+            if result[edge + '_time'] is not None and edge in commands:
+                result[edge + '_offset'] = result[edge + '_time'] - commands[edge]
+        update_trial_metadata(framesPath, {'led_sync': result})
+    return result
+
+def process_study(videos, roi, workers=None):
+    ''' Processes the videos in parallel, yields the results as they come '''
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(process_worker, [(v, roi) for v in videos]):
+            yield result
+
+def process_worker(args):
+    videoPath, roi = args
+    try:
+        return process_video(videoPath, roi)
+    except (OSError, ValueError) as e:
+        return {'video': videoPath, 'error': str(e)}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detect the synchronisation led pulse in recorded videos')
+    parser.add_argument('paths', nargs='+', help='videos or folders containing videos')
+    parser.add_argument('--roi', nargs=4, type=int, required=True, metavar=('X', 'Y', 'WIDTH', 'HEIGHT'))
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes, all cores by default')
+    args = parser.parse_args()
+    videos = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            videos.extend(sorted(glob.glob(os.path.join(path, '**', '*.h264'), recursive=True)))
+        else:
+            videos.append(path)
+    for result in process_study(videos, args.roi, args.workers):
+        if 'error' in result:
+            print("%s: %s" % (result['video'], result['error']))
+        else:
+            print("%s: on %s, off %s" % (result['video'], result['on_frame'], result['off_frame']))
@@ -0,0 +1,230 @@
+'''
+Loader of recorded sessions for the analysis of the trials.
+The files of each trial are found from the names given by the acquisition processes,
+<experiment>_<participant>_<sensor>_<trial>[_<repeat>].<csv|inob> with the sensors ft, ftlp, IMU and Camera
+(frame timestamps), and the video <experiment>_<participant>_<trial>[_<repeat>].h264. The experiment name is
+taken as the part before the first underscore.
+Columns are loaded lazily, when they are first used. Binary trial files are mapped in memory as they are.
+CSV files are parsed once, the rows of NaN padding left by older versions of the acquisition and an incomplete
+last line are removed, and every column is stored as a .npy file in a cache keyed by the path, size and
+modification time of the file. Reopening the trial maps the cached columns, without parsing the CSV again.
+The least recently used entries are removed once the cache is larger than its limit.
+
+Usage: python Instrumented_Object_Analysis_Session.py folder [--cache DIR] (lists the trials and fills the cache)
+'''
+import os
+import re
+import json
+import glob
+import time
+import shutil
+import hashlib
+import tempfile
+import argparse
+import numpy as np
+from Instrumented_Object_GUI_Writer import load_trial, read_trial_metadata, trial_has_records
+
+TRIAL_PATTERN = re.compile(r'^(?P<experiment>[^_]+)_(?P<participant>.+)_(?P<sensor>ft|ftlp|IMU|Camera)_'
+                           r'(?P<trial>-?\d+)(?:_(?P<repeat>\d+))?\.(?P<extension>csv|inob)$')
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'inob')
+
+def parse_trial_name(path):
+    ''' Returns (experiment, participant, sensor, trial, repeat) of a trial file, None if it is not one. repeat is 0 for the first recording '''
+    match = TRIAL_PATTERN.match(os.path.basename(path))
+    if match is None:
+        return None
+    return (match.group('experiment'), match.group('participant'), match.group('sensor'),
+            int(match.group('trial')), int(match.group('repeat') or 0))
+
+def parse_csv(path):
+    ''' Parses a trial CSV file, returns the header and the rows without NaN padding and incomplete last line '''
+    with open(path) as fileHandle:
+        header = fileHandle.readline().strip().split(',')
+        text = fileHandle.read()
+    # A line without its end of line was cut by a crash
+    text = text[:text.rfind('\n') + 1].replace('\r\n', ',').replace('\n', ',').rstrip(',')
+    values = np.fromstring(text, sep=',') if text else np.zeros(0)
+    columns = len(header)
+    data = values[:len(values) - len(values) % columns].reshape(-1, columns)
+    return header, data[~np.isnan(data).all(axis=1)]
+
+class TrialCache:
+    '''
+    Cache of the parsed columns of CSV trial files, one folder per file with a .npy file per column.
+    Entries are named after the path, size and modification time of the file, so that a file that changed
+    is parsed again. Once the cache is larger than max_bytes the least recently used entries are removed.
+    '''
+
+    def __init__(self, folder=DEFAULT_CACHE, max_bytes=2*1024**3):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+
+    def entry(self, path):
+        stat = os.stat(path)
+        key = "%s:%i:%i" % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        return os.path.join(self.folder, hashlib.sha1(key.encode()).hexdigest())
+
+    def columns(self, path):
+        ''' Names of the columns of a CSV trial file, the file is parsed and cached if it is not yet '''
+        entry = self.entry(path)
+        index = os.path.join(entry, 'columns.json')
+        if not os.path.exists(index):
+            self.store(path, entry)
+        # The time of last use decides which entries are removed first
+        os.utime(index)
+        with open(index) as fileHandle:
+            return json.load(fileHandle)
+
+    def column(self, path, name):
+        ''' Maps one column of a CSV trial file from the cache '''
+        columns = self.columns(path)
+        if name not in columns:
+            raise KeyError("%s has no column %s" % (path, name))
+        return np.load(os.path.join(self.entry(path), "c%i.npy" % columns.index(name)), mmap_mode='r')
+
+    def store(self, path, entry):
+        header, data = parse_csv(path)
+        # The entry is written aside and renamed, so that a partial entry is never used
+        temporary = tempfile.mkdtemp(dir=self.folder)
+        for i in range(len(header)):
+            np.save(os.path.join(temporary, "c%i.npy" % i), np.ascontiguousarray(data[:,i]))
+        with open(os.path.join(temporary, 'columns.json'), "w") as fileHandle:
+            json.dump(header, fileHandle)
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # Stored meanwhile by another process
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        ''' Removes the least recently used entries until the cache fits in max_bytes '''
+        entries = []
+        for item in os.scandir(self.folder):
+            index = os.path.join(item.path, 'columns.json')
+            if item.is_dir() and os.path.exists(index):
+                size = sum(f.stat().st_size for f in os.scandir(item.path))
+                entries.append((os.stat(index).st_mtime, size, item.path))
+        total = sum(size for used, size, entryPath in entries)
+        for used, size, entryPath in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entryPath, ignore_errors=True)
+            total = total - size
+
+class TrialData:
+    ''' Data of one sensor of a trial, data["fz"] loads the column when it is first used '''
+
+    def __init__(self, path, cache):
+        self.path = path
+        self.cache = cache
+        self.loaded = {}
+        self.records = None
+
+    @property
+    def columns(self):
+        if self.path.endswith('.inob'):
+            return list(self.binary().dtype.names)
+        return self.cache.columns(self.path)
+
+    @property
+    def metadata(self):
+        return read_trial_metadata(self.path)
+
+    def binary(self):
+        if self.records is None:
+            self.records, info = load_trial(self.path)
+        return self.records
+
+    def __getitem__(self, name):
+        if name not in self.loaded:
+            if self.path.endswith('.inob'):
+                self.loaded[name] = self.binary()[name]
+            else:
+                self.loaded[name] = self.cache.column(self.path, name)
+        return self.loaded[name]
+
+    def __len__(self):
+        return len(self[self.columns[0]])
+
+    def to_array(self):
+        ''' All the columns as a single (N,columns) float array '''
+        return np.column_stack([np.asarray(self[name], dtype=np.float64) for name in self.columns])
+
+class RecordedTrial:
+    ''' Files of one recording, trial["ft"] gives the TrialData of a sensor '''
+
+    def __init__(self, folder, experiment, participant, trial, repeat, cache):
+        self.folder = folder
+        self.experiment = experiment
+        self.participant = participant
+        self.trial = trial
+        self.repeat = repeat
+        self.cache = cache
+        self.files = {}
+
+    @property
+    def name(self):
+        number = "%i_%i" % (self.trial, self.repeat) if self.repeat else "%i" % self.trial
+        return "%s_%s_%s" % (self.experiment, self.participant, number)
+
+    @property
+    def sensors(self):
+        return sorted(self.files)
+
+    @property
+    def video(self):
+        ''' Path of the video of the recording, None if there is none '''
+        path = os.path.join(self.folder, self.name + '.h264')
+        return path if os.path.exists(path) else None
+
+    def __getitem__(self, sensor):
+        return TrialData(self.files[sensor], self.cache)
+
+    def __repr__(self):
+        return "<RecordedTrial %s: %s>" % (self.name, ', '.join(self.sensors))
+
+class RecordedSession:
+    ''' Trials found in a folder (and its subfolders), in the order of the experiment, participant, trial and repeat '''
+
+    def __init__(self, folder, cache=None):
+        self.folder = folder
+        self.cache = cache if cache is not None else TrialCache()
+        trials = {}
+        for path in glob.glob(os.path.join(folder, '**', '*_*'), recursive=True):
+            name = parse_trial_name(path)
+            # Files prepared for a trial that was never recorded are left behind by a crash
+            if name is None or not trial_has_records(path):
+                continue
+            experiment, participant, sensor, trial, repeat = name
+            key = (os.path.dirname(path), experiment, participant, trial, repeat)
+            if key not in trials:
+                trials[key] = RecordedTrial(os.path.dirname(path), experiment, participant, trial, repeat, self.cache)
+            trials[key].files[sensor] = path
+        self.trials = [trials[key] for key in sorted(trials, key=lambda k: k[1:] + k[:1])]
+
+    def find(self, experiment=None, participant=None, trial=None, repeat=None):
+        ''' Trials matching all the values given '''
+        return [t for t in self.trials if (experiment is None or t.experiment == experiment) and
+                (participant is None or t.participant == participant) and
+                (trial is None or t.trial == trial) and (repeat is None or t.repeat == repeat)]
+
+    def __iter__(self):
+        return iter(self.trials)
+
+    def __len__(self):
+        return len(self.trials)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List the trials of a session and fill the cache of parsed CSV files')
+    parser.add_argument('folder', help='folder of the recorded trials')
+    parser.add_argument('--cache', default=DEFAULT_CACHE, help='cache folder, %s by default' % DEFAULT_CACHE)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    session = RecordedSession(args.folder, TrialCache(args.cache))
+    for trial in session:
+        rows = ', '.join("%s %i rows" % (sensor, len(trial[sensor])) for sensor in trial.sensors)
+        print("%s: %s%s" % (trial.name, rows, ", video" if trial.video else ""))
+    print("%i trials loaded in %.3f s" % (len(session), time.perf_counter() - start))
@@ -0,0 +1,147 @@
+'''
+Seek index of the recorded .h264 videos, which have no container and no index of their own.
+The index gives the byte position of every frame in the video (where the decoder can start for it, the
+SPS/PPS headers before a key frame included) and whether it is a key frame. It is saved in the frame
+timestamps sidecar during the recording, or is built by scanning the NAL units of the video for older
+recordings: the start codes are found with numpy on the mapped file, each frame starts with a slice whose
+first_mb_in_slice is 0. The frames are linked in order to the rows of the sidecar, so a frame can be found
+from a time of the common clock and decoded from the closest key frame before it, instead of from the
+start of the video (requires ffmpeg).
+
+Usage: python Instrumented_Object_Analysis_Video.py video.h264 [--time T --output frame.pgm]
+'''
+import os
+import time
+import argparse
+import subprocess
+import numpy as np
+from Instrumented_Object_GUI_Writer import load_trial, read_trial_metadata
+from Instrumented_Object_GUI_Clock import device_to_host
+from Instrumented_Object_Analysis_LED_Sync import frames_path
+
+# NAL unit types of the slices, non IDR and IDR
+NAL_SLICE = 1
+NAL_IDR = 5
+
+def find_start_codes(data, chunk=1 << 26):
+    ''' Positions of the 00 00 01 start codes in a uint8 array, found by chunks to bound the memory used '''
+    positions = []
+    for start in range(0, max(0, len(data) - 2), chunk):
+        block = np.asarray(data[start:start+chunk+2])
+        found = np.flatnonzero((block[:-2] == 0) & (block[1:-1] == 0) & (block[2:] == 1))
+        positions.append(found + start)
+    return np.concatenate(positions) if positions else np.zeros(0, dtype=np.int64)
+
+def scan_h264(path):
+    '''
+    Scans the NAL units of an Annex B H.264 stream, returns the byte position of each frame (its first
+    NAL unit after the previous frame, headers included), its size and whether it is a key frame
+    '''
+    data = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, dtype=np.uint8)
+    codes = find_start_codes(data)
+    codes = codes[codes + 4 < len(data)]
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=bool)
+    # A 4 byte start code has one more zero in front
+    starts = codes - ((codes > 0) & (data[np.maximum(codes - 1, 0)] == 0))
+    types = data[codes + 3] & 0x1F
+    slices = (types == NAL_SLICE) | (types == NAL_IDR)
+    # first_mb_in_slice is coded ue(v), its first bit is 1 when it is 0
+    first = slices & (data[codes + 4] & 0x80 > 0)
+    # A frame starts right after the last slice of the previous frame
+    index = np.arange(len(codes))
+    lastSlice = np.maximum.accumulate(np.where(slices, index, -1))
+    frames = np.flatnonzero(first)
+    unitStart = np.concatenate([[0], lastSlice[frames[1:] - 1] + 1]) if len(frames) else frames
+    positions = starts[unitStart]
+    sizes = np.diff(np.concatenate([positions, [len(data)]]))
+    return positions, sizes, types[frames] == NAL_IDR
+
+class VideoIndex:
+    '''
+    Index of one recorded video: position, size, key frame flag and GPU timestamp of each frame, and the
+    common clock time of each frame when the camera clock mapping was saved with the recording
+    '''
+
+    def __init__(self, videoPath, framesPath=None):
+        self.videoPath = videoPath
+        self.framesPath = framesPath if framesPath is not None else frames_path(videoPath)
+        frames, info = load_trial(self.framesPath) if self.framesPath else (None, {})
+        self.resolution = info.get('metadata', {}).get('resolution')
+        if frames is not None and 'position' in frames.dtype.names and (frames['position'] >= 0).all():
+            self.positions = np.array(frames['position'])
+            self.keys = np.array(frames['key'], dtype=bool)
+            self.sizes = np.diff(np.concatenate([self.positions, [os.path.getsize(videoPath)]]))
+            self.source = 'recording'
+        else:
+            self.positions, self.sizes, self.keys = scan_h264(videoPath)
+            self.source = 'scan'
+        self.timestamps = None
+        self.times = None
+        if frames is not None:
+            # Frames of the sidecar and of the video are in the same order, a truncated end is left out
+            n = min(len(frames), len(self.positions))
+            if n != len(frames) or n != len(self.positions):
+                print("%s: %i frames in the video, %i in %s" % (videoPath, len(self.positions), len(frames), self.framesPath))
+            self.positions, self.sizes, self.keys = self.positions[:n], self.sizes[:n], self.keys[:n]
+            self.timestamps = np.array(frames['timestamp'][:n])
+            clock = read_trial_metadata(self.framesPath).get('camera_clock')
+            if clock is not None and clock.get('offset') is not None:
+                self.times = device_to_host(self.timestamps, clock)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nearest(self, hostTime):
+        ''' Number of the frame closest to a time of the common clock '''
+        if self.times is None:
+            raise ValueError("%s: no frame times, the camera clock mapping is missing" % self.videoPath)
+        k = int(np.clip(np.searchsorted(self.times, hostTime), 1, len(self.times) - 1))
+        return k - 1 if hostTime - self.times[k-1] < self.times[k] - hostTime else k
+
+    def key_frame(self, frame):
+        ''' Number of the last key frame at or before a frame '''
+        keys = np.flatnonzero(self.keys[:frame+1])
+        if len(keys) == 0:
+            raise ValueError("%s: no key frame before frame %i" % (self.videoPath, frame))
+        return int(keys[-1])
+
+    def segment(self, frame):
+        ''' Bytes of the video from the closest key frame before a frame to the end of that frame '''
+        key = self.key_frame(frame)
+        start = self.positions[key]
+        with open(self.videoPath, "rb") as fileHandle:
+            fileHandle.seek(start)
+            return fileHandle.read(self.positions[frame] + self.sizes[frame] - start), frame - key
+
+    def read_frame(self, frame, resolution=None, ffmpeg='ffmpeg'):
+        ''' Decodes one frame in grey levels, only the frames from the closest key frame before it are decoded '''
+        width, height = resolution or self.resolution
+        data, skip = self.segment(frame)
+        command = [ffmpeg, '-v', 'error', '-f', 'h264', '-i', '-', '-f', 'rawvideo', '-pix_fmt', 'gray', '-']
+        output = subprocess.run(command, input=data, stdout=subprocess.PIPE, check=True).stdout
+        frames = np.frombuffer(output, dtype=np.uint8).reshape(-1, height, width)
+        if len(frames) <= skip:
+            raise ValueError("%s: frame %i could not be decoded" % (self.videoPath, frame))
+        return frames[skip]
+
+    def read_at(self, hostTime, resolution=None, ffmpeg='ffmpeg'):
+        ''' Decodes the frame closest to a time of the common clock, returns its number and the image '''
+        frame = self.nearest(hostTime)
+        return frame, self.read_frame(frame, resolution, ffmpeg)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Index a recorded video and extract the frame at a given time')
+    parser.add_argument('video', help='.h264 video')
+    parser.add_argument('--time', type=float, help='time of the common clock (monotonic) of the frame to extract')
+    parser.add_argument('--output', default='frame.pgm', help='image file of the extracted frame (PGM)')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    index = VideoIndex(args.video)
+    print("%s: %i frames, %i key frames, index from the %s in %.3f s" %
+          (args.video, len(index), index.keys.sum(), index.source, time.perf_counter() - start))
+    if args.time is not None:
+        frame, image = index.read_at(args.time)
+        with open(args.output, "wb") as fileHandle:
+            fileHandle.write(b"P5 %i %i 255\n" % (image.shape[1], image.shape[0]) + image.tobytes())
+        print("Frame %i written to %s" % (frame, args.output))
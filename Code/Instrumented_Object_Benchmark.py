@@ -0,0 +1,386 @@
+'''
+Benchmark of the acquisition pipeline, run with the simulated devices so it works on any Linux machine.
+It measures the parsing throughput of the ATI frames, the cost of sending live samples to the GUI (and
+while the GUI is stalled), the end of trial write, the processing stage of the forces, the reduction of the plot windows and the GUI
+plot update, the memory and disk used per trial minute, and the ATI sample rate at which samples start
+being dropped (the whole ATIMonitorThread is driven by the fake controller at rising rates), and how late
+the contact events are detected after the simulated grasps. Results are saved as JSON, and can be compared
+with a previous run to catch regressions.
+
+Usage: python Instrumented_Object_Benchmark.py --output results.json [--compare previous.json]
+'''
+import os
+import io
+import sys
+import glob
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from ATI_Mini40_data_bank import ati_mini40_data_bank, split_ati_frames, parse_ati_frames, SCALE
+from Instrumented_Object_GUI_Buffer import TrialBuffer
+from Instrumented_Object_GUI_Writer import TrialWriter, TRIAL_FILE_TYPES, load_trial, read_trial_metadata
+from Instrumented_Object_GUI_Stream import SharedRingBuffer, StreamReader
+from Instrumented_Object_GUI_Plot import PlotModel
+from Instrumented_Object_GUI_Filter import ForceProcessor
+
+def synthetic_frames(n, seed=0):
+    rng = np.random.RandomState(seed)
+    counts = rng.randint(-20000, 20000, (n, 6))
+    return ''.join('0,%d,%d,%d,%d,%d,%d\r\n' % tuple(r) for r in counts.tolist()).encode()
+
+def bench_parse(frames=50000):
+    ''' Frames parsed per second, line by line as before and in bulk from a byte buffer '''
+    data = synthetic_frames(frames)
+    port = io.BytesIO(data)
+    start = time.perf_counter()
+    for i in range(frames):
+        ati_mini40_data_bank(port)
+    legacy = time.perf_counter() - start
+
+    buffer = bytearray()
+    parsed = 0
+    start = time.perf_counter()
+    for offset in range(0, len(data), 4096):
+        buffer += data[offset:offset+4096]
+        values, dropped = parse_ati_frames(split_ati_frames(buffer))
+        parsed = parsed + len(values)
+    bulk = time.perf_counter() - start
+    return {'legacy_frames_per_s': frames/legacy, 'bulk_frames_per_s': parsed/bulk}
+
+def drain_queue(q, n):
+    for i in range(n):
+        q.get()
+
+def bench_ipc(samples=20000, block=10):
+    ''' Producer cost per live sample, one tuple per sample in a Queue as before, or blocks in the ring buffer '''
+    q = multiprocessing.Queue()
+    consumer = multiprocessing.Process(target=drain_queue, args=(q, samples))
+    consumer.start()
+    row = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 1.0)
+    start = time.perf_counter()
+    for i in range(samples):
+        q.put(row)
+    queueCost = time.perf_counter() - start
+    consumer.join()
+
+    ring = SharedRingBuffer(4096, 7)
+    rows = np.ones((block, 7))
+    start = time.perf_counter()
+    for i in range(samples//block):
+        ring.write(rows)
+    ringCost = time.perf_counter() - start
+    ring.close()
+    ring.unlink()
+    return {'queue_us_per_sample': 1e6*queueCost/samples, 'ring_us_per_sample': 1e6*ringCost/samples}
+
+def bench_stalled_reader(stall=30.0, rate=200, window=10.0, block=10):
+    ''' Producer cost while the GUI is stalled for stall seconds, and cost of the first read once it resumes '''
+    ring = SharedRingBuffer(4096, 7)
+    reader = StreamReader(ring, max_rows=int(window*rate) + 1)
+    rows = np.ones((block, 7))
+    blocks = int(stall*rate)//block
+    start = time.perf_counter()
+    for i in range(blocks):
+        ring.write(rows)
+    writeCost = time.perf_counter() - start
+    start = time.perf_counter()
+    n = len(reader.read())
+    readCost = time.perf_counter() - start
+    result = {'write_us_per_sample': 1e6*writeCost/(blocks*block), 'read_ms': 1e3*readCost,
+              'rows_read': n, 'lost': reader.lost, 'dropped': reader.dropped}
+    ring.close()
+    ring.unlink()
+    return result
+
+def bench_trial_write(folder, rate=200, seconds=60):
+    '''
+    For a trial of the given length: time the stop path takes in the acquisition loop, time until the
+    file is complete on disk, file size per minute and peak memory of the trial buffer
+    '''
+    results = {}
+    # Forces and torques drifting by a few controller counts per sample, as recorded from the controller
+    rng = np.random.RandomState(0)
+    counts = np.cumsum(rng.randint(-3, 4, (rate*seconds, 6)), axis=0) + rng.randint(-2000, 2000, 6)
+    rows = np.column_stack([1e4 + np.arange(rate*seconds)/rate, counts/SCALE])
+    metadata = {'divisors': [None] + SCALE.tolist()}
+    for name, fileType in TRIAL_FILE_TYPES.items():
+        path = os.path.join(folder, 'bench_%s.%s' % (name, fileType.extension))
+        writer = TrialWriter()
+        writer.start()
+        writer.open(path, ["Time","fx","fy","fz","tx","ty","tz"], fileType, metadata)
+        buffer = TrialBuffer(7, chunk_rows=400)
+        peak = 0
+        for start in range(0, len(rows), 10):
+            buffer.append(rows[start:start+10])
+            peak = max(peak, len(buffer.chunks))
+            for block in buffer.take_full():
+                writer.write(block)
+        start = time.perf_counter()
+        for block in buffer.take_all():
+            writer.write(block)
+        writer.close()
+        stopPath = time.perf_counter() - start
+        writer.stop()
+        complete = time.perf_counter() - start
+        minutes = seconds/60
+        results[name] = {'stop_path_s': stopPath, 'file_complete_s': complete,
+                         'file_bytes_per_minute': os.path.getsize(path)/minutes}
+        if fileType.extension == 'inob':
+            start = time.perf_counter()
+            load_trial(path)
+            results[name]['load_s'] = time.perf_counter() - start
+        results['buffer_peak_bytes'] = peak*buffer.chunk_rows*7*8
+    return results
+
+def bench_plot_model(updates=200, width=800):
+    ''' Cost of reading the new rows and reducing a plot window to the plot width, for short and long windows '''
+    results = {}
+    for window in (10, 60):
+        plot = PlotModel(["Time","fx","fy","fz","tx","ty","tz"], window, 200)
+        rows = np.random.RandomState(0).standard_normal((200*window, 7))
+        rows[:,0] = np.arange(len(rows))/200
+        plot.append(rows)
+        cost = 0.0
+        for i in range(updates):
+            block = rows[:10].copy()
+            block[:,0] = rows[-1,0] + (i*10 + np.arange(1, 11))/200
+            start = time.perf_counter()
+            plot.append(block)
+            plot.channel("fz", width)
+            cost = cost + time.perf_counter() - start
+        results['window_%is_us' % window] = 1e6*cost/updates
+    return results
+
+def bench_filter(updates=2000, block=10):
+    ''' Cost of the processing stage of the ATI process per sample, for blocks of the given size '''
+    processor = ForceProcessor()
+    rows = np.random.RandomState(0).standard_normal((block, 7))
+    start = time.perf_counter()
+    for i in range(updates):
+        rows[:,0] = (i*block + np.arange(block))/200
+        processor.process(rows)
+    return {'us_per_sample': 1e6*(time.perf_counter() - start)/(updates*block)}
+
+def bench_gui_update(updates=200):
+    ''' Cost of one live plot update, skipped when the GUI libraries are not installed '''
+    try:
+        from Instrumented_Object_GUI import DataMonitor
+    except ImportError as e:
+        return {'skipped': str(e)}
+    class Line:
+        def setData(self, *args):
+            pass
+    class Plot:
+        def width(self):
+            return 800
+    monitor = DataMonitor.__new__(DataMonitor)
+    class Session:
+        ATIStream = SharedRingBuffer(4096, 7)
+        ATIProcessedStream = SharedRingBuffer(4096, len(ForceProcessor.header))
+        IMUStream = SharedRingBuffer(4096, 7)
+    monitor.session = session = Session()
+    monitor.ATIPlot = PlotModel(["Time","fx","fy","fz","tx","ty","tz"], 10, 200)
+    monitor.ATIProcessedPlot = PlotModel(ForceProcessor.header, 10, 200)
+    monitor.IMUPlot = PlotModel(["Time","Eula1","Eula2","Eula3","linA1","linA2","linA3"], 10, 100)
+    monitor.ATIReader = StreamReader(session.ATIStream, max_rows=monitor.ATIPlot.capacity)
+    monitor.ATIProcessedReader = StreamReader(session.ATIProcessedStream, max_rows=monitor.ATIProcessedPlot.capacity)
+    monitor.IMUReader = StreamReader(session.IMUStream, max_rows=monitor.IMUPlot.capacity)
+    monitor.ATIChannel, monitor.IMUChannel = "fz", "linA3"
+    monitor.ATIWindowPlot = monitor.IMUWindowPlot = Plot()
+    monitor.ATIDataLine = monitor.IMUDataLine = Line()
+    monitor.startup = None
+    processor = ForceProcessor()
+    rows = np.ones((4, 7))
+    cost = 0.0
+    for i in range(updates):
+        rows[:,0] = i*4 + np.arange(4)
+        session.ATIStream.write(rows)
+        session.ATIProcessedStream.write(processor.process(rows))
+        session.IMUStream.write(rows[:2])
+        start = time.perf_counter()
+        monitor.updatePlotData()
+        cost = cost + time.perf_counter() - start
+    for stream in (session.ATIStream, session.ATIProcessedStream, session.IMUStream):
+        stream.close()
+        stream.unlink()
+    return {'update_us': 1e6*cost/updates}
+
+def run_ati_trial(folder, rate, seconds):
+    ''' Runs ATIMonitorThread on the simulated controller for one trial, returns the rows recorded per second '''
+    from Instrumented_Object_GUI_Utils import ATIMonitorThread
+    from Instrumented_Object_GUI_Sim import ATISimulator
+    simulator = ATISimulator(rate)
+    port = simulator.start()
+    events = [multiprocessing.Event() for i in range(6)]
+    recordingEvent, setEvent, stopEvent, biasEvent, endEvent, repeatEvent = events
+    stream = SharedRingBuffer(8192, 7)
+    msg_q = multiprocessing.Queue()
+    error_q = multiprocessing.Queue()
+    monitor = ATIMonitorThread(stream, msg_q, error_q, recordingEvent, setEvent, stopEvent, biasEvent, endEvent,
+                               repeatEvent, port, 115200, file_format='binary', sample_rate=rate)
+    monitor.start()
+    for message in ('P', 'bench%i' % rate, folder):
+        msg_q.put(message)
+    setEvent.set()
+    # Waiting for the end of the initialisation of the controller
+    while stream.seq[0] == 0 and monitor.is_alive():
+        time.sleep(0.05)
+    recordingEvent.set()
+    start = time.monotonic()
+    time.sleep(seconds)
+    stopEvent.set()
+    duration = time.monotonic() - start
+    time.sleep(0.5)
+    monitor.join(5)
+    simulator.terminate()
+    stream.close()
+    stream.unlink()
+    data, info = load_trial(os.path.join(folder, 'bench%i_P_ft_0.inob' % rate))
+    intervals = np.diff(data['Time'])
+    return {'rows_per_s': len(data)/duration,
+            'received_fraction': len(data)/(rate*duration),
+            'interval_p99_ms': 1e3*float(np.percentile(intervals, 99)) if len(intervals) else None}
+
+def bench_drop_rate(folder, rates, seconds=3, tolerance=0.01):
+    ''' Drives the ATI process at rising rates, reports the first rate losing more than tolerance of the samples '''
+    results = {'rates': {}, 'drop_rate_hz': None}
+    for rate in rates:
+        trial = run_ati_trial(folder, rate, seconds)
+        results['rates'][str(rate)] = trial
+        print("  %i Hz: %.1f%% received" % (rate, 100*trial['received_fraction']))
+        if trial['received_fraction'] < 1 - tolerance:
+            results['drop_rate_hz'] = rate
+            break
+    return results
+
+def bench_contact(folder, seconds=11, rate=200, margin=0.5):
+    '''
+    Lets the contact detector start and stop the trials on the simulated grasps, and compares the event markers
+    with the times the simulated force crossed the thresholds: error of the marker times, and delay from the
+    crossing to the detection
+    '''
+    from Instrumented_Object_GUI_Utils import ATIMonitorThread
+    from Instrumented_Object_GUI_Sim import ATISimulator, grasp_profile
+    simulator = ATISimulator(rate)
+    port = simulator.start()
+    events = [multiprocessing.Event() for i in range(7)]
+    recordingEvent, setEvent, stopEvent, biasEvent, endEvent, repeatEvent, autoEvent = events
+    stream = SharedRingBuffer(8192, 7)
+    msg_q = multiprocessing.Queue()
+    error_q = multiprocessing.Queue()
+    contact = {'channel': 'fz', 'onset': 1.0, 'release': 0.5, 'lift': 5.0}
+    monitor = ATIMonitorThread(stream, msg_q, error_q, recordingEvent, setEvent, stopEvent, biasEvent, endEvent,
+                               repeatEvent, port, 115200, file_format='binary', sample_rate=rate, contact=contact,
+                               autoTrigger=autoEvent, pre_event=margin, post_event=margin)
+    monitor.start()
+    for message in ('P', 'contact', folder):
+        msg_q.put(message)
+    setEvent.set()
+    while stream.seq[0] == 0 and monitor.is_alive():
+        time.sleep(0.05)
+    # The simulated controller is biased between two grasps, so that the force is zero at rest
+    time.sleep(np.mod(3.0 - time.monotonic(), 5.0))
+    biasEvent.set()
+    while biasEvent.is_set() and monitor.is_alive():
+        time.sleep(0.01)
+    autoEvent.set()
+    time.sleep(seconds)
+    autoEvent.clear()
+    stopEvent.set()
+    time.sleep(0.5)
+    monitor.join(5)
+    simulator.terminate()
+    stream.close()
+    stream.unlink()
+    thresholds = {'grasp': contact['onset'], 'lift': contact['lift'], 'release': contact['release']}
+    errors, delays, trials = [], [], 0
+    for path in sorted(glob.glob(os.path.join(folder, 'contact_P_ft_*.inob'))):
+        data, info = load_trial(path)
+        markers = read_trial_metadata(path).get('events', [])
+        if not markers:
+            continue
+        trials = trials + 1
+        rest = float(np.median(data['fz'][data['Time'] < markers[0]['time'] - 0.1]))
+        for marker in markers:
+            # Crossing of the threshold by the simulated force closest to the marker, on a 0.1 ms grid
+            t = marker['time'] + np.arange(-0.1, 0.1, 1e-4)
+            above = (grasp_profile(t) + rest > thresholds[marker['event']]).astype(int)
+            crossed = np.flatnonzero(np.diff(above) == (-1 if marker['event'] == 'release' else 1)) + 1
+            if len(crossed) == 0:
+                continue
+            physical = t[crossed[np.argmin(np.abs(t[crossed] - marker['time']))]]
+            errors.append(marker['time'] - physical)
+            delays.append(marker['time'] + marker['latency'] - physical)
+    if not errors:
+        return {'trials': trials, 'events': 0}
+    return {'trials': trials, 'events': len(errors),
+            'marker_error_ms': 1e3*float(np.mean(np.abs(errors))),
+            'marker_error_max_ms': 1e3*float(np.max(np.abs(errors))),
+            'delay_ms': 1e3*float(np.mean(delays)),
+            'delay_max_ms': 1e3*float(np.max(delays))}
+
+def flatten(results, prefix=''):
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+def compare(results, previous, tolerance):
+    ''' Prints the change of every metric, returns the names of the metrics that got worse by more than tolerance '''
+    new = flatten(results['results'])
+    old = flatten(previous['results'])
+    regressions = []
+    for name in sorted(set(new) & set(old)):
+        if old[name] == 0:
+            continue
+        ratio = new[name]/old[name]
+        # Throughputs and rates should go up, costs should go down
+        higherIsBetter = name.endswith('_per_s') or name.endswith('fraction') or name.endswith('drop_rate_hz')
+        worse = ratio < 1 - tolerance if higherIsBetter else ratio > 1 + tolerance
+        print("%-45s %12.4g -> %12.4g  (x%.2f)%s" % (name, old[name], new[name], ratio, '  REGRESSION' if worse else ''))
+        if worse:
+            regressions.append(name)
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the acquisition pipeline with simulated devices')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='previous results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative change reported as a regression')
+    parser.add_argument('--rates', type=int, nargs='+', default=[200, 500, 1000, 2000, 5000, 10000])
+    parser.add_argument('--seconds', type=float, default=3, help='length of the trials at each rate')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    results = {}
+    try:
+        print("Parsing"); results['parse'] = bench_parse()
+        print("Live data IPC"); results['ipc'] = bench_ipc()
+        print("Stalled GUI"); results['stalled_reader'] = bench_stalled_reader()
+        print("End of trial write"); results['trial_write'] = bench_trial_write(folder)
+        print("Filter"); results['filter'] = bench_filter()
+        print("Plot model"); results['plot_model'] = bench_plot_model()
+        print("GUI update"); results['gui_update'] = bench_gui_update()
+        print("Drop rate"); results['drop_rate'] = bench_drop_rate(folder, args.rates, args.seconds)
+        print("Contact detection"); results['contact'] = bench_contact(folder)
+    finally:
+        shutil.rmtree(folder)
+    output = {'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': platform.machine(),
+                       'node': platform.node(), 'python': platform.python_version(), 'numpy': np.__version__,
+                       'cpus': os.cpu_count()},
+              'results': results}
+    with open(args.output, 'w') as fileHandle:
+        json.dump(output, fileHandle, indent=1)
+    print(json.dumps(results, indent=1))
+    if args.compare:
+        with open(args.compare) as fileHandle:
+            regressions = compare(output, json.load(fileHandle), args.tolerance)
+        sys.exit(1 if regressions else 0)
@@ -3,78 +3,59 @@
 # # Date: August 2021
 # # Note: see git repo for commit history 
 
-import random, sys
+import random, sys, time, json, argparse
+# Launch time of the GUI, the startup breakdown is measured from here
+LAUNCH_TIME = time.monotonic()
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 import PyQt5.QtWidgets as QtWidgets
-import pyqtgraph as pg
 import queue
 from random import randint
 #from ComMonitor import ComMonitorThread
-import serial
-import time
 import os
 import csv
 #from multiprocessing import Process, Event, Queue, Pipe
 import multiprocessing
 import threading
-from picamera import PiCamera
-from gpiozero import LED
-from Instrumented_Object_GUI_IMU import IMUMonitorThread
-from Instrumented_Object_GUI_Utils import ATIMonitorThread
-from Instrumented_Object_GUI_Camera import CameraMonitorThread
+from Instrumented_Object_GUI_Session import AcquisitionSession, CAMERA_PRESETS
+from Instrumented_Object_GUI_Control import StartupTimer
+from Instrumented_Object_GUI_Plot import PlotModel
+from Instrumented_Object_GUI_Stream import StreamReader, DROP_OLDEST, POLICIES
+from Instrumented_Object_GUI_Filter import ForceProcessor
+from Instrumented_Object_GUI_Scheduler import TrialScheduler, load_protocol
+
+def load_pyqtgraph():
+    ''' Imports pyqtgraph, which is slow to import, once the acquisition processes are started '''
+    import pyqtgraph
+    return pyqtgraph
 
 class DataMonitor(QtWidgets.QMainWindow):
-    def __init__(self):
+    def __init__(self, refresh_interval=50, plot_window=10.0, software_bias=None, live_policy=DROP_OLDEST, live_factor=1,
+                 contact=None, pre_event=1.0, post_event=1.0, file_format='csv'):
+        '''
+        The plots are refreshed every refresh_interval ms and show the last plot_window seconds.
+        The live rows are read with the StreamReader policy live_policy (one row out of live_factor when
+        decimating), at most a plot window of rows is taken at each refresh.
+        With software_bias (seconds), the bias button removes the mean of the last software_bias seconds
+        of ATI samples instead of biasing the controller.
+        With contact (ContactDetector settings), the grasp events are detected on the forces and saved in the
+        trial metadata, and the trials can be started and stopped by the grasps, with pre_event seconds of
+        forces before the grasp and post_event seconds after the release.
+        The trials are written in file_format, 'csv', 'binary' or 'compressed'.
+        '''
         super().__init__()
-        # Creating all the required processes and events for the different processes that will run in parallel
-        self.ATIData_q          = multiprocessing.Queue()
-        self.ATIMsg_q           = multiprocessing.Queue()
-        self.ATIError_q         = multiprocessing.Queue()
-        self.IMUData_q          = multiprocessing.Queue()
-        self.IMUMsg_q           = multiprocessing.Queue()
-        self.cameraMsg_q        = multiprocessing.Queue()
-
-        self.dataRecordingEvent = multiprocessing.Event()
-        self.setEvent           = multiprocessing.Event()
-        self.stopEvent          = multiprocessing.Event()
-        self.biasEvent          = multiprocessing.Event()
-        self.endEvent           = multiprocessing.Event()
-        self.previewEvent       = multiprocessing.Event()
-        self.repeatEvent        = multiprocessing.Event()
-        
-        self.led0 = LED(23)
-        self.led1 = LED(24)
-
-        self.ATIMonitor         = ATIMonitorThread(self.ATIData_q,
-                                self.ATIMsg_q,
-                                self.ATIError_q,
-                                self.dataRecordingEvent,
-                                self.setEvent,
-                                self.stopEvent,
-                                self.biasEvent,
-                                self.endEvent,
-                                self.repeatEvent,
-                                "/dev/ttyUSB0",
-                                115200)
-        
-        self.IMUMonitor         = IMUMonitorThread(self.IMUData_q, self.IMUMsg_q,
-                                self.setEvent,
-                                self.dataRecordingEvent,
-                                self.stopEvent,
-                                self.repeatEvent)
-
-        self.CameraMonitor      = CameraMonitorThread(self.setEvent,
-                                self.dataRecordingEvent,
-                                self.previewEvent,
-                                self.stopEvent,
-                                self.cameraMsg_q,
-                                self.led0,
-                                self.led1)
-
-        self.ATIMonitor.start()
-        self.IMUMonitor.start()
-        self.CameraMonitor.start()
+        self.startup = StartupTimer('GUI', LAUNCH_TIME)
+        self.startup.mark('imports')
+        # The processes, streams and events of the acquisition, the devices are initialised in parallel
+        # by the processes while the window is built
+        self.session = AcquisitionSession(software_bias=software_bias, file_format=file_format, contact=contact,
+                                          pre_event=pre_event, post_event=post_event)
+        self.session.start()
+        self.ATIMonitor = self.session.ATIMonitor
+        self.IMUMonitor = self.session.IMUMonitor
+        self.startup.mark('processes')
+        self.pg = load_pyqtgraph()
+        self.startup.mark('pyqtgraph')
 
         # Creating graphical interfaces
         self.title = 'Instrumented object graphical interface'
@@ -85,53 +66,50 @@ class DataMonitor(QtWidgets.QMainWindow):
         self.trialNumber = 0
         self.setWindowTitle(self.title)
         self.setGeometry(self.left, self.top, self.width, self.height)
-        self.ATIx = list(range(100))  # 100 time points
-        self.ATIy = [randint(0,100) for _ in range(100)]  # 100 data points
-        self.IMUx = list(range(100))  # 100 time points
-        print(self.IMUx[1:])
-        self.IMUy = [randint(0,100) for _ in range(100)]  # 100 data points
-        self.IMUtime = 0
-        self.IMUdata = 0
-        self.ATItime = 0
-        self.ATIdata = 0
-        self.pen = pg.mkPen(color=(255, 0, 0))
-        self.forcePen = pg.mkPen(color=(255,255,0))
+        # Live data of the plot windows, any channel of the ATI and IMU rows can be shown
+        self.ATIPlot = PlotModel(self.ATIMonitor.header, plot_window, self.ATIMonitor.sample_rate)
+        self.ATIProcessedPlot = PlotModel(ForceProcessor.header, plot_window, self.ATIMonitor.sample_rate)
+        self.IMUPlot = PlotModel(self.IMUMonitor.header, plot_window, self.IMUMonitor.sample_rate)
+        self.ATIChannel = "fz"
+        self.IMUChannel = self.IMUMonitor.header[-1]
+        # Readers of the shared ring buffers, rows that do not fit in the plots are dropped and counted
+        self.ATIReader = StreamReader(self.session.ATIStream, live_policy, self.ATIPlot.capacity, live_factor)
+        self.ATIProcessedReader = StreamReader(self.session.ATIProcessedStream, live_policy, self.ATIProcessedPlot.capacity, live_factor)
+        self.IMUReader = StreamReader(self.session.IMUStream, live_policy, self.IMUPlot.capacity, live_factor)
+        # Protocol of back to back trials started from the GUI
+        self.scheduler = None
+        # Last errors reported by the processes, shown under the health of the processes
+        self.errorLines = []
+        self.pen = self.pg.mkPen(color=(255, 0, 0))
+        self.forcePen = self.pg.mkPen(color=(255,255,0))
         self.initUI()
         # ... init continued ...
         self.timer = QTimer()
-        #self.timer.setInterval(0.5)
+        self.timer.setInterval(refresh_interval)
         self.timer.timeout.connect(self.updatePlotData)
         self.timer.start()
+        self.healthTimer = QTimer()
+        self.healthTimer.setInterval(1000)
+        self.healthTimer.timeout.connect(self.updateHealth)
+        self.healthTimer.start()
         self.show()
-
-    def get_all_from_queue(self,Q):
-        """ Empties queue of data
-        """
-        try:
-            while True:
-                yield Q.get_nowait( )
-        except queue.Empty:
-            return
+        self.startup.mark('window')
 
     def read_ATI_data(self):
-        """ Called periodically by the update timer to read data
-            from the ATI process.
+        """ Called periodically by the update timer to read the rows
+            [Time,fx,fy,fz,tx,ty,tz] written by the ATI process since the last call.
         """
-        qdata = list(self.get_all_from_queue(self.ATIData_q))
+        return self.ATIReader.read()
 
-        if len(qdata) > 0:
-            self.ATIdata = qdata[-1][2]
-            self.ATItime = qdata[-1][6]
+    def read_ATI_processed_data(self):
+        """ Rows [Time,fx_lp,fy_lp,fz_lp,tx_lp,ty_lp,tz_lp,F,dF] of the processing stage of the ATI process """
+        return self.ATIProcessedReader.read()
 
     def read_IMU_data(self):
-        """ Called periodically by the update timer to read data
-            from the ATI process.
+        """ Called periodically by the update timer to read the rows
+            [Time,Eula1,Eula2,Eula3,linA1,linA2,linA3] written by the IMU process since the last call.
         """
-        qdata = list(self.get_all_from_queue(self.IMUData_q))
-
-        if len(qdata) > 0:
-            self.IMUdata = qdata[-1][6]
-            self.IMUtime = qdata[-1][0]
+        return self.IMUReader.read()
 
     def initUI(self):
         ''' Initializing the GUI interface '''
@@ -152,8 +130,7 @@ class DataMonitor(QtWidgets.QMainWindow):
         self.previewCheckBox.toggled.connect(lambda:self.previewCamera(self.previewCheckBox))
 
         self.cameraParam = QtWidgets.QComboBox(self)
-        cameraParamList = ["1280x720/60fps", "1920x1080/30fps"]
-        self.cameraParam.addItems(cameraParamList)
+        self.cameraParam.addItems(CAMERA_PRESETS)
         
         self.led0Test = QtWidgets.QCheckBox('Led 0 test')
         self.led0Test.toggled.connect(lambda:self.led0Toggle(self.led0Test))
@@ -173,13 +150,30 @@ class DataMonitor(QtWidgets.QMainWindow):
         self.biasButton = QtWidgets.QPushButton('Bias ATI', self)
         self.biasButton.clicked.connect(self.biasButtonAction) 
 
-        self.ATIWindowPlot = pg.PlotWidget(title='z Force [N]')
+        self.protocolButton = QtWidgets.QPushButton('Run protocol', self)
+        self.protocolButton.clicked.connect(self.protocolButtonAction)
+
+        self.autoCheckBox = QtWidgets.QCheckBox('Trials on contact')
+        self.autoCheckBox.setEnabled(self.ATIMonitor.contact is not None)
+        self.autoCheckBox.toggled.connect(lambda:self.session.set_auto(self.autoCheckBox.isChecked()))
+
+        self.ATIWindowPlot = self.pg.PlotWidget(title=self.ATIChannel)
         self.ATIWindowPlot.setBackground('k') 
-        self.ATIDataLine =  self.ATIWindowPlot.plot(self.ATIx, self.ATIy, pen=self.pen)
+        self.ATIDataLine =  self.ATIWindowPlot.plot([], [], pen=self.pen)
+        self.ATIChannelBox = QtWidgets.QComboBox(self)
+        self.ATIChannelBox.addItems(self.ATIPlot.header[1:] + self.ATIProcessedPlot.header[1:])
+        self.ATIChannelBox.setCurrentText(self.ATIChannel)
+        self.ATIChannelBox.currentTextChanged.connect(self.selectATIChannel)
         
-        self.IMUWindowPlot = pg.PlotWidget(title='y Acceleration')
+        self.IMUWindowPlot = self.pg.PlotWidget(title=self.IMUChannel)
         self.IMUWindowPlot.setBackground('k')  
-        self.IMUDataLine =  self.IMUWindowPlot.plot(self.IMUx, self.IMUy, pen=self.pen)
+        self.IMUDataLine =  self.IMUWindowPlot.plot([], [], pen=self.pen)
+        self.IMUChannelBox = QtWidgets.QComboBox(self)
+        self.IMUChannelBox.addItems(self.IMUPlot.header[1:])
+        self.IMUChannelBox.setCurrentText(self.IMUChannel)
+        self.IMUChannelBox.currentTextChanged.connect(self.selectIMUChannel)
+
+        self.healthLabel = QtWidgets.QLabel('')
         
         layout = QtWidgets.QGridLayout() 
         widget.setLayout(layout)  
@@ -199,8 +193,13 @@ class DataMonitor(QtWidgets.QMainWindow):
         layout.addWidget(self.startButton,6,0)
         layout.addWidget(self.stopButton,6,1)
         layout.addWidget(self.biasButton,6,2)
+        layout.addWidget(self.protocolButton,7,0)
+        layout.addWidget(self.autoCheckBox,7,1)
         layout.addWidget(self.ATIWindowPlot,0,3,2,6)
         layout.addWidget(self.IMUWindowPlot,2,3,2,6)
+        layout.addWidget(self.ATIChannelBox,0,9)
+        layout.addWidget(self.IMUChannelBox,2,9)
+        layout.addWidget(self.healthLabel,4,3,3,6)
         #layout.setColumnStretch(3,3)
         self.setCentralWidget(widget)
 
@@ -209,20 +208,20 @@ class DataMonitor(QtWidgets.QMainWindow):
         self.folderTextbox.setText(self.selectedDir)
 
     def previewCamera(self,b):
-        self.previewEvent.set()
+        self.session.toggle_preview()
 
         
     def led0Toggle(self,b):
         if b.isChecked():
-            self.led0.on()
+            self.session.led0.on()
         else:
-            self.led0.off()
+            self.session.led0.off()
             
     def led1Toggle(self,b):
         if b.isChecked():
-            self.led1.on()
+            self.session.led1.on()
         else:
-            self.led1.off()
+            self.session.led1.off()
 
 
     def setup(self):
@@ -244,93 +243,97 @@ class DataMonitor(QtWidgets.QMainWindow):
         experimentID = self.experimentIDTextbox.text()
         participantID = self.participantIDTextbox.text()
         folderName = self.folderTextbox.text()    
-        cameraParam = self.cameraParam.currentText()
-        cameraParam = cameraParam.split("/")
-        fps = cameraParam[-1]
-        fps = fps.split("f")[0]
-        resolution = cameraParam[0]
-        resolution = resolution.split("x")
-        resolution = (int(resolution[0]),int(resolution[1]))
-
-        self.cameraMsg_q.put(int(fps))
-        self.cameraMsg_q.put(resolution)
-        self.cameraMsg_q.put(participantID)
-        self.cameraMsg_q.put(experimentID)
-        self.cameraMsg_q.put(folderName)   
-        
-        self.ATIMsg_q.put(participantID)
-        self.ATIMsg_q.put(experimentID)
-        self.ATIMsg_q.put(folderName)
-
-        self.IMUMsg_q.put(participantID)
-        self.IMUMsg_q.put(experimentID)
-        self.IMUMsg_q.put(folderName)
-
-        self.setEvent.set()
+        self.session.setup(participantID, experimentID, folderName, self.cameraParam.currentText())
 
     def startButtonAction(self):
-        if not self.setEvent.is_set():
+        if not self.session.setEvent.is_set():
             QtWidgets.QMessageBox.warning(self, 'Message', "Setup has not been registered correctly")
             return
         else:
-            self.stopEvent.clear()
-            self.dataRecordingEvent.set()
+            self.session.start_trial()
             self.reply = QtWidgets.QMessageBox.information(self, 'Message', "Recording started")
 
     def stopButtonAction(self):
-        if not self.dataRecordingEvent.is_set():
+        if not self.session.dataRecordingEvent.is_set():
             QtWidgets.QMessageBox.warning(self, 'Message', "Trial has not been started")
             return
         else:
-            self.stopEvent.set()
+            self.session.stop_trial()
             
     def biasButtonAction(self):
-        self.biasEvent.set()
+        self.session.bias()
 
-    def updateATIPlot(self):
-        self.read_ATI_data()
-        if self.ATItime:
-            #print(self.ATItime)
-            self.ATIx = self.ATIx[1:]
-            self.ATIx.append(self.ATItime)
+    def protocolButtonAction(self):
+        ''' Runs the trials of a protocol file back to back, or cancels the protocol that is running '''
+        if self.scheduler is not None and self.scheduler.is_alive():
+            self.scheduler.cancel()
+            return
+        if not self.session.setEvent.is_set():
+            QtWidgets.QMessageBox.warning(self, 'Message', "Setup has not been registered correctly")
+            return
+        path, _ = QtWidgets.QFileDialog.getOpenFileName(self, caption='Choose protocol', directory=os.getcwd(), filter='Protocol (*.json)')
+        if not path:
+            return
+        try:
+            protocol = load_protocol(path)
+        except (OSError, ValueError) as e:
+            QtWidgets.QMessageBox.warning(self, 'Message', "Cannot read the protocol: %s" % e)
+            return
+        self.scheduler = TrialScheduler(self.session, protocol)
+        self.scheduler.start()
 
-        if self.ATIdata:
-            self.ATIy = self.ATIy[1:]
-            self.ATIy.append(self.ATIdata)
+    def selectATIChannel(self, name):
+        self.ATIChannel = name
+        self.ATIWindowPlot.setTitle(name)
 
-        self.ATIDataLine.setData(self.ATIx,self.ATIy)
+    def selectIMUChannel(self, name):
+        self.IMUChannel = name
+        self.IMUWindowPlot.setTitle(name)
+
+    def updateATIPlot(self):
+        # Every new sample is added to the plot model, the window is drawn with at most two points per pixel
+        self.ATIPlot.append(self.read_ATI_data())
+        self.ATIProcessedPlot.append(self.read_ATI_processed_data())
+        plot = self.ATIPlot if self.ATIChannel in self.ATIPlot.header else self.ATIProcessedPlot
+        x, y = plot.channel(self.ATIChannel, self.ATIWindowPlot.width())
+        self.ATIDataLine.setData(x, y)
 
-        
     def updateIMUPlot(self):
-        self.read_IMU_data()
-        if self.IMUtime:
-            self.IMUx = self.IMUx[1:]
-            self.IMUx.append(self.IMUtime)
-        
-        if self.IMUdata:
-            self.IMUy = self.IMUy[1:]
-            self.IMUy.append(self.IMUdata)
-        self.IMUDataLine.setData(self.IMUx,self.IMUy)
+        self.IMUPlot.append(self.read_IMU_data())
+        x, y = self.IMUPlot.channel(self.IMUChannel, self.IMUWindowPlot.width())
+        self.IMUDataLine.setData(x, y)
+
+    def updateHealth(self):
+        ''' Shows the live statistics published by the processes, fields not published yet are nan '''
+        lines = []
+        for name, board in (('ATI', self.session.ATIHealth), ('IMU', self.session.IMUHealth), ('Camera', self.session.cameraHealth)):
+            h = board.read()
+            lines.append("%s: %.0f Hz, interval p99 %.1f ms (max %.1f), %.0f dropped, queued %.0f, "
+                         "read p99 %.2f ms, queue p99 %.2f ms, write p99 %.2f ms, %.0f write errors, CPU %.0f%%" %
+                         (name, h['rate'], h['interval_p99_ms'], h['interval_max_ms'], h['malformed'], h['fill'],
+                          h['read_latency_p99_ms'], h['queue_latency_p99_ms'], h['write_latency_p99_ms'],
+                          h['write_errors'], h['cpu']))
+        # Rows the plots missed because the GUI was late (lost) or left out by the read policy (dropped)
+        lines.append("Live plots: " + ", ".join("%s %i lost, %i dropped" % (name, reader.lost, reader.dropped) for name, reader in
+                     (('ATI', self.ATIReader), ('ATI processed', self.ATIProcessedReader), ('IMU', self.IMUReader))))
+        self.errorLines = (self.errorLines + self.session.errors())[-3:]
+        self.healthLabel.setText('\n'.join(lines + self.errorLines))
 
     def updatePlotData(self):
         self.updateIMUPlot()
         self.updateATIPlot()
+        if self.startup is not None and self.session.ATIStream.seq[0] and self.session.IMUStream.seq[0]:
+            # Ready once the first samples of both sensors arrived
+            self.startup.mark('first samples')
+            self.startup.report()
+            self.startup = None
 
     def closeEvent(self,event):
-        if self.ATIMonitor is not None:
-            print('closing ATI process')
-            self.ATIMonitor.join()
-            self.ATIMonitor.close()
-
-        if self.IMUMonitor is not None:
-            print('closing IMU process')
-            self.IMUMonitor.join()
-            self.IMUMonitor.close()
-
-        if self.CameraMonitor is not None:
-            print('closing camera process')
-            self.CameraMonitor.join()
-            self.CameraMonitor.close()
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+            self.scheduler.join()
+        # Stopping the processes and freeing the shared memory of the live streams
+        self.session.close()
             
         can_exit = True    
         if can_exit:
@@ -340,7 +343,21 @@ class DataMonitor(QtWidgets.QMainWindow):
         
 
 if __name__ == '__main__':
-    app = QtWidgets.QApplication(sys.argv)
-    ex = DataMonitor()
+    parser = argparse.ArgumentParser(description='Instrumented object acquisition GUI')
+    parser.add_argument('--file-format', choices=['csv', 'binary', 'compressed'], default='csv', help='format of the trial files')
+    parser.add_argument('--software-bias', type=float, metavar='SECONDS',
+                        help='bias in software with the mean of the last SECONDS of forces instead of biasing the controller')
+    parser.add_argument('--contact', type=json.loads, metavar='JSON',
+                        help='detect the grasps with these ContactDetector settings, e.g. \'{"channel": "F", "onset": 1.0, "release": 0.5, "lift": 5.0}\', \'{}\' for the defaults')
+    parser.add_argument('--pre-event', type=float, default=1.0, help='seconds of forces recorded before the grasp of a trial started on contact')
+    parser.add_argument('--post-event', type=float, default=1.0, help='seconds recorded after the release of a trial started on contact')
+    parser.add_argument('--refresh-interval', type=int, default=50, help='refresh period of the plots in ms')
+    parser.add_argument('--plot-window', type=float, default=10.0, help='seconds shown in the plots')
+    parser.add_argument('--live-policy', choices=POLICIES, default=DROP_OLDEST, help='rows of the live data taken at each refresh')
+    parser.add_argument('--live-factor', type=int, default=1, help='one row out of LIVE_FACTOR plotted with the decimate policy')
+    args = parser.parse_args()
+    app = QtWidgets.QApplication(sys.argv[:1])
+    ex = DataMonitor(args.refresh_interval, args.plot_window, args.software_bias, args.live_policy, args.live_factor,
+                     args.contact, args.pre_event, args.post_event, args.file_format)
     sys.exit(app.exec_())
 
@@ -0,0 +1,49 @@
+'''
+Device backends of the acquisition processes.
+The backend is 'real' for the instrumented object (ATI controller on a serial port, BNO055 on I2C, PiCamera,
+gpiozero leds) or 'sim' for the simulated devices of Instrumented_Object_GUI_Sim. It is chosen with the
+INOB_BACKEND environment variable, or given explicitly to the processes. The hardware libraries are only
+imported when a real device is opened, so the code also loads on a machine without them.
+'''
+import os
+
+BACKENDS = ('real', 'sim')
+
+def default_backend():
+    backend = os.environ.get('INOB_BACKEND', 'real')
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend %s, expected one of %s" % (backend, ', '.join(BACKENDS)))
+    return backend
+
+def open_imu(backend=None):
+    ''' Returns the BNO055 sensor object '''
+    if (backend or default_backend()) == 'sim':
+        from Instrumented_Object_GUI_Sim import SimBNO055
+        return SimBNO055()
+    import board
+    import adafruit_bno055
+    return adafruit_bno055.BNO055_I2C(board.I2C())
+
+def open_camera(backend=None):
+    if (backend or default_backend()) == 'sim':
+        from Instrumented_Object_GUI_Sim import FakeCamera
+        return FakeCamera()
+    from picamera import PiCamera
+    return PiCamera()
+
+def make_led(pin, backend=None):
+    if (backend or default_backend()) == 'sim':
+        from Instrumented_Object_GUI_Sim import FakeLED
+        return FakeLED(pin)
+    from gpiozero import LED
+    return LED(pin)
+
+def ati_port(port, backend=None, rate=200):
+    '''
+    Returns the serial port of the ATI controller. With the simulated backend a fake controller is
+    started and the port of its pseudo terminal is returned instead of port.
+    '''
+    if (backend or default_backend()) == 'sim':
+        from Instrumented_Object_GUI_Sim import ATISimulator
+        return ATISimulator(rate).start()
+    return port
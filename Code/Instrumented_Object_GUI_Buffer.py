@@ -0,0 +1,78 @@
+'''
+Growable buffer used by the acquisition processes to store the data of a trial.
+Data is stored in fixed size numpy chunks that are added as the trial goes on, so
+memory follows the length of the trial and old data is never copied when it grows.
+'''
+import numpy as np
+
+class TrialBuffer:
+
+    def __init__(self, columns, chunk_rows=2000, dtype=np.float64):
+        self.columns = columns
+        self.chunk_rows = chunk_rows
+        self.dtype = dtype
+        # List of chunks, only the last one can be partially filled
+        self.chunks = []
+        self.fill = 0
+        self.length = 0
+        # Chunks allocated ahead of time by reserve, used before allocating new ones
+        self.spare = []
+
+    def __len__(self):
+        return self.length
+
+    def append(self, rows):
+        ''' Appends a single row or a block of rows to the buffer '''
+        rows = np.asarray(rows, dtype=self.dtype).reshape(-1, self.columns)
+        n = rows.shape[0]
+        start = 0
+        while start < n:
+            if not self.chunks or self.fill == self.chunk_rows:
+                self.chunks.append(self.spare.pop() if self.spare else np.empty((self.chunk_rows, self.columns), dtype=self.dtype))
+                self.fill = 0
+            k = min(self.chunk_rows - self.fill, n - start)
+            self.chunks[-1][self.fill:self.fill+k,:] = rows[start:start+k,:]
+            self.fill = self.fill + k
+            start = start + k
+        self.length = self.length + n
+
+    def reserve(self, chunks=1):
+        ''' Allocates chunks ahead of time, e.g. for the next trial while waiting for it to start '''
+        while len(self.spare) < chunks:
+            self.spare.append(np.empty((self.chunk_rows, self.columns), dtype=self.dtype))
+
+    def blocks(self):
+        ''' Yields views on the filled part of each chunk '''
+        for chunk in self.chunks[:-1]:
+            yield chunk
+        if self.chunks:
+            yield self.chunks[-1][:self.fill]
+
+    def to_array(self):
+        ''' Returns a copy of the whole trial as a single array '''
+        if not self.chunks:
+            return np.empty((0, self.columns), dtype=self.dtype)
+        return np.concatenate(list(self.blocks()))
+
+    def take_full(self):
+        ''' Removes the chunks that are full from the buffer and returns them '''
+        if self.chunks and self.fill == self.chunk_rows:
+            full = self.chunks
+            self.chunks = []
+        else:
+            full = self.chunks[:-1]
+            self.chunks = self.chunks[-1:]
+        self.length = self.length - len(full)*self.chunk_rows
+        return full
+
+    def take_all(self):
+        ''' Removes all the data from the buffer and returns it as a list of blocks '''
+        blocks = list(self.blocks())
+        self.clear()
+        return blocks
+
+    def clear(self):
+        ''' Releases all the chunks at the end of a trial '''
+        self.chunks = []
+        self.fill = 0
+        self.length = 0
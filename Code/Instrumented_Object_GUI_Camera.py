@@ -2,11 +2,14 @@
 Class created for the readout of the camera, inherits from the multiprocessing class
 Created by David Cordova Bulens @ University College Dublin
 '''
-from picamera import PiCamera
-import time
-from gpiozero import LED
 import time
 import multiprocessing
+from Instrumented_Object_GUI_Writer import TrialWriter
+from Instrumented_Object_GUI_Frames import FrameTimestampOutput
+from Instrumented_Object_GUI_Control import StateNotifier, CPUMonitor, StartupTimer
+from Instrumented_Object_GUI_Clock import ClockOffsetEstimator, clock_metadata, now
+from Instrumented_Object_GUI_Backend import open_camera
+from Instrumented_Object_GUI_Stats import MonitorStats
 
 class CameraMonitorThread(multiprocessing.Process):
     
@@ -18,20 +21,31 @@ class CameraMonitorThread(multiprocessing.Process):
                     repeatEvent,
                     msgQueue,
                     led0,
-                    led1):
+                    led1,
+                    stateChange=None,
+                    backend=None,
+                    health=None,
+                    trialClosed=None,
+                    error_q=None):
         multiprocessing.Process.__init__(self)
         
         self.i2c = None
         self.sensor = None
 
         self.camera = None
+        # 'real' or 'sim' device, INOB_BACKEND by default
+        self.backend = backend
         self.msgQueue = msgQueue        
+        # Queue where the errors of the frame timestamps files are reported
+        self.error_q = error_q
         # Events for defning status of the code and trials
         self.cameraSetupEvent = cameraSetupEvent
         self.recordingEvent = recordingEvent
         self.previewEvent = previewEvent
         self.stopEvent = stopEvent
         self.repeatEvent = repeatEvent
+        # Notified by the GUI on every change of the events above, the loop sleeps until then
+        self.stateChange = stateChange if stateChange is not None else StateNotifier()
         # Flags for file creation and termination
         self.previewIsOn = False
         self.fileIsCreated = False
@@ -39,9 +53,14 @@ class CameraMonitorThread(multiprocessing.Process):
         # Creating leds for synchronization
         self.led0 = led0
         self.led1 = led1
-        # Array creation to store data during trial
+        # Output collecting the video and frame timestamps during trial
         self.repeatNumber = 0        
-        self.trial_data = np.zeros((50000,1))*np.NAN
+        self.output = None
+        # Semaphore released once a recording is closed, the frame timestamps file of the next one is then prepared
+        self.trialClosed = trialClosed
+        # Shared HealthBoard where the live statistics of the process are published for the GUI
+        self.health = health
+        self.stats = None
         # Event defining the end of the init function
         self.alive = multiprocessing.Event()
         self.alive.set()
@@ -54,10 +73,17 @@ class CameraMonitorThread(multiprocessing.Process):
         It then reads from the Camera and stores the data in an array. 
         '''
         ### CREATING CAMERA ###
+        startup = StartupTimer('Camera')
         if self.camera: 
             self.camera.close()   
-        self.camera = PiCamera()
+        self.camera = open_camera(self.backend)
         self.camera.color_effects = (128,128) # Setting it to grayscale     
+        startup.mark('camera')
+        # The writer thread streams the frame timestamps sidecar to disk
+        self.fileWriter = TrialWriter(errors=self.error_q)
+        self.fileWriter.start()
+        startup.mark('writer')
+        startup.report()
 
         ### WAITING FOR SETUP TO BE DONE IN THE GUI ###
         e_wait = self.cameraSetupEvent.wait(); # Waiting for the setup event
@@ -75,12 +101,14 @@ class CameraMonitorThread(multiprocessing.Process):
             self.videoNumber = -1
             self.timeStamp = -1
             self.N_frames = 0
+            self.filePrefix = "%s/%s_%s" % (folderName,experimentName,fileName)
+            self.prepareTrialFile()
             print('Camera information set')
     
         # Initialize time
         time0 = time.time()
-        timeStamp = -1
-        N_frames = 0
+        seen = self.stateChange.version.value
+        cpu = CPUMonitor('Camera')
 
         while self.alive.is_set():
             ### PREVIEW WINDOW ###
@@ -98,56 +126,87 @@ class CameraMonitorThread(multiprocessing.Process):
             if self.recordingEvent.is_set() and not self.stopEvent.is_set():
                 self.started = True
                 if self.fileIsCreated:
-                    # Reading timestamp of current frame
-                    timeStamp_tmp = self.camera.frame.timestamp
-                    if timeStamp_tmp != timeStamp and timeStamp_tmp !=None:
-                        timeStamp = timeStamp_tmp
-                        self.trial_data[N_frames] = timeStamp
-                        # self.fileHandle.write(str(timeStamp))
-                        # self.fileHandle.write('\n')
-                        N_frames = N_frames +1  
-                    if N_frames == 30:
-                        self.led0.on()
-                        self.led1.on()
-                    if N_frames == 60:            
-                        self.led0.off()
-                        self.led1.off()
+                    # Frame timestamps and leds are handled by the output for every frame, raises if the encoder failed
+                    self.camera.wait_recording(0)
+                    self.readCameraClock()
+                    self.stats.set_fill(self.fileWriter.requests.qsize())
+                    self.stats.set_write_errors(self.fileWriter.errorCount)
+                    self.stats.publish(now(), self.fileWriter.latency, cpu)
                 else:                    
+                    framesFilePath, videoFilePath = self.trialPaths(self.repeatEvent.is_set())
                     if self.repeatEvent.is_set():
                         print('video repeat')
                         self.repeatNumber = self.repeatNumber + 1 
-                        txtFilePath = "%s/%s_%s_Camera_%i_%i.txt" % (folderName,experimentName,fileName,self.videoNumber,self.repeatNumber)
-                        videoFilePath = "%s/%s_%s_%i_%i.h264" % (folderName,experimentName,fileName,self.videoNumber,self.repeatNumber)
-                        self.fileHandle = open(txtFilePath,"w");  
-                        self.startTime = time.time()
                     else:                        
                         self.videoNumber = self.videoNumber +1
-                        txtFilePath = "%s/%s_%s_Camera_%i.txt" % (folderName,experimentName,fileName,self.videoNumber)
-                        videoFilePath = "%s/%s_%s_%i.h264" % (folderName,experimentName,fileName,self.videoNumber)
-                        self.fileHandle = open(txtFilePath,"w");  
-                        self.startTime = time.time()
+                    self.startTime = time.time()
+                    # Frame intervals and dropped frames are counted by the output, per recording
+                    self.stats = MonitorStats('Camera', self.health)
+                    self.output = FrameTimestampOutput(self.camera, videoFilePath, framesFilePath, self.camera.framerate,
+                                                       self.fileWriter, leds=(self.led0, self.led1), stats=self.stats)
                     print('starting recording\n')
-                    self.camera.start_recording(videoFilePath,format='h264')
+                    self.camera.start_recording(self.output,format='h264')
+                    # A few readings of the camera clock give a first estimate of its offset
+                    self.clockEstimator = ClockOffsetEstimator()
+                    for i in range(5):
+                        self.readCameraClock()
                     self.fileIsCreated = True
 
             if self.stopEvent.is_set() and self.started:                
-               self.writer.writerows(self.trial_data)
                 if self.camera.recording:
                     self.camera.stop_recording()
+                if self.output is not None:
+                    # Mapping of the GPU timestamps of the frames to the common clock
+                    self.fileWriter.update_metadata(dict(clock_metadata(), camera_clock=self.clockEstimator.metadata(),
+                                                         led_commands=self.output.ledTimes, stats=self.stats.summary()))
+                    self.output.close()
+                    self.output = None
+                    self.stats.report()
                 self.recordingEvent.clear()
-                N_frames = 0
                 self.fileIsCreated = False
                 self.started = False
-                self.fileHandle.close()
-                timeStamp = -1
+                cpu.report()
+                self.prepareTrialFile()
+                if self.trialClosed is not None:
+                    self.trialClosed.release()
+
+            ### WAITING ###
+            # Sleep until the GUI changes the state
+            seen = self.stateChange.wait(seen, 0.5)
             
             
         # clean up
+        cpu.report()
+        self.fileWriter.stop()
         if self.camera:
             self.camera.close()
 
+    def trialPaths(self, repeat):
+        ''' Paths of the frame timestamps and video files of the next recording, a repeat of the last one or a new one '''
+        if repeat:
+            number = "%i_%i" % (self.videoNumber, self.repeatNumber + 1)
+        else:
+            number = "%i" % (self.videoNumber + 1)
+        return "%s_Camera_%s.inob" % (self.filePrefix, number), "%s_%s.h264" % (self.filePrefix, number)
+
+    def prepareTrialFile(self):
+        ''' Creates the frame timestamps file of the next recording while waiting for it, the video file is opened by the recording '''
+        FrameTimestampOutput.prepare(self.fileWriter, self.trialPaths(self.repeatEvent.is_set())[0], self.camera.framerate,
+                                     self.camera.resolution)
+
+    def readCameraClock(self):
+        ''' Reads the GPU clock of the camera between two readings of the common clock '''
+        before = now()
+        gpu = self.camera.timestamp
+        after = now()
+        self.clockEstimator.add(gpu, before, after)
+        # The read latency of the camera is the length of the clock reading
+        if self.stats is not None:
+            self.stats.add_read_latency(after - before)
+
     def join(self, timeout=None):
         self.alive.clear()
+        self.stateChange.notify()
         multiprocessing.Process.join(self, timeout)
 
     
@@ -0,0 +1,78 @@
+'''
+Common time base of the acquisition processes.
+All the processes stamp their samples with the system wide monotonic clock, which is shared by every
+process of the machine and is not affected by changes of the wall clock. epoch() gives the offset to
+add to these timestamps to get wall clock time, it is saved in the metadata of each trial.
+The camera stamps its frames with the GPU clock, ClockOffsetEstimator maps it to the monotonic clock
+from pairs of readings of both clocks taken during the recording.
+'''
+import time
+import collections
+import numpy as np
+
+CLOCK_NAME = 'monotonic'
+
+def now():
+    return time.monotonic()
+
+def epoch():
+    ''' Wall clock time of the origin of the monotonic clock '''
+    return time.time() - time.monotonic()
+
+def clock_metadata():
+    return {'clock': CLOCK_NAME, 'clock_epoch': epoch()}
+
+def device_to_host(device, mapping):
+    ''' Maps device clock readings to the host clock with the metadata of a ClockOffsetEstimator '''
+    return mapping['offset'] + (1 + 1e-6*mapping['drift_ppm'])*np.asarray(device)*mapping['scale']
+
+class ClockOffsetEstimator:
+    '''
+    Online linear fit host = offset + (1 + drift)*device of a device clock against the host clock.
+    Each reading of the device clock is bracketed by two host readings, readings whose bracket is much
+    wider than the best one seen (the process was preempted) are rejected. The fit is done over the
+    last `window` readings so that slow changes of the drift are followed.
+    '''
+    def __init__(self, scale=1e-6, window=600, tolerance=2.0):
+        # Seconds per device clock tick, the camera GPU clock is in us
+        self.scale = scale
+        self.tolerance = tolerance
+        self.samples = collections.deque(maxlen=window)
+        self.bestDelay = None
+        self.rejected = 0
+        self.offset = None
+        self.drift = 0.0
+        self.residual = None
+
+    def add(self, device, hostBefore, hostAfter):
+        delay = hostAfter - hostBefore
+        if self.bestDelay is None or delay < self.bestDelay:
+            self.bestDelay = delay
+        if delay > self.tolerance*self.bestDelay + 1e-4:
+            self.rejected = self.rejected + 1
+            return
+        self.samples.append((device*self.scale, 0.5*(hostBefore + hostAfter)))
+        self.fit()
+
+    def fit(self):
+        data = np.array(self.samples)
+        # Centering the data keeps the fit accurate with large clock values
+        x0, y0 = data[0]
+        x = data[:,0] - x0
+        y = data[:,1] - y0
+        if len(data) > 1 and np.ptp(x) > 0:
+            slope = np.dot(x - x.mean(), y - y.mean())/np.dot(x - x.mean(), x - x.mean())
+        else:
+            slope = 1.0
+        intercept = y.mean() - slope*x.mean()
+        self.drift = float(slope - 1)
+        self.offset = float(y0 + intercept - slope*x0)
+        self.residual = float(np.sqrt(np.mean((y - intercept - slope*x)**2)))
+
+    def to_host(self, device):
+        ''' Converts device clock values (scalar or array) to host time '''
+        return self.offset + (1 + self.drift)*np.asarray(device)*self.scale
+
+    def metadata(self):
+        return {'offset': self.offset, 'drift_ppm': 1e6*self.drift, 'scale': self.scale,
+                'samples': len(self.samples), 'rejected': self.rejected, 'residual': self.residual}
@@ -0,0 +1,147 @@
+'''
+Streaming contact detection on the forces of the ATI process.
+Each block of samples read from the controller goes through a small state machine with hysteresis
+thresholds on one force channel: the grasp starts when the force rises above the onset threshold, the
+object is lifted when it rises above the lift threshold, and it is released when the force falls below
+the release threshold, lower than the onset one so that the noise around a threshold does not make
+events of its own. The block is searched with numpy for the next threshold crossing of the current state
+instead of looping over the samples, and the time of each event is interpolated between the two samples
+around the crossing. The delay between the time of an event and its detection is measured for every event.
+'''
+import numpy as np
+from Instrumented_Object_GUI_Stats import Histogram
+
+# Events of a grasp, in the order they happen
+GRASP = 'grasp'
+LIFT = 'lift'
+RELEASE = 'release'
+
+# States of the detector
+IDLE = 0
+CONTACT = 1
+LIFTED = 2
+
+class ContactDetector:
+    '''
+    Detects the grasp, lift and release events in blocks of ATI rows [Time,fx,fy,fz,tx,ty,tz].
+    channel is a column of the header, or "F" for the resultant of fx, fy and fz. Thresholds are in N,
+    the lift is detected again after the force went back below lift - (onset - release)
+    '''
+
+    def __init__(self, header, channel='F', onset=1.0, release=0.5, lift=5.0):
+        if release >= onset:
+            raise ValueError("Release threshold %g N must be below the onset threshold %g N" % (release, onset))
+        if lift is not None and lift <= onset:
+            raise ValueError("Lift threshold %g N must be above the onset threshold %g N" % (lift, onset))
+        self.channel = channel
+        self.column = None if channel == 'F' else header.index(channel)
+        self.onset = onset
+        self.release = release
+        self.lift = lift
+        self.state = IDLE
+        # Lift detected and not re-armed yet
+        self.lifted = False
+        # Last sample of the previous block, to interpolate a crossing at the start of a block
+        self.lastTime = None
+        self.lastValue = None
+        self.latency = Histogram()
+
+    def metadata(self):
+        return {'channel': self.channel, 'onset': self.onset, 'release': self.release, 'lift': self.lift}
+
+    def values(self, block):
+        if self.column is None:
+            return np.sqrt(np.einsum('ij,ij->i', block[:,1:4], block[:,1:4]))
+        return block[:,self.column]
+
+    def crossing(self, times, values, k, threshold):
+        ''' Time at which the force crossed threshold between sample k-1 (or the previous block) and sample k '''
+        if k > 0:
+            t0, v0 = times[k-1], values[k-1]
+        elif self.lastTime is not None:
+            t0, v0 = self.lastTime, self.lastValue
+        else:
+            return float(times[k])
+        if values[k] == v0:
+            return float(times[k])
+        return float(t0 + (threshold - v0)/(values[k] - v0)*(times[k] - t0))
+
+    def process(self, block, detected):
+        '''
+        Returns the events of a block as dicts {'event', 'time', 'latency'}, detected is the time at which
+        the block is processed, on the clock of the samples
+        '''
+        times = block[:,0]
+        values = self.values(block)
+        events = []
+        k = 0
+        n = len(values)
+        rearm = None if self.lift is None else self.lift - (self.onset - self.release)
+        while k < n:
+            # Next sample past the threshold of each transition possible from the current state
+            if self.state == IDLE:
+                candidates = [(values[k:] > self.onset, self.onset, GRASP)]
+            else:
+                candidates = [(values[k:] < self.release, self.release, RELEASE)]
+                if self.lift is not None and not self.lifted:
+                    candidates.append((values[k:] > self.lift, self.lift, LIFT))
+                elif self.lifted:
+                    candidates.append((values[k:] < rearm, rearm, None))
+            first = None
+            for above, threshold, event in candidates:
+                i = int(np.argmax(above))
+                if above[i] and (first is None or i < first[0]):
+                    first = (i, threshold, event)
+            if first is None:
+                break
+            i, threshold, event = first
+            k = k + i
+            if event is None:
+                self.lifted = False
+            else:
+                time = self.crossing(times, values, k, threshold)
+                events.append({'event': event, 'time': time, 'latency': detected - time})
+                if event == GRASP:
+                    self.state = CONTACT
+                elif event == LIFT:
+                    self.state = LIFTED
+                    self.lifted = True
+                else:
+                    self.state = IDLE
+                    self.lifted = False
+            k = k + 1
+        if n:
+            self.lastTime, self.lastValue = times[-1], values[-1]
+        self.latency.add([e['latency'] for e in events])
+        return events
+
+    def summary(self):
+        ''' Detection latency of the events, saved in the trial metadata '''
+        return dict(self.metadata(), latency=self.latency.summary())
+
+    def report(self):
+        latency = self.latency.summary()
+        if latency['count']:
+            print("Contact: %i events, detection latency mean %.1f ms, p99 %.1f ms, max %.1f ms" %
+                  (latency['count'], 1e3*latency['mean'], 1e3*latency['p99'], 1e3*latency['max']))
+
+class RecentRows:
+    ''' Rows of the last blocks in a ring, so that a trial started by an event also records the data before it '''
+
+    def __init__(self, columns, capacity):
+        self.rows = np.zeros((max(capacity, 1), columns))
+        self.position = 0
+        self.count = 0
+
+    def add(self, block):
+        block = block[-len(self.rows):]
+        index = (self.position + np.arange(len(block))) % len(self.rows)
+        self.rows[index] = block
+        self.position = (self.position + len(block)) % len(self.rows)
+        self.count = min(self.count + len(block), len(self.rows))
+
+    def since(self, time):
+        ''' Rows of the ring from the given time, oldest first '''
+        index = (self.position - self.count + np.arange(self.count)) % len(self.rows)
+        rows = self.rows[index]
+        return rows[rows[:,0] >= time]
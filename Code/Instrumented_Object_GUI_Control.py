@@ -0,0 +1,68 @@
+'''
+Control plane shared by the GUI and the acquisition processes.
+StateNotifier lets the processes sleep until the GUI changes the state of the trial (setup, start,
+stop, bias, preview) instead of polling the events in a loop, CPUMonitor reports the CPU used
+by a process so that the cost of each acquisition loop can be followed, and StartupTimer reports
+the time spent in each step of the start of a process.
+'''
+import multiprocessing
+import time
+
+class StateNotifier:
+
+    def __init__(self):
+        self.condition = multiprocessing.Condition()
+        # Incremented on every change of state, processes compare it with the last value they saw
+        self.version = multiprocessing.Value('L', 0, lock=False)
+
+    def notify(self):
+        ''' Called after setting or clearing one of the trial events '''
+        with self.condition:
+            self.version.value = self.version.value + 1
+            self.condition.notify_all()
+
+    def wait(self, seen, timeout=None):
+        ''' Blocks until the state changes from the version seen, or the timeout. Returns the current version '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.version.value != seen, timeout)
+            return self.version.value
+
+class CPUMonitor:
+
+    def __init__(self, name):
+        self.name = name
+        self.reset()
+
+    def reset(self):
+        self.wallTime = time.time()
+        self.cpuTime = time.process_time()
+
+    def usage(self):
+        ''' Percentage of one core used by the process (all threads) since the last reset '''
+        wall = time.time() - self.wallTime
+        if wall <= 0:
+            return 0.0
+        return 100*(time.process_time() - self.cpuTime)/wall
+
+    def report(self):
+        print("%s process CPU use: %.1f%% of one core" % (self.name, self.usage()))
+        self.reset()
+
+class StartupTimer:
+
+    def __init__(self, name, start=None):
+        ''' start is the time.monotonic() time the startup began, now by default '''
+        self.name = name
+        self.start = time.monotonic() if start is None else start
+        self.last = self.start
+        self.steps = []
+
+    def mark(self, step):
+        ''' Ends a step of the startup '''
+        t = time.monotonic()
+        self.steps.append((step, t - self.last))
+        self.last = t
+
+    def report(self):
+        steps = ', '.join("%s %.3f s" % step for step in self.steps)
+        print("%s startup: %s (total %.3f s)" % (self.name, steps, self.last - self.start))
@@ -0,0 +1,124 @@
+'''
+Streaming processing stage of the ATI process.
+The force/torque columns of every block read from the controller are low-pass filtered with a
+Butterworth filter made of second order sections, whose state is carried from one block to the next,
+and the resultant force and its rate of change are derived from the filtered forces.
+A section is a two state linear system, so the whole block goes through it with matrix products
+computed once for all the block lengths (impulse response, effect of the initial state, state update)
+instead of a Python loop over the samples. The filter is designed here with numpy, scipy is not needed.
+'''
+import numpy as np
+
+def butter_sos(order, cutoff, fs):
+    '''
+    Digital Butterworth low-pass of the given order and cutoff [Hz] for the sample rate fs, designed by
+    bilinear transform. Returns the sections as rows [b0,b1,b2,1,a1,a2], like scipy.signal.butter(output='sos')
+    '''
+    if not 0 < cutoff < fs/2:
+        raise ValueError("Cutoff frequency %g Hz must be between 0 and %g Hz" % (cutoff, fs/2))
+    k = 2*fs
+    wc = k*np.tan(np.pi*cutoff/fs)
+    sections = []
+    # Analog poles in the left half plane, one section per conjugate pair
+    for i in range(order//2):
+        pole = np.exp(1j*np.pi*(2*i + order + 1)/(2*order))
+        a1 = -2*pole.real*wc
+        a0 = wc*wc
+        d = np.array([k*k + a1*k + a0, 2*a0 - 2*k*k, k*k - a1*k + a0])
+        sections.append(np.concatenate([a0*np.array([1, 2, 1]), d])/d[0])
+    if order % 2:
+        d = np.array([k + wc, wc - k, 0])
+        sections.append(np.concatenate([[wc, wc, 0], d])/d[0])
+    return np.array(sections)
+
+class SOSFilter:
+    ''' Filters blocks of rows (N,channels) column-wise, keeping the state of the sections between blocks '''
+
+    def __init__(self, sos, channels, max_block=256):
+        self.max_block = max_block
+        self.sections = [self.section_matrices(s, max_block) for s in np.atleast_2d(sos)]
+        self.state = None
+        self.channels = channels
+
+    @staticmethod
+    def section_matrices(section, n):
+        ''' Matrices of a section in transposed direct form II for blocks of up to n samples '''
+        b0, b1, b2, a0, a1, a2 = section
+        A = np.array([[-a1, 1.0], [-a2, 0.0]])
+        B = np.array([b1 - a1*b0, b2 - a2*b0])
+        C = np.array([1.0, 0.0])
+        powers = [np.eye(2)]
+        for i in range(n):
+            powers.append(powers[-1].dot(A))
+        powers = np.array(powers)
+        # Response to the initial state, response to an impulse, and effect of each input on the final state
+        observe = np.einsum('j,mjk->mk', C, powers[:n])
+        response = np.concatenate([[b0], observe[:n-1].dot(B)])
+        inputs = powers[:n].dot(B)
+        index = np.arange(n)
+        lag = index[:,None] - index[None,:]
+        toeplitz = np.where(lag >= 0, response[np.clip(lag, 0, n-1)], 0.0)
+        return toeplitz, observe, powers, inputs
+
+    def reset(self, rows=None):
+        ''' Starts from rest, or from the steady state of a constant input equal to the first of rows '''
+        self.state = np.zeros((len(self.sections), 2, self.channels))
+        if rows is None:
+            return
+        level = np.asarray(rows, dtype=np.float64)[0]
+        for i, (toeplitz, observe, powers, inputs) in enumerate(self.sections):
+            # Steady state s = A s + B x, the sections have a unit gain so the level goes through unchanged
+            A = powers[1]
+            B = inputs[0]
+            self.state[i] = np.linalg.solve(np.eye(2) - A, B)[:,None]*level[None,:]
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        if self.state is None:
+            self.reset(block)
+        output = np.empty_like(block)
+        for start in range(0, len(block), self.max_block):
+            x = block[start:start+self.max_block]
+            n = len(x)
+            for i, (toeplitz, observe, powers, inputs) in enumerate(self.sections):
+                state = self.state[i]
+                y = toeplitz[:n,:n].dot(x) + observe[:n].dot(state)
+                self.state[i] = powers[n].dot(state) + inputs[n-1::-1].T.dot(x)
+                x = y
+            output[start:start+n] = x
+        return output
+
+class ForceProcessor:
+    '''
+    Processing stage of the ATI blocks [Time,fx,fy,fz,tx,ty,tz]: returns the filtered forces and torques,
+    the resultant force F [N] and its rate dF [N/s], as rows [Time,fx_lp,...,tz_lp,F,dF].
+    The controller samples at a fixed rate, so the rate is taken over its sample period rather than over the
+    timestamps, which are those of the serial reads
+    '''
+    header = ["Time","fx_lp","fy_lp","fz_lp","tx_lp","ty_lp","tz_lp","F","dF"]
+    units = ["s","N","N","N","Nm","Nm","Nm","N","N/s"]
+
+    def __init__(self, sample_rate=200, cutoff=20.0, order=4):
+        self.cutoff = cutoff
+        self.order = order
+        self.sample_rate = sample_rate
+        self.filter = SOSFilter(butter_sos(order, cutoff, sample_rate), 6)
+        self.lastForce = None
+
+    def metadata(self):
+        return {'filter': {'type': 'butterworth_lowpass', 'order': self.order, 'cutoff': self.cutoff,
+                           'columns': self.header[1:7]}}
+
+    def process(self, block):
+        n = len(block)
+        output = np.empty((n, len(self.header)))
+        output[:,0] = block[:,0]
+        output[:,1:7] = self.filter.process(block[:,1:7])
+        force = np.sqrt(np.einsum('ij,ij->i', output[:,1:4], output[:,1:4]))
+        output[:,7] = force
+        # Rate of the resultant force, continued from the last sample of the previous block
+        if self.lastForce is None:
+            self.lastForce = force[0]
+        output[:,8] = np.diff(np.concatenate([[self.lastForce], force]))*self.sample_rate
+        self.lastForce = force[-1]
+        return output
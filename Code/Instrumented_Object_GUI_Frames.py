@@ -0,0 +1,111 @@
+'''
+Custom output given to camera.start_recording. The camera calls its write method for every buffer
+produced by the encoder, so the timestamp of every frame is collected from the encoder output path
+rather than by polling camera.frame from the acquisition loop. The video is written to the .h264 file
+and one row [frame index, GPU timestamp in us, flag, byte position, key frame] per frame is written to a
+binary sidecar file. The position is where the decoder can start for this frame in the .h264 file, headers
+(SPS/PPS) written before a key frame included, so the sidecar is also an index to seek in the video.
+It only relies on camera.frame, so any object providing it (e.g. a fake camera) can drive it.
+'''
+import numpy as np
+from Instrumented_Object_GUI_Buffer import TrialBuffer
+from Instrumented_Object_GUI_Writer import BinaryTrialFile
+from Instrumented_Object_GUI_Clock import now
+
+# Flags of the frames in the sidecar file
+FRAME_OK = 0
+FRAME_AFTER_DROP = 1    # one or more frames are missing before this one
+FRAME_DUPLICATE = 2     # same index or timestamp as the previous frame
+
+FRAME_HEADER = ["index", "timestamp", "flag", "position", "key"]
+FRAME_METADATA = {'units': ["", "us", "", "B", ""], 'dtypes': ['<i8', '<i8', '<u1', '<i8', '<u1'], 'clock': 'gpu_us'}
+# picamera.PiVideoFrameType.key_frame
+KEY_FRAME = 1
+
+def frame_metadata(framerate, resolution):
+    # The framerate of a PiCamera is a PiCameraFraction, which JSON cannot store
+    return dict(FRAME_METADATA, sample_rate=float(framerate), resolution=[int(r) for r in resolution])
+
+class FrameTimestampOutput:
+
+    def __init__(self, camera, videoPath, framePath, framerate, fileWriter, leds=(), ledOn=30, ledOff=60, stats=None):
+        self.camera = camera
+        self.videoHandle = open(videoPath, "wb")
+        self.framerate = framerate
+        self.period = 1e6/framerate
+        # The frame rows are handed to the writer thread of the camera process in chunks
+        self.fileWriter = fileWriter
+        self.fileWriter.open(framePath, FRAME_HEADER, BinaryTrialFile, frame_metadata(framerate, camera.resolution))
+        self.frames = TrialBuffer(len(FRAME_HEADER), chunk_rows=120, dtype=np.int64)
+        # Bytes written to the video, and position of the first buffer of the frame being written
+        self.position = 0
+        self.frameStart = None
+        # Synchronisation leds are turned on and off at given frame numbers
+        self.leds = leds
+        self.ledOn = ledOn
+        self.ledOff = ledOff
+        # Common clock time at which the leds were switched, saved in the trial metadata
+        self.ledTimes = {}
+        self.nFrames = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.lastIndex = None
+        self.lastTimestamp = None
+        # MonitorStats of the camera process, given the frame times in s
+        self.stats = stats
+
+    @staticmethod
+    def prepare(fileWriter, framePath, framerate, resolution):
+        ''' Creates the frame timestamps file of the next recording ahead of time '''
+        fileWriter.prepare(framePath, FRAME_HEADER, BinaryTrialFile, frame_metadata(framerate, resolution))
+
+    def write(self, buf):
+        if self.frameStart is None:
+            self.frameStart = self.position
+        self.videoHandle.write(buf)
+        self.position = self.position + len(buf)
+        frame = self.camera.frame
+        # Headers have no timestamp and belong to the next frame, and a frame can span several buffers
+        if frame.complete and frame.timestamp is not None:
+            self.addFrame(frame.index, frame.timestamp, self.frameStart, frame.frame_type == KEY_FRAME)
+            self.frameStart = None
+        return len(buf)
+
+    def addFrame(self, index, timestamp, position=-1, key=False):
+        flag = FRAME_OK
+        if self.lastTimestamp is not None:
+            if index == self.lastIndex or timestamp == self.lastTimestamp:
+                flag = FRAME_DUPLICATE
+                self.duplicated = self.duplicated + 1
+            elif timestamp - self.lastTimestamp > 1.5*self.period:
+                flag = FRAME_AFTER_DROP
+                self.dropped = self.dropped + int(round((timestamp - self.lastTimestamp)/self.period)) - 1
+        self.lastIndex = index
+        self.lastTimestamp = timestamp
+        if self.stats is not None:
+            self.stats.add_samples(1e-6*timestamp)
+            self.stats.set_malformed(self.dropped + self.duplicated)
+        self.frames.append([index, timestamp, flag, position, key])
+        for block in self.frames.take_full():
+            self.fileWriter.write(block)
+
+        self.nFrames = self.nFrames + 1
+        if self.nFrames == self.ledOn:
+            for led in self.leds:
+                led.on()
+            self.ledTimes['on'] = now()
+        if self.nFrames == self.ledOff:
+            for led in self.leds:
+                led.off()
+            self.ledTimes['off'] = now()
+
+    def flush(self):
+        self.videoHandle.flush()
+
+    def close(self):
+        ''' Called once the recording is stopped, the end of the sidecar file is queued to the writer '''
+        self.videoHandle.close()
+        for block in self.frames.take_all():
+            self.fileWriter.write(block)
+        self.fileWriter.close()
+        print("Recorded %i frames, %i dropped, %i duplicated" % (self.nFrames, self.dropped, self.duplicated))
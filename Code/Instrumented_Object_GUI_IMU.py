@@ -2,28 +2,94 @@
 Class created for the readout of the IMU, inherits from the multiprocessing class
 Created by David Cordova Bulens @ University College Dublin
 '''
-import board
-import adafruit_bno055
 import time
 import multiprocessing
-import csv
 import numpy as np
+from Instrumented_Object_GUI_Buffer import TrialBuffer
+from Instrumented_Object_GUI_Writer import TrialWriter, TRIAL_FILE_TYPES
+from Instrumented_Object_GUI_Control import CPUMonitor, StartupTimer
+from Instrumented_Object_GUI_Clock import CLOCK_NAME, clock_metadata, now
+from Instrumented_Object_GUI_Backend import open_imu
+from Instrumented_Object_GUI_Stats import MonitorStats
+
+# BNO055 output registers (page 0): start register, number of int16 values, scale, column names and units
+IMU_CHANNELS = {
+   'gyro':                (0x14, 3, np.pi/(180*16), ["gyr1","gyr2","gyr3"], ["rad/s"]*3),
+   'euler':               (0x1A, 3, 1/16, ["Eula1","Eula2","Eula3"], ["deg"]*3),
+   'quaternion':          (0x20, 4, 1/(1<<14), ["quatW","quatX","quatY","quatZ"], [""]*4),
+   'linear_acceleration': (0x28, 3, 1/100, ["linA1","linA2","linA3"], ["m/s^2"]*3),
+}
+# Calibration status byte, 2 bits per sensor: sys, gyro, accel, mag
+CALIBRATION_REGISTER = 0x35
+DEFAULT_CHANNELS = ('euler', 'linear_acceleration')
+
+def imu_header(channels=DEFAULT_CHANNELS):
+   ''' Columns of the IMU rows for the channels read, the time first '''
+   return ["Time"] + BNO055BurstReader(None, channels).header
+
+class BNO055BurstReader:
+   '''
+   Reads all the requested channels of the BNO055 in a single I2C transaction, so that all the
+   values of a row come from the same instant. The block of registers spans from the first to
+   the last requested channel.
+   '''
+   def __init__(self, sensor, channels=DEFAULT_CHANNELS):
+      self.sensor = sensor
+      self.channels = [c for c in channels if c != 'calibration']
+      self.calibration = 'calibration' in channels
+      starts = [IMU_CHANNELS[c][0] for c in self.channels]
+      ends = [IMU_CHANNELS[c][0] + 2*IMU_CHANNELS[c][1] for c in self.channels]
+      if self.calibration:
+         starts.append(CALIBRATION_REGISTER)
+         ends.append(CALIBRATION_REGISTER + 1)
+      self.start = min(starts)
+      self.buffer = bytearray(max(ends) - self.start)
+      self.register = bytes([self.start])
+      # Column names and units, in the order of the rows returned by read
+      self.header = [n for c in self.channels for n in IMU_CHANNELS[c][3]] + (["calib"] if self.calibration else [])
+      self.units = [u for c in self.channels for u in IMU_CHANNELS[c][4]] + ([""] if self.calibration else [])
+
+   def read(self):
+      ''' Returns a row with the values of all the channels '''
+      with self.sensor.i2c_device as i2c:
+         i2c.write_then_readinto(self.register, self.buffer)
+      row = []
+      for c in self.channels:
+         register, n, scale, names, units = IMU_CHANNELS[c]
+         offset = register - self.start
+         row.extend(np.frombuffer(self.buffer, dtype='<i2', count=n, offset=offset)*scale)
+      if self.calibration:
+         row.append(self.buffer[CALIBRATION_REGISTER - self.start])
+      return row
 
 class IMUMonitorThread(multiprocessing.Process):
     
    def __init__(   self, 
-                    data_q, msg_q,
+                    data_stream, msg_q,
                     setEvent,
                     recordingEvent,
                     stopEvent,
-                    repeatEvent):
+                    repeatEvent,
+                    flush_interval=1.0,
+                    fsync_interval=5.0,
+                    file_format='csv',
+                    sample_rate=100,
+                    channels=DEFAULT_CHANNELS,
+                    backend=None,
+                    health=None,
+                    trialClosed=None,
+                    error_q=None):
       multiprocessing.Process.__init__(self)
         
       self.i2c = None
       self.sensor = None
-      # Queues for data transmission across processes
-      self.data_q = data_q
+      # 'real' or 'sim' device, INOB_BACKEND by default
+      self.backend = backend
+      # Shared ring buffer for the live data and queue for messages across processes
+      self.data_stream = data_stream
       self.msg_q = msg_q      
+      # Queue where the errors of the trial files are reported
+      self.error_q = error_q
       # Events for defning status of the code and trials
       self.recordingEvent = recordingEvent
       self.setEvent = setEvent
@@ -37,20 +103,47 @@ class IMUMonitorThread(multiprocessing.Process):
       # Variable to keep track of trial ongoing
       self.fileNumber = -1
       self.repeatNumber = 0
-      # Array creation to store data during trial
-      self.trial_data = np.zeros((50000,7))*np.NAN
-      self.iteration = 0
+      # Semaphore released once the file of a trial is closed, the file of the next trial is then prepared
+      self.trialClosed = trialClosed
+      self.filePrefix = None
+      # Channels read from the IMU and target sample rate in Hz
+      self.channels = channels
+      self.sample_rate = sample_rate
+      self.overruns = 0
+      # Schedule in seconds for flushing and syncing the trial file to disk during the trial
+      self.flush_interval = flush_interval
+      self.fsync_interval = fsync_interval
+      # Format of the trial files, 'csv' or 'binary'
+      self.fileType = TRIAL_FILE_TYPES[file_format]
+      layout = BNO055BurstReader(None, channels)
+      self.header = imu_header(channels)
+      self.metadata = {'units': ["s"] + layout.units, 'sample_rate': sample_rate, 'clock': CLOCK_NAME}
+      # Buffer creation to store data during trial, it grows with the length of the trial
+      self.trial_data = TrialBuffer(len(self.header), chunk_rows=400)
+      # Shared HealthBoard where the live statistics of the process are published for the GUI
+      self.health = health
       # Event defining the end of the init function
       self.alive = multiprocessing.Event()
       self.alive.set()
         
    def run(self):
          # Creating board readout 
-         self.i2c = board.I2C()
-         self.sensor = adafruit_bno055.BNO055_I2C(self.i2c)
+         startup = StartupTimer('IMU')
+         self.sensor = open_imu(self.backend)
+         self.reader = BNO055BurstReader(self.sensor, self.channels)
+         startup.mark('sensor')
+         # The writer thread streams the trial data to disk
+         self.fileWriter = TrialWriter(self.flush_interval, self.fsync_interval, self.error_q)
+         self.fileWriter.start()
+         startup.mark('writer')
+         startup.report()
         
-         # Set starting time the clock
-         time0 = time.time()
+         # Set starting time the clock, samples are read at fixed deadlines from there
+         time0 = now()
+         period = 1/self.sample_rate
+         deadline = time0
+         cpu = CPUMonitor('IMU')
+         stats = MonitorStats('IMU', self.health)
 
          ### FILE CREATION ###
          while self.alive.is_set():
@@ -60,45 +153,95 @@ class IMUMonitorThread(multiprocessing.Process):
                   fileName = self.msg_q.get()
                   experimentName = self.msg_q.get()
                   folderName = self.msg_q.get()
+                  self.filePrefix = "%s/%s_%s" % (folderName,experimentName,fileName)
+                  self.prepareTrialFile()
                self.getTitle = False   
 
-            # Read data
-            timestamp = time.time()            
-            data = [timestamp,self.sensor.euler[0],self.sensor.euler[1],self.sensor.euler[2],self.sensor.linear_acceleration[0],self.sensor.linear_acceleration[1],self.sensor.linear_acceleration[2]]
+            # Wait for the next deadline, if we are more than a period late the missed deadlines are skipped
+            deadline = deadline + period
+            delay = deadline - now()
+            if delay > 0:
+               time.sleep(delay)
+            elif delay < -period:
+               self.overruns = self.overruns + 1
+               deadline = now()
+
+            # Read data, all channels in one burst stamped with the middle of the transaction
+            before = now()
+            values = self.reader.read()
+            after = now()
+            timestamp = 0.5*(before + after)
+            data = [timestamp] + values
+            # Put the sample in the shared ring buffer for the live plot
+            self.data_stream.write(data)
               
             ### DATA RECORDING ###
             if self.recordingEvent.is_set() and not self.stopEvent.is_set():
                if not self.fileIsCreated:                  
-                    # Create file for data recording
-                    if self.repeatEvent.is_set():
-                        self.fileIsCreated = True
-                        self.repeatNumber = self.repeatNumber + 1 
-                        self.txtfilepath = "%s/%s_%s_IMU_%i_%i.csv" % (folderName,experimentName,fileName,self.fileNumber,self.repeatNumber)          
-                    else:
-                        self.fileNumber = self.fileNumber+1
-                        self.fileIsCreated = True
-                        self.txtfilepath = "%s/%s_%s_IMU_%i.csv" % (folderName,experimentName,fileName,self.fileNumber)          
-                    self.fileHandle = open(self.txtfilepath,"w",newline='')
-                    self.writer = csv.writer(self.fileHandle,delimiter=',')
-                    print("Writing file header...\n")
-                    self.writer.writerow(["Time","Eula1","Eula2","Eula3","linA1","linA2","linA3"])
-               else:                  
-                  # Start storing data in the np array
-                  self.fileIsClosed = False
-                  self.trial_data[self.iteration,:] = data
-               
-               self.iteration = self.iteration+1
+                  # Create file for data recording, the file prepared for this trial is used if there is one
+                  self.txtfilepath = self.trialPath(self.repeatEvent.is_set())
+                  if self.repeatEvent.is_set():
+                     self.repeatNumber = self.repeatNumber + 1 
+                  else:
+                     self.fileNumber = self.fileNumber+1
+                  self.fileIsCreated = True
+                  print("Writing file header...\n")
+                  self.fileWriter.open(self.txtfilepath,self.header,self.fileType,self.metadata)
+                  self.fileWriter.update_metadata(dict(self.metadata, **clock_metadata()))
+                  stats.reset()
+               # Start storing data in the buffer from the sample read in the pass that created the file,
+               # full chunks are handed to the writer
+               self.fileIsClosed = False
+               self.trial_data.append(data)
+               for block in self.trial_data.take_full():
+                  self.fileWriter.write(block)
+
+            ### STATISTICS ###
+            # The read latency is the length of the I2C transaction
+            stats.add_samples(timestamp)
+            stats.add_read_latency(after - before)
+            stats.set_fill(self.fileWriter.requests.qsize())
+            stats.set_write_errors(self.fileWriter.errorCount)
+            stats.publish(after, self.fileWriter.latency, cpu)
 
             ### END OF TRIAL ###             
             if self.stopEvent.is_set() and not self.fileIsClosed:
-               self.writer.writerows(self.trial_data)
-               self.fileHandle.close()   
-               self.trial_data = np.zeros((50000,7))*np.NAN
-               self.iteration = 0       
-               self.stopEvent.clear()
+               for block in self.trial_data.take_all():
+                  self.fileWriter.write(block)
+               self.fileWriter.update_metadata(dict(stats=stats.summary(), overruns=self.overruns))
+               self.fileWriter.close()
                self.fileIsCreated = False
                self.fileIsClosed = True
                print("Finished acquiring data")
+               print("Missed IMU deadlines: %i" % self.overruns)
+               stats.report()
+               cpu.report()
+               self.prepareTrialFile()
+               if self.trialClosed is not None:
+                  self.trialClosed.release()
+
+         # clean up, data of a trial still running is written
+         cpu.report()
+         for block in self.trial_data.take_all():
+            self.fileWriter.write(block)
+         if self.fileIsCreated:
+            self.fileWriter.update_metadata(dict(stats=stats.summary(), overruns=self.overruns))
+         self.fileWriter.stop()
+
+   def trialPath(self, repeat):
+      ''' Path of the file of the next trial, a repeat of the last trial or a new trial '''
+      if repeat:
+         number = "%i_%i" % (self.fileNumber, self.repeatNumber + 1)
+      else:
+         number = "%i" % (self.fileNumber + 1)
+      return "%s_IMU_%s.%s" % (self.filePrefix, number, self.fileType.extension)
+
+   def prepareTrialFile(self):
+      ''' Creates the file and the first buffer chunk of the next trial while waiting for it, a repeat if the repeat event is set '''
+      if self.filePrefix is None:
+         return
+      self.fileWriter.prepare(self.trialPath(self.repeatEvent.is_set()), self.header, self.fileType, self.metadata)
+      self.trial_data.reserve()
 
    def join(self, timeout=None):
         self.alive.clear()
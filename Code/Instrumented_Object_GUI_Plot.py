@@ -0,0 +1,116 @@
+'''
+Plot model of the live graphs of the GUI.
+The rows read from a live stream are kept in a numpy ring buffer covering the plot window, written
+twice so that the window is always a contiguous view. Before drawing, a channel of the window is reduced
+to the minimum and maximum of each pixel column. The reduced columns are kept from one redraw to the
+next and only the columns completed by the new rows are reduced, so the cost of a redraw depends on the
+width of the plot and the rows that arrived, not on the length of the window or the sample rate.
+'''
+import numpy as np
+
+class PlotModel:
+
+    def __init__(self, header, window=10.0, sample_rate=200):
+        ''' header names the columns of the rows, the first one being the time in seconds '''
+        self.header = list(header)
+        self.window = window
+        self.capacity = int(np.ceil(window*sample_rate)) + 1
+        self.data = np.zeros((2*self.capacity, len(self.header)))
+        self.position = 0
+        self.count = 0
+        # Rows appended since the start, and min/max reductions kept for each column of the rows drawn
+        self.total = 0
+        self.reductions = {}
+
+    def append(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.header))
+        self.total = self.total + len(rows)
+        rows = rows[-self.capacity:]
+        n = len(rows)
+        if n == 0:
+            return
+        # Each row goes at its position and one capacity further, in at most two slices
+        first = min(n, self.capacity - self.position)
+        for offset in (0, self.capacity):
+            start = self.position + offset
+            self.data[start:start+first] = rows[:first]
+            self.data[offset:offset+n-first] = rows[first:]
+        self.position = (self.position + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def rows(self):
+        ''' The rows in the ring buffer, oldest first, as a view '''
+        return self.data[self.position + self.capacity - self.count:self.position + self.capacity]
+
+    def channel(self, name, width=None):
+        '''
+        Returns the time relative to the last sample and the values of a channel over the plot window,
+        reduced to at most 2*width points when width is given
+        '''
+        rows = self.rows()
+        if len(rows) == 0:
+            return np.zeros(0), np.zeros(0)
+        t = rows[:,0]
+        start = np.searchsorted(t, t[-1] - self.window)
+        column = self.header.index(name)
+        if width:
+            # The step follows the rows kept rather than the rows of the window, which change by one from a call to the next
+            step = int(np.ceil(len(rows)/max(int(width), 1)))
+            if step > 2:
+                return self.reduced(column, start, step)
+        return t[start:] - t[-1], rows[start:, column]
+
+    def reduced(self, column, start, step):
+        '''
+        Min/max decimation of a column from row start, by columns of step samples. The columns are aligned on the
+        number of the sample since the first append, so that the reduction of a column never changes: it is kept
+        and only the columns completed since the last call are reduced. The samples before the first and after
+        the last complete column are drawn as they are.
+        '''
+        rows = self.rows()
+        first = self.total - len(rows)
+        # Numbers of the first and after the last complete columns in the window
+        b0 = -(-(first + start)//step)
+        b1 = self.total//step
+        cache = self.reductions.get(column)
+        if cache is None or cache['step'] != step:
+            size = self.capacity//step + 2
+            cache = {'step': step, 'done': b0, 'time': np.zeros(size), 'values': np.zeros((size, 2))}
+            self.reductions[column] = cache
+        size = len(cache['time'])
+        done = max(cache['done'], b0)
+        if b1 > done:
+            blocks = rows[done*step - first:b1*step - first].reshape(-1, step, len(self.header))
+            index = np.arange(done, b1) % size
+            cache['time'][index] = blocks[:,0,0]
+            cache['values'][index] = minmax(blocks[:,:,column])
+            cache['done'] = b1
+        index = np.arange(b0, max(b0, b1)) % size
+        t = rows[:,0]
+        head = slice(start, max(start, b0*step - first))
+        tail = slice(max(start, b1*step - first), len(rows))
+        x = np.concatenate([t[head], np.repeat(cache['time'][index], 2), t[tail]]) - t[-1]
+        y = np.concatenate([rows[head, column], cache['values'][index].ravel(), rows[tail, column]])
+        return x, y
+
+def minmax(blocks):
+    ''' Minimum and maximum of each row of blocks, in the order in which they occur, as (N,2) '''
+    lowFirst = blocks.argmin(axis=1) <= blocks.argmax(axis=1)
+    low, high = blocks.min(axis=1), blocks.max(axis=1)
+    values = np.empty((len(blocks), 2))
+    values[:,0] = np.where(lowFirst, low, high)
+    values[:,1] = np.where(lowFirst, high, low)
+    return values
+
+def decimate(x, y, width):
+    ''' Min/max decimation of y to width columns of equal number of samples, keeps peaks of any length '''
+    width = max(int(width), 1)
+    n = len(y)
+    step = int(np.ceil(n/width))
+    if step <= 2:
+        return x, y
+    full = (n//step)*step
+    # Minimum and maximum of each column, drawn in the order in which they occur
+    yd = minmax(y[:full].reshape(-1, step))
+    xd = np.repeat(x[:full:step], 2)
+    return np.concatenate([xd, x[full:]]), np.concatenate([yd.ravel(), y[full:]])
@@ -0,0 +1,90 @@
+'''
+Trial protocol scheduler: runs a list of timed trials back to back on an AcquisitionSession, with the
+repeats of each trial and the rest between trials, using the same start/stop/repeat machinery as the
+buttons of the GUI. Each recording starts and stops at a fixed time from the start of the protocol, the
+sum of the durations and intervals before it on the monotonic clock, so that the time taken to start and
+stop the processes does not add up over the protocol: a recording started late (the processes were late
+to close the previous one) is shortened rather than delaying the rest of the protocol. Before each stop
+the processes are told whether the next trial is a repeat, so that they prepare its files while waiting for it.
+
+Protocol file (JSON), a list of trials, each recorded once then repeated "repeats" times:
+    [{"duration": 10, "repeats": 2, "interval": 5},
+     {"duration": 30, "interval": 10}]
+"duration" is the length of each recording and "interval" the rest after each recording, in seconds.
+'''
+import json
+import time
+import threading
+
+def load_protocol(path):
+    ''' Reads a protocol file, returns the list of trials with the default repeats and interval filled in '''
+    with open(path) as fileHandle:
+        protocol = json.load(fileHandle)
+    trials = []
+    for i, trial in enumerate(protocol):
+        if float(trial.get('duration', 0)) <= 0:
+            raise ValueError("%s: trial %i has no duration" % (path, i))
+        trials.append({'duration': float(trial['duration']), 'repeats': int(trial.get('repeats', 0)),
+                       'interval': float(trial.get('interval', 0))})
+    return trials
+
+def protocol_recordings(protocol):
+    ''' List of (trial index, repeat, duration, interval) of the recordings of a protocol, in order '''
+    recordings = []
+    for i, trial in enumerate(protocol):
+        for r in range(trial.get('repeats', 0) + 1):
+            recordings.append((i, r > 0, trial['duration'], trial.get('interval', 0)))
+    return recordings
+
+class TrialScheduler(threading.Thread):
+
+    def __init__(self, session, protocol, stop_timeout=5.0):
+        threading.Thread.__init__(self, daemon=True)
+        self.session = session
+        self.recordings = protocol_recordings(protocol)
+        # Longest wait for the processes to close a trial before the next one is started anyway
+        self.stop_timeout = stop_timeout
+        self.cancelled = threading.Event()
+        # (start, stop) of each recording on the monotonic clock, and the recordings the processes were late to close
+        self.times = []
+        self.late = 0
+
+    def cancel(self):
+        ''' Stops the protocol, the trial being recorded is stopped right away '''
+        self.cancelled.set()
+
+    def wait_until(self, deadline):
+        ''' Waits for a deadline, returns False if the protocol was cancelled meanwhile '''
+        return not self.cancelled.wait(max(0, deadline - time.monotonic()))
+
+    def run(self):
+        # Start of the next recording from the start of the protocol
+        deadline = time.monotonic()
+        for k, (trial, repeat, duration, interval) in enumerate(self.recordings):
+            if not self.wait_until(deadline):
+                break
+            self.session.start_trial(repeat)
+            start = time.monotonic()
+            print("Protocol: trial %i%s started (%i/%i)" % (trial, " repeat" if repeat else "", k + 1, len(self.recordings)))
+            self.wait_until(deadline + duration)
+            # The next recording decides the files the processes prepare
+            nextRepeat = self.recordings[k+1][1] if k + 1 < len(self.recordings) else False
+            self.session.stop_trial(nextRepeat)
+            stop = time.monotonic()
+            self.times.append((start, stop))
+            if not self.session.wait_stopped(self.stop_timeout):
+                self.late = self.late + 1
+                print("Protocol: the processes did not close trial %i within %.1f s" % (trial, self.stop_timeout))
+            deadline = deadline + duration + interval
+            if self.cancelled.is_set():
+                break
+        self.report()
+
+    def report(self):
+        if not self.times:
+            return
+        lengths = [stop - start for start, stop in self.times]
+        gaps = [self.times[k+1][0] - self.times[k][1] for k in range(len(self.times) - 1)]
+        print("Protocol: %i/%i recordings, length %.3f-%.3f s, %s%i late stops" %
+              (len(self.times), len(self.recordings), min(lengths), max(lengths),
+               "gap %.3f-%.3f s, " % (min(gaps), max(gaps)) if gaps else "", self.late))
@@ -0,0 +1,200 @@
+'''
+Acquisition session: the ATI, IMU and camera processes with the shared streams, queues and events
+that drive them. It is used by the GUI and by the headless mode, so that trials are controlled and
+recorded in the same files whichever of them starts the trials.
+'''
+import time
+import multiprocessing
+from Instrumented_Object_GUI_IMU import IMUMonitorThread, imu_header, DEFAULT_CHANNELS
+from Instrumented_Object_GUI_Utils import ATIMonitorThread
+from Instrumented_Object_GUI_Camera import CameraMonitorThread
+from Instrumented_Object_GUI_Stream import SharedRingBuffer
+from Instrumented_Object_GUI_Control import StateNotifier
+from Instrumented_Object_GUI_Backend import make_led, ati_port
+from Instrumented_Object_GUI_Stats import HealthBoard
+from Instrumented_Object_GUI_Filter import ForceProcessor
+
+# Camera settings offered to the user, "<width>x<height>/<fps>fps"
+CAMERA_PRESETS = ["1280x720/60fps", "1920x1080/30fps"]
+
+def parse_camera_preset(preset):
+    ''' Returns the frame rate and the resolution of a camera preset '''
+    resolution, fps = preset.split("/")
+    width, height = resolution.split("x")
+    return int(fps.split("f")[0]), (int(width), int(height))
+
+class AcquisitionSession:
+
+    def __init__(self, software_bias=None, file_format='csv', port="/dev/ttyUSB0", backend=None, contact=None,
+                 pre_event=1.0, post_event=1.0, imu_channels=DEFAULT_CHANNELS):
+        # Creating all the required processes and events for the different processes that will run in parallel
+        self.ATIStream          = SharedRingBuffer(4096, 7)
+        self.ATIMsg_q           = multiprocessing.Queue()
+        self.ATIError_q         = multiprocessing.Queue()
+        self.ATIProcessedStream = SharedRingBuffer(4096, len(ForceProcessor.header))
+        # The IMU rows have a column per value of the channels read
+        self.IMUStream          = SharedRingBuffer(4096, len(imu_header(imu_channels)))
+        self.IMUMsg_q           = multiprocessing.Queue()
+        self.IMUError_q         = multiprocessing.Queue()
+        self.cameraMsg_q        = multiprocessing.Queue()
+        self.cameraError_q      = multiprocessing.Queue()
+
+        self.dataRecordingEvent = multiprocessing.Event()
+        self.setEvent           = multiprocessing.Event()
+        self.stopEvent          = multiprocessing.Event()
+        self.biasEvent          = multiprocessing.Event()
+        self.endEvent           = multiprocessing.Event()
+        self.previewEvent       = multiprocessing.Event()
+        self.repeatEvent        = multiprocessing.Event()
+        # Trials started and stopped by the grasps detected on the forces (contact settings given)
+        self.autoEvent          = multiprocessing.Event()
+        # Wakes up the processes waiting for a change of the events above
+        self.stateChange        = StateNotifier()
+        # Released by each process once it closed the files of a trial
+        self.trialClosed        = multiprocessing.Semaphore(0)
+        # Live statistics published by each process
+        self.ATIHealth          = HealthBoard()
+        self.IMUHealth          = HealthBoard()
+        self.cameraHealth       = HealthBoard()
+
+        self.led0 = make_led(23, backend)
+        self.led1 = make_led(24, backend)
+
+        self.ATIMonitor         = ATIMonitorThread(self.ATIStream,
+                                self.ATIMsg_q,
+                                self.ATIError_q,
+                                self.dataRecordingEvent,
+                                self.setEvent,
+                                self.stopEvent,
+                                self.biasEvent,
+                                self.endEvent,
+                                self.repeatEvent,
+                                ati_port(port, backend),
+                                115200,
+                                file_format=file_format,
+                                health=self.ATIHealth,
+                                processed_stream=self.ATIProcessedStream,
+                                software_bias=software_bias,
+                                trialClosed=self.trialClosed,
+                                contact=contact,
+                                autoTrigger=self.autoEvent,
+                                pre_event=pre_event,
+                                post_event=post_event,
+                                stateChange=self.stateChange)
+
+        self.IMUMonitor         = IMUMonitorThread(self.IMUStream, self.IMUMsg_q,
+                                self.setEvent,
+                                self.dataRecordingEvent,
+                                self.stopEvent,
+                                self.repeatEvent,
+                                file_format=file_format,
+                                channels=imu_channels,
+                                backend=backend,
+                                health=self.IMUHealth,
+                                trialClosed=self.trialClosed,
+                                error_q=self.IMUError_q)
+
+        self.CameraMonitor      = CameraMonitorThread(self.setEvent,
+                                self.dataRecordingEvent,
+                                self.previewEvent,
+                                self.stopEvent,
+                                self.repeatEvent,
+                                self.cameraMsg_q,
+                                self.led0,
+                                self.led1,
+                                self.stateChange,
+                                backend=backend,
+                                health=self.cameraHealth,
+                                trialClosed=self.trialClosed,
+                                error_q=self.cameraError_q)
+
+    def start(self):
+        ''' Starts the processes, the devices are initialised in parallel '''
+        self.ATIMonitor.start()
+        self.IMUMonitor.start()
+        self.CameraMonitor.start()
+
+    def setup(self, participantID, experimentID, folderName, cameraPreset=CAMERA_PRESETS[0]):
+        ''' Sends the names of the trial files and the camera settings to the processes '''
+        fps, resolution = parse_camera_preset(cameraPreset)
+        self.cameraMsg_q.put(fps)
+        self.cameraMsg_q.put(resolution)
+        self.cameraMsg_q.put(participantID)
+        self.cameraMsg_q.put(experimentID)
+        self.cameraMsg_q.put(folderName)
+
+        self.ATIMsg_q.put(participantID)
+        self.ATIMsg_q.put(experimentID)
+        self.ATIMsg_q.put(folderName)
+
+        self.IMUMsg_q.put(participantID)
+        self.IMUMsg_q.put(experimentID)
+        self.IMUMsg_q.put(folderName)
+
+        self.setEvent.set()
+        self.stateChange.notify()
+
+    def start_trial(self, repeat=False):
+        ''' Starts recording a new trial, or a repeat of the last trial '''
+        # Acknowledgements of a trial that was stopped without waiting for the processes
+        while self.trialClosed.acquire(False):
+            pass
+        if repeat:
+            self.repeatEvent.set()
+        else:
+            self.repeatEvent.clear()
+        self.stopEvent.clear()
+        self.dataRecordingEvent.set()
+        self.stateChange.notify()
+
+    def stop_trial(self, next_repeat=None):
+        ''' Stops the trial, next_repeat tells the processes if the next trial is a repeat so that they prepare its files '''
+        if next_repeat is not None:
+            if next_repeat:
+                self.repeatEvent.set()
+            else:
+                self.repeatEvent.clear()
+        self.stopEvent.set()
+        self.stateChange.notify()
+
+    def wait_stopped(self, timeout=5.0):
+        ''' Waits until the ATI, IMU and camera processes closed the trial, False if one of them did not within timeout '''
+        deadline = time.monotonic() + timeout
+        for i in range(3):
+            if not self.trialClosed.acquire(timeout=max(0, deadline - time.monotonic())):
+                return False
+        return True
+
+    def errors(self):
+        ''' Errors reported by the processes since the last call, as "<process>: <message>" '''
+        messages = []
+        for name, errorQueue in (('ATI', self.ATIError_q), ('IMU', self.IMUError_q), ('Camera', self.cameraError_q)):
+            while not errorQueue.empty():
+                messages.append("%s: %s" % (name, errorQueue.get()))
+        return messages
+
+    def set_auto(self, enabled):
+        ''' Lets the ATI process start a trial on each grasp and stop it after the release '''
+        if enabled:
+            self.autoEvent.set()
+        else:
+            self.autoEvent.clear()
+
+    def bias(self):
+        self.biasEvent.set()
+        self.stateChange.notify()
+
+    def toggle_preview(self):
+        self.previewEvent.set()
+        self.stateChange.notify()
+
+    def close(self):
+        ''' Stops the processes and frees the shared memory of the live streams '''
+        for name, monitor in (('ATI', self.ATIMonitor), ('IMU', self.IMUMonitor), ('camera', self.CameraMonitor)):
+            if monitor is not None:
+                print('closing %s process' % name)
+                monitor.join()
+                monitor.close()
+        for stream in (self.ATIStream, self.ATIProcessedStream, self.IMUStream):
+            stream.close()
+            stream.unlink()
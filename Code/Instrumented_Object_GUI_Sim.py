@@ -0,0 +1,279 @@
+'''
+Simulated devices used to run the acquisition pipeline without the instrumented object.
+ATISimulator is a fake ATI controller behind a pseudo terminal: it answers the SB/SF/TF/TC/QS commands
+and streams frames at any rate, so ATIMonitorThread reads it through pyserial like the real one.
+SimBNO055 serves synthetic BNO055 registers through the same I2C interface the burst reader uses,
+FakeCamera produces frames (H.264 like NAL units) and GPU timestamps through the picamera API, and
+FakeLED replaces the gpiozero leds.
+'''
+import os
+import pty
+import tty
+import select
+import struct
+import threading
+import multiprocessing
+import collections
+import time
+import numpy as np
+
+def grasp_profile(t, period=5.0, hold=2.0, ramp=0.2, amplitude=10.0):
+    ''' Synthetic grip force: every period a smooth ramp to amplitude, held for hold seconds, then released '''
+    phase = np.mod(t, period)
+    rise = np.clip(phase/ramp, 0, 1)
+    fall = np.clip((ramp + hold + ramp - phase)/ramp, 0, 1)
+    shape = np.minimum(rise, fall)
+    return amplitude*(3*shape**2 - 2*shape**3)
+
+class ATISimulator(multiprocessing.Process):
+
+    def __init__(self, rate=200, noise=0.02, seed=0):
+        multiprocessing.Process.__init__(self, daemon=True)
+        self.rate = rate
+        self.noise = noise
+        self.seed = seed
+        # The pseudo terminal is created in the simulator process, its name is sent back through this queue
+        self.port_q = multiprocessing.Queue()
+        self.port = None
+
+    def start(self):
+        ''' Starts the simulator and returns the name of the serial port to open '''
+        multiprocessing.Process.start(self)
+        self.port = self.port_q.get()
+        return self.port
+
+    def run(self):
+        master, slave = pty.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        self.port_q.put(os.ttyname(slave))
+        rng = np.random.RandomState(self.seed)
+        bias = np.zeros(6)
+        streaming = False
+        sent = 0
+        start = time.monotonic()
+        commands = b''
+        while True:
+            if streaming:
+                timeout = max(0.0, start + (sent + 1)/self.rate - time.monotonic())
+            else:
+                timeout = 0.5
+            readable, _, _ = select.select([master], [], [], timeout)
+            if readable:
+                try:
+                    commands = commands + os.read(master, 1024)
+                except OSError:
+                    commands = b''
+                # Any input stops the data stream, like on the controller
+                streaming = False
+                while b'\r' in commands or b'\n' in commands:
+                    end = min(i for i in (commands.find(b'\r'), commands.find(b'\n')) if i >= 0)
+                    line = commands[:end].strip().decode(errors='replace')
+                    commands = commands[end+1:]
+                    if not line:
+                        continue
+                    command = line.split()[0].upper()
+                    if command == 'SB':
+                        bias = self.signal(np.array([time.monotonic()]), rng, 0)[0]
+                    elif command == 'QS':
+                        streaming = True
+                        start = time.monotonic()
+                        sent = 0
+                    self.send(master, ('%s\r\n>' % line).encode())
+            if streaming:
+                # Frames due since the last pass are sent in one write
+                due = int((time.monotonic() - start)*self.rate) - sent
+                if due > 0:
+                    t = start + (sent + np.arange(1, due + 1))/self.rate
+                    counts = np.round((self.signal(t, rng, self.noise) - bias)*[200, 200, 200, 8000, 8000, 8000]).astype(int)
+                    text = ''.join('0,%d,%d,%d,%d,%d,%d\r\n' % tuple(r) for r in counts.tolist())
+                    self.send(master, text.encode())
+                    sent = sent + due
+
+    def signal(self, t, rng, noise):
+        ''' Forces [N] and torques [Nm] at times t, an (N,6) array '''
+        fz = grasp_profile(t)
+        values = np.stack([0.05*fz, -0.02*fz, fz, 0.001*fz, -0.002*fz, 0.0005*np.sin(t)], axis=1)
+        return values + noise*rng.standard_normal(values.shape)
+
+    def send(self, master, data):
+        # The data is lost if the reader does not keep up and the terminal buffer is full, like a serial overrun
+        try:
+            os.write(master, data)
+        except BlockingIOError:
+            pass
+
+class SimI2CDevice:
+    ''' Serves the registers of a SimBNO055 like adafruit_bus_device.I2CDevice '''
+
+    def __init__(self, sensor, transaction_time):
+        self.sensor = sensor
+        self.transaction_time = transaction_time
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write_then_readinto(self, out_buffer, in_buffer):
+        if self.transaction_time:
+            time.sleep(self.transaction_time)
+        registers = self.sensor.registers()
+        start = out_buffer[0]
+        in_buffer[:] = registers[start:start+len(in_buffer)]
+
+class SimBNO055:
+    ''' Synthetic BNO055: slow rotation and oscillating linear acceleration, computed at each read '''
+
+    def __init__(self, transaction_time=0.0):
+        self.i2c_device = SimI2CDevice(self, transaction_time)
+        self.start = time.monotonic()
+
+    def values(self):
+        t = time.monotonic() - self.start
+        euler = np.array([np.mod(10*t, 360), 20*np.sin(0.5*t), 10*np.cos(0.3*t)])
+        acceleration = np.array([0.5*np.sin(2*t), 0.3*np.cos(3*t), 0.2*np.sin(5*t)])
+        gyro = np.radians([10, 10*np.cos(0.5*t), -3*np.sin(0.3*t)])
+        h, r, p = np.radians(euler)/2
+        quaternion = np.array([np.cos(h)*np.cos(r)*np.cos(p) + np.sin(h)*np.sin(r)*np.sin(p),
+                               np.cos(h)*np.sin(r)*np.cos(p) - np.sin(h)*np.cos(r)*np.sin(p),
+                               np.cos(h)*np.cos(r)*np.sin(p) + np.sin(h)*np.sin(r)*np.cos(p),
+                               np.sin(h)*np.cos(r)*np.cos(p) - np.cos(h)*np.sin(r)*np.sin(p)])
+        return euler, acceleration, gyro, quaternion
+
+    def registers(self):
+        euler, acceleration, gyro, quaternion = self.values()
+        memory = bytearray(0x40)
+        struct.pack_into('<3h', memory, 0x14, *np.round(gyro*180*16/np.pi).astype(int))
+        struct.pack_into('<3h', memory, 0x1A, *np.round(euler*16).astype(int))
+        struct.pack_into('<4h', memory, 0x20, *np.round(quaternion*(1 << 14)).astype(int))
+        struct.pack_into('<3h', memory, 0x28, *np.round(acceleration*100).astype(int))
+        memory[0x35] = 0xFF
+        return memory
+
+    @property
+    def euler(self):
+        return tuple(self.values()[0])
+
+    @property
+    def linear_acceleration(self):
+        return tuple(self.values()[1])
+
+# Frame types of picamera.PiVideoFrameType
+FRAME_TYPE_FRAME = 0
+FRAME_TYPE_KEY_FRAME = 1
+FRAME_TYPE_SPS_HEADER = 2
+
+FakeFrame = collections.namedtuple('FakeFrame', ['index', 'frame_type', 'frame_size', 'timestamp', 'complete'])
+
+class FakeCamera:
+    '''
+    Stand-in for picamera.PiCamera. While recording, a thread produces one frame per frame period and
+    passes it to the output in the same way as the encoder: a header buffer (SPS/PPS) before every key
+    frame, key frames split in two buffers, camera.frame describing the buffer being written.
+    The GPU clock runs with a small drift from the host clock, and frames can be dropped at random.
+    '''
+    def __init__(self, drift_ppm=20.0, drop_rate=0.0, intra_period=30, frame_size=2000, seed=0):
+        self.resolution = (1280, 720)
+        self.framerate = 30
+        self.color_effects = None
+        self.recording = False
+        self.previewing = False
+        self.frame = None
+        self.drift = drift_ppm*1e-6
+        self.drop_rate = drop_rate
+        self.intra_period = intra_period
+        self.frame_size = frame_size
+        self.rng = np.random.RandomState(seed)
+        self.start = time.monotonic()
+        self.thread = None
+        self.error = None
+
+    @property
+    def timestamp(self):
+        ''' GPU clock in us '''
+        return int((time.monotonic() - self.start)*(1 + self.drift)*1e6)
+
+    def start_preview(self, **options):
+        self.previewing = True
+
+    def stop_preview(self):
+        self.previewing = False
+
+    def start_recording(self, output, format='h264'):
+        self.ownsOutput = isinstance(output, str)
+        self.output = open(output, "wb") if self.ownsOutput else output
+        self.recording = True
+        self.thread = threading.Thread(target=self.encode, daemon=True)
+        self.thread.start()
+
+    def wait_recording(self, timeout=0):
+        if self.error is not None:
+            raise self.error
+        if timeout:
+            time.sleep(timeout)
+
+    def stop_recording(self):
+        self.recording = False
+        self.thread.join()
+        if hasattr(self.output, 'flush'):
+            self.output.flush()
+        if self.ownsOutput:
+            self.output.close()
+
+    def close(self):
+        if self.recording:
+            self.stop_recording()
+
+    def encode(self):
+        period = 1/self.framerate
+        deadline = time.monotonic()
+        index = 0
+        try:
+            while self.recording:
+                deadline = deadline + period
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                timestamp = self.timestamp
+                if self.drop_rate and self.rng.random_sample() < self.drop_rate:
+                    index = index + 1
+                    continue
+                if index % self.intra_period == 0:
+                    header = self.nal(7, 20) + self.nal(8, 4)
+                    self.emit(header, index, FRAME_TYPE_SPS_HEADER, None, True)
+                    data = self.nal(5, self.frame_size*4)
+                    half = len(data)//2
+                    self.emit(data[:half], index, FRAME_TYPE_KEY_FRAME, timestamp, False)
+                    self.emit(data[half:], index, FRAME_TYPE_KEY_FRAME, timestamp, True)
+                else:
+                    self.emit(self.nal(1, self.frame_size), index, FRAME_TYPE_FRAME, timestamp, True)
+                index = index + 1
+        except Exception as e:
+            self.error = e
+
+    def emit(self, data, index, frameType, timestamp, complete):
+        self.frame = FakeFrame(index, frameType, len(data), timestamp, complete)
+        self.output.write(data)
+
+    def nal(self, nalType, size):
+        # Annex B start code, NAL header, and a payload that cannot contain a start code. Slices start
+        # with first_mb_in_slice = 0, a frame is a single slice
+        payload = self.rng.randint(0x10, 0x100, size).astype(np.uint8)
+        if nalType in (1, 5):
+            payload[0] = payload[0] | 0x80
+        payload = payload.tobytes()
+        return b'\x00\x00\x00\x01' + bytes([0x60 | nalType]) + payload
+
+class FakeLED:
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.is_lit = False
+
+    def on(self):
+        self.is_lit = True
+
+    def off(self):
+        self.is_lit = False
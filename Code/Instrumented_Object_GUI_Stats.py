@@ -0,0 +1,191 @@
+'''
+Runtime instrumentation of the acquisition processes.
+Each process keeps a MonitorStats with histograms of the intervals between samples, of the read latency
+and of the write latency, the number of malformed frames, the errors of its writer threads and the fill level
+of its queues and buffers.
+The ATI samples are read from the serial port in batches and stamped backwards from the time of the read,
+so for the ATI the intervals are those between reads, and the size of the batches and the time they wait
+in the queue of the reader thread (queue latency) are kept as well.
+Histograms have fixed logarithmic bins, so adding a whole batch of values is a couple of numpy calls.
+A summary of each trial is saved in the trial metadata, and a few live values are published about once
+per second in a HealthBoard, a small shared array read by the GUI.
+'''
+import multiprocessing
+import numpy as np
+
+class Histogram:
+    ''' Histogram of durations in seconds with logarithmic bins from low to high '''
+
+    def __init__(self, low=1e-6, high=10.0, bins=140):
+        self.edges = np.logspace(np.log10(low), np.log10(high), bins + 1)
+        self.reset()
+
+    def reset(self):
+        # First and last bins count the values out of range
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, values):
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if values.size == 0:
+            return
+        self.counts = self.counts + np.bincount(np.searchsorted(self.edges, values), minlength=len(self.counts))
+        self.count = self.count + values.size
+        self.total = self.total + float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+    def percentile(self, q):
+        ''' Upper edge of the bin holding the q-th percentile, at most the largest value added '''
+        if self.count == 0:
+            return None
+        index = int(np.searchsorted(np.cumsum(self.counts), q/100*self.count))
+        return min(float(self.edges[min(index, len(self.edges) - 1)]), self.max)
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total/self.count, 'max': self.max,
+                'p50': self.percentile(50), 'p99': self.percentile(99)}
+
+# Values published in the health board, in this order
+HEALTH_FIELDS = ['rate', 'interval_p99_ms', 'interval_max_ms', 'malformed', 'fill', 'read_latency_p99_ms',
+                 'queue_latency_p99_ms', 'write_latency_p99_ms', 'write_errors', 'cpu']
+
+class HealthBoard:
+    ''' Live health values of one process, shared with the GUI '''
+
+    def __init__(self):
+        self.values = multiprocessing.Array('d', [np.nan]*len(HEALTH_FIELDS), lock=False)
+
+    def publish(self, values):
+        for i, field in enumerate(HEALTH_FIELDS):
+            value = values.get(field)
+            self.values[i] = np.nan if value is None else value
+
+    def read(self):
+        return dict(zip(HEALTH_FIELDS, self.values[:]))
+
+class MonitorStats:
+
+    def __init__(self, name, board=None, publish_interval=1.0):
+        self.name = name
+        self.board = board
+        self.publish_interval = publish_interval
+        self.intervals = Histogram()
+        self.readLatency = Histogram()
+        self.queueLatency = Histogram()
+        # Number of samples of each read, for the sensors read in batches
+        self.batchSizes = Histogram(1, 1e5, 50)
+        self.lastTimestamp = None
+        self.lastPublish = None
+        # Samples since the start of the process, for the live rate
+        self.liveSamples = 0
+        self.publishedSamples = 0
+        self.malformedTotal = 0
+        self.writeErrorsTotal = 0
+        self.reset()
+
+    def reset(self):
+        ''' Starts the statistics of a new trial '''
+        self.intervals.reset()
+        self.readLatency.reset()
+        self.queueLatency.reset()
+        self.batchSizes.reset()
+        self.samples = 0
+        # Malformed frames are counted from the start of the trial
+        self.malformedBase = self.malformedTotal
+        self.malformed = 0
+        self.writeErrorsBase = self.writeErrorsTotal
+        self.writeErrors = 0
+        self.fill = 0
+        self.peakFill = 0
+
+    def add_samples(self, timestamps):
+        ''' Adds the timestamps of a batch of samples '''
+        timestamps = np.atleast_1d(timestamps)
+        if len(timestamps) == 0:
+            return
+        self.samples = self.samples + len(timestamps)
+        self.liveSamples = self.liveSamples + len(timestamps)
+        if self.lastTimestamp is not None:
+            timestamps = np.concatenate([[self.lastTimestamp], timestamps])
+        self.intervals.add(np.diff(timestamps))
+        self.lastTimestamp = timestamps[-1]
+
+    def add_batch(self, timestamp, size):
+        ''' Adds one read of size samples stamped at timestamp, the intervals are then those between reads '''
+        self.add_samples(timestamp)
+        self.samples = self.samples + size - 1
+        self.liveSamples = self.liveSamples + size - 1
+        self.batchSizes.add(size)
+
+    def add_read_latency(self, latency):
+        self.readLatency.add(latency)
+
+    def add_queue_latency(self, latency):
+        ''' Time a batch waited between its read and its processing '''
+        self.queueLatency.add(latency)
+
+    def set_malformed(self, total):
+        ''' Total number of malformed frames counted by the reader since it started '''
+        self.malformedTotal = total
+        self.malformed = total - self.malformedBase
+
+    def set_write_errors(self, total):
+        ''' Total number of errors of the writer threads of the process since they started '''
+        self.writeErrorsTotal = total
+        self.writeErrors = total - self.writeErrorsBase
+
+    def set_fill(self, fill):
+        ''' Number of items waiting in the queues and buffers of the process '''
+        self.fill = fill
+        self.peakFill = max(self.peakFill, fill)
+
+    def summary(self):
+        ''' Statistics of the trial, saved in the trial metadata '''
+        return {'samples': self.samples, 'malformed': self.malformed, 'write_errors': self.writeErrors, 'peak_fill': self.peakFill,
+                'interval': self.intervals.summary(), 'read_latency': self.readLatency.summary(),
+                'queue_latency': self.queueLatency.summary(), 'batch_size': self.batchSizes.summary()}
+
+    def report(self):
+        interval = self.intervals.summary()
+        if interval['count']:
+            print("%s intervals: mean %.2f ms, p99 %.2f ms, max %.2f ms, %i malformed frames" %
+                  (self.name, 1e3*interval['mean'], 1e3*interval['p99'], 1e3*interval['max'], self.malformed))
+        if self.writeErrors:
+            print("%s: %i errors writing the trial files" % (self.name, self.writeErrors))
+        batch = self.batchSizes.summary()
+        if batch['count']:
+            queued = self.queueLatency.summary()
+            print("%s reads: mean %.1f samples, max %i, queue latency p99 %.2f ms" %
+                  (self.name, batch['mean'], batch['max'], 1e3*queued['p99'] if queued['count'] else float('nan')))
+
+    def publish(self, now, writeLatency=None, cpu=None):
+        '''
+        Publishes the live values in the health board, at most once per publish interval.
+        writeLatency is the histogram of the writer thread and cpu the CPUMonitor of the process.
+        '''
+        if self.board is None:
+            return
+        if self.lastPublish is None:
+            self.lastPublish = now
+            self.publishedSamples = self.liveSamples
+            return
+        elapsed = now - self.lastPublish
+        if elapsed < self.publish_interval:
+            return
+        milliseconds = lambda value: None if value is None else 1e3*value
+        self.board.publish({'rate': (self.liveSamples - self.publishedSamples)/elapsed,
+                            'interval_p99_ms': milliseconds(self.intervals.percentile(99)),
+                            'interval_max_ms': 1e3*self.intervals.max,
+                            'malformed': self.malformed,
+                            'fill': self.fill,
+                            'read_latency_p99_ms': milliseconds(self.readLatency.percentile(99)),
+                            'queue_latency_p99_ms': milliseconds(self.queueLatency.percentile(99)),
+                            'write_latency_p99_ms': milliseconds(writeLatency.percentile(99)) if writeLatency is not None else None,
+                            'write_errors': self.writeErrors,
+                            'cpu': cpu.usage() if cpu is not None else None})
+        self.lastPublish = now
+        self.publishedSamples = self.liveSamples
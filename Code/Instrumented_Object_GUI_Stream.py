@@ -0,0 +1,131 @@
+'''
+Shared memory ring buffer used to stream the live data of a sensor from its acquisition process to the GUI.
+There is a single writer, the acquisition process, which copies numpy rows in the ring and then publishes
+them by increasing a sequence counter. Readers never lock: they read the counter and get the latest rows
+as a view on the shared memory. Every row is written twice (at i and i+rows) so that the last N rows are
+always contiguous and can be returned without copying.
+The ring is bounded and the writer never waits for the readers, so a slow reader never holds up the acquisition:
+rows it did not read in time are overwritten. Readers can also bound what they take at each read with a
+StreamReader policy, and count the rows they lost or dropped.
+'''
+from multiprocessing import shared_memory
+import numpy as np
+
+# Bytes reserved at the start of the shared memory for the sequence counter
+HEADER_SIZE = 64
+
+class SharedRingBuffer:
+
+    def __init__(self, rows, columns, name=None, create=True):
+        self.rows = rows
+        self.columns = columns
+        size = HEADER_SIZE + 2*rows*columns*np.dtype(np.float64).itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        self.mapArrays()
+        if create:
+            self.seq[0] = 0
+
+    def mapArrays(self):
+        # seq[0] is the total number of rows written since the creation of the buffer
+        self.seq = np.ndarray((1,), dtype=np.int64, buffer=self.shm.buf)
+        self.data = np.ndarray((2*self.rows, self.columns), dtype=np.float64, buffer=self.shm.buf, offset=HEADER_SIZE)
+
+    def __getstate__(self):
+        # Processes started with spawn attach to the existing shared memory by name
+        return (self.shm.name, self.rows, self.columns)
+
+    def __setstate__(self, state):
+        name, rows, columns = state
+        self.__init__(rows, columns, name=name, create=False)
+
+    def write(self, block):
+        ''' Writes a single row or a block of rows, only to be called by the producer process '''
+        block = np.asarray(block, dtype=np.float64).reshape(-1, self.columns)
+        n = block.shape[0]
+        seq = int(self.seq[0])
+        if n > self.rows:
+            # Only the last rows fit in the ring
+            block = block[n-self.rows:]
+        start = (seq + n - block.shape[0]) % self.rows
+        k = min(block.shape[0], self.rows - start)
+        self.data[start:start+k] = block[:k]
+        self.data[start+self.rows:start+self.rows+k] = block[:k]
+        if k < block.shape[0]:
+            rest = block.shape[0] - k
+            self.data[:rest] = block[k:]
+            self.data[self.rows:self.rows+rest] = block[k:]
+        # Publishing the rows once they are in place
+        self.seq[0] = seq + n
+
+    def latest(self, n):
+        ''' Returns a view on the last n rows (fewer if less were written) '''
+        return self.read(int(self.seq[0]), n)
+
+    def read_since(self, lastSeq):
+        '''
+        Returns a view on the rows written since the sequence number lastSeq, the new sequence
+        number to pass to the next call, and the number of rows lost because the reader fell
+        more than the size of the ring behind.
+        '''
+        seq = int(self.seq[0])
+        new = seq - lastSeq
+        lost = max(0, new - self.rows)
+        return self.read(seq, new - lost), seq, lost
+
+    def read(self, seq, n):
+        n = max(0, min(n, seq, self.rows))
+        end = seq % self.rows + self.rows
+        return self.data[end-n:end]
+
+    def close(self):
+        # The arrays must be released before the shared memory can be closed
+        self.seq = None
+        self.data = None
+        self.shm.close()
+
+    def unlink(self):
+        ''' Frees the shared memory, to be called once by the process that created it '''
+        self.shm.unlink()
+
+# Policies of StreamReader: the last max_rows rows, only the latest row, or one row out of factor
+DROP_OLDEST = 'drop-oldest'
+KEEP_LATEST = 'keep-latest'
+DECIMATE = 'decimate'
+POLICIES = (DROP_OLDEST, KEEP_LATEST, DECIMATE)
+
+class StreamReader:
+    '''
+    Reader of a SharedRingBuffer keeping its own sequence number. Each read returns at most max_rows of the
+    rows written since the last read, selected by the policy. lost counts the rows overwritten in the ring
+    before they could be read, dropped the rows left out by the policy.
+    '''
+
+    def __init__(self, stream, policy=DROP_OLDEST, max_rows=None, factor=1):
+        if policy not in POLICIES:
+            raise ValueError("Unknown policy %s, expected one of %s" % (policy, ', '.join(POLICIES)))
+        self.stream = stream
+        self.policy = policy
+        self.max_rows = max(1, max_rows or stream.rows)
+        self.factor = max(1, int(factor))
+        self.seq = 0
+        self.lost = 0
+        self.dropped = 0
+
+    def read(self):
+        ''' Returns a view on the selected rows written since the last read '''
+        rows, seq, lost = self.stream.read_since(self.seq)
+        self.seq = seq
+        self.lost = self.lost + lost
+        n = len(rows)
+        if self.policy == KEEP_LATEST:
+            rows = rows[-1:]
+        elif self.policy == DECIMATE:
+            # Rows whose sequence number is a multiple of factor, so that the spacing is regular across reads
+            rows = rows[(n - seq) % self.factor::self.factor]
+        rows = rows[-self.max_rows:]
+        self.dropped = self.dropped + n - len(rows)
+        return rows
+
+    def skip(self):
+        ''' Leaves out the rows written so far, the next read starts from the rows written from now on '''
+        self.seq = int(self.stream.seq[0])
@@ -2,15 +2,21 @@
 Class created for the readout of the ATI sensor, inherits from the multiprocessing class
 Created by David Cordova Bulens @ University College Dublin
 '''
-import serial
 import time
 import multiprocessing
-import csv
 import numpy as np
+from ATI_Mini40_data_bank import ATISerialReader, SoftwareBias, SCALE
+from Instrumented_Object_GUI_Buffer import TrialBuffer
+from Instrumented_Object_GUI_Writer import TrialWriter, TRIAL_FILE_TYPES, CompressedTrialFile
+from Instrumented_Object_GUI_Control import CPUMonitor, StartupTimer
+from Instrumented_Object_GUI_Clock import CLOCK_NAME, clock_metadata, now
+from Instrumented_Object_GUI_Stats import MonitorStats
+from Instrumented_Object_GUI_Filter import ForceProcessor
+from Instrumented_Object_GUI_Contact import ContactDetector, RecentRows, GRASP, RELEASE
 class ATIMonitorThread(multiprocessing.Process):
     
     def __init__(   self, 
-                    data_q, msg_q, error_q, 
+                    data_stream, msg_q, error_q, 
                     dataRecordingEvent,
                     setEvent,
                     stopEvent,
@@ -19,20 +25,37 @@ class ATIMonitorThread(multiprocessing.Process):
                     repeatEvent,
                     port_num,
                     port_baud,
-                    port_stopbits=serial.STOPBITS_ONE,
-                    port_parity=serial.PARITY_NONE,
-                    port_timeout=0.05):
+                    port_stopbits=1,
+                    port_parity='N',
+                    port_timeout=0.05,
+                    flush_interval=1.0,
+                    fsync_interval=5.0,
+                    file_format='csv',
+                    sample_rate=200,
+                    health=None,
+                    processed_stream=None,
+                    filter_cutoff=20.0,
+                    filter_order=4,
+                    software_bias=None,
+                    bias_timeout=2.0,
+                    command_timeout=1.0,
+                    trialClosed=None,
+                    contact=None,
+                    autoTrigger=None,
+                    pre_event=1.0,
+                    post_event=1.0,
+                    stateChange=None):
         multiprocessing.Process.__init__(self)
         
-        # Create serial port based on class inputs
+        # Create serial port based on class inputs, pyserial is only imported in the process (one stop bit, no parity by default)
         self.serial_port = None
         self.serial_arg = dict( port=port_num,
                                 baudrate=port_baud,
                                 stopbits=port_stopbits,
                                 parity=port_parity,
                                 timeout=port_timeout)
-        # Queues for data transmission across processes
-        self.data_q = data_q
+        # Shared ring buffer for the live data and queues for messages across processes
+        self.data_stream = data_stream
         self.error_q = error_q
         self.msg_q = msg_q
         # Events for defning status of the code and trials
@@ -49,9 +72,52 @@ class ATIMonitorThread(multiprocessing.Process):
         # Variable to keep track of trial ongoing
         self.fileNumber = -1
         self.repeatNumber = 0
-        # Array creation to store data during trial
-        self.trial_data = np.zeros((50000,7))*np.NAN
-        self.iteration = 0
+        # Semaphore released once the files of a trial are closed, the files of the next trial are then prepared
+        self.trialClosed = trialClosed
+        self.filePrefix = None
+        # Buffer creation to store data during trial, it grows with the length of the trial
+        self.trial_data = TrialBuffer(7, chunk_rows=400)
+        # Schedule in seconds for flushing and syncing the trial file to disk during the trial
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        # Format of the trial files, 'csv' or 'binary'
+        self.fileType = TRIAL_FILE_TYPES[file_format]
+        self.header = ["Time","fx","fy","fz","tx","ty","tz"]
+        # Rate set on the controller by ftSensorInit, used to timestamp the samples read in one batch
+        self.sample_rate = sample_rate
+        # The compressed format records the controller counts, value*divisor, of the forces and torques
+        self.metadata = {'units': ["s","N","N","N","Nm","Nm","Nm"], 'sample_rate': sample_rate, 'clock': CLOCK_NAME,
+                         'divisors': [None] + SCALE.tolist()}
+        # Shared HealthBoard where the live statistics of the process are published for the GUI
+        self.health = health
+        # Low-pass filter of the forces and torques in Hz, and shared ring buffer for the processed rows
+        # [Time,fx_lp,fy_lp,fz_lp,tx_lp,ty_lp,tz_lp,F,dF]. No processing if the cutoff is None
+        self.processed_stream = processed_stream
+        self.filter_cutoff = filter_cutoff
+        self.filter_order = filter_order
+        self.processed_data = TrialBuffer(len(ForceProcessor.header), chunk_rows=400)
+        # Bias done by the controller (SB command), or in software with the mean of the last software_bias
+        # seconds of samples. The controller bias is done while the samples keep being read, it ends when the
+        # controller acknowledges the commands or after bias_timeout seconds
+        self.software_bias = software_bias
+        self.bias_timeout = bias_timeout
+        self.biasCommands = None
+        self.biasDeadline = None
+        # Longest wait for the controller to acknowledge a command during the initialisation
+        self.command_timeout = command_timeout
+        # Contact detection with the ContactDetector settings given in contact (None to disable it). The grasp, lift
+        # and release events are saved in the metadata of the trial. While autoTrigger is set, a grasp starts a trial
+        # with the pre_event seconds of data before it, and the trial is stopped post_event seconds after the release
+        self.contact = contact
+        self.autoTrigger = autoTrigger
+        self.pre_event = pre_event
+        self.post_event = post_event
+        self.stateChange = stateChange
+        self.trialEvents = []
+        self.autoStart = None
+        self.autoStop = None
+        # Set once the death of the serial reader thread is reported
+        self.readerFailed = False
         # Event defining the end of the init function
         self.alive = multiprocessing.Event()
         self.alive.set()
@@ -60,20 +126,51 @@ class ATIMonitorThread(multiprocessing.Process):
         ''' 
         Run function, starts the serial port, and starts reading information from the main process of the instrumented object.
         The code then waits for different events to be flagged by the main proccess.
-        It then reads from the ATI sensor and stores the data in an array. The data is also put in a queue for plotting purposes.
+        It then reads from the ATI sensor and stores the data in an array. The data is also put in a shared ring buffer for plotting purposes.
         '''
+        import serial
+        startup = StartupTimer('ATI')
         # Create serial port transmission
         try:
             if self.serial_port: 
                 self.serial_port.close()
             self.serial_port = serial.Serial(**self.serial_arg)
+            startup.mark('serial port')
+            # The reader thread owns the serial port reads from now on, the answers to the commands included
+            self.reader = ATISerialReader(self.serial_port, 1/self.sample_rate)
+            self.reader.start()
             self.ftSensorInit()
-        except (serial.SerialException, e):
-            self.error_q.put(e.message)
+            startup.mark('controller')
+        except serial.SerialException as e:
+            self.error_q.put(str(e))
             return
+        self.softwareBias = SoftwareBias(self.software_bias, self.sample_rate) if self.software_bias else None
+        # The writer thread streams the trial data to disk
+        self.fileWriter = TrialWriter(self.flush_interval, self.fsync_interval, self.error_q)
+        self.fileWriter.start()
+        startup.mark('writer')
+        # The processed rows are recorded in a second file next to the raw data, by their own writer
+        self.processor = None
+        if self.filter_cutoff:
+            self.processor = ForceProcessor(self.sample_rate, self.filter_cutoff, self.filter_order)
+            self.processedMetadata = dict(self.metadata, units=ForceProcessor.units, divisors=[None]*len(ForceProcessor.header),
+                                          **self.processor.metadata())
+            self.processedWriter = TrialWriter(self.flush_interval, self.fsync_interval, self.error_q)
+            self.processedWriter.start()
+            startup.mark('processing')
+        self.detector = None
+        if self.contact is not None:
+            self.detector = ContactDetector(self.header, **self.contact)
+            # Rows kept for the start of the trials started by a grasp, one block more than the margin
+            capacity = int((self.pre_event + 1.0)*self.sample_rate)
+            self.recent = RecentRows(len(self.header), capacity)
+            self.recentProcessed = RecentRows(len(ForceProcessor.header), capacity)
+        startup.report()
         
         # time0 is the initial time of the process
         time0 = time.time()
+        cpu = CPUMonitor('ATI')
+        stats = MonitorStats('ATI', self.health)
 
         while self.alive.is_set():
             ### FILE CREATION ###
@@ -84,140 +181,273 @@ class ATIMonitorThread(multiprocessing.Process):
                   fileName = self.msg_q.get()
                   experimentName = self.msg_q.get()
                   folderName = self.msg_q.get()
+                  self.filePrefix = "%s/%s_%s" % (folderName,experimentName,fileName)
+                  self.prepareTrialFiles()
                self.getTitle = False  
 
-            # Read ATI data and set timestamp
+            # Read the block of ATI data parsed since the last pass, each row is [Time,fx,fy,fz,tx,ty,tz]
             data = self.ati_mini40_data_bank()
-            timestamp = time.time()
-            # Put force reading in queue for initial plot update
-            self.data_q.put((data[0],data[1],data[2],data[3],data[4],data[5], timestamp))
+            if data is None and not self.readerFailed and not self.reader.is_alive():
+                # No more samples will come, the acquisition stalls
+                self.readerFailed = True
+                self.error_q.put("serial reader stopped: %s" % self.reader.error)
+            processed = None
+            recorded = data
+            if data is not None and self.softwareBias is not None:
+                self.softwareBias.add(data)
+                if self.fileType is CompressedTrialFile:
+                    # The compressed files keep the raw counts, the software bias offset is in the trial metadata
+                    recorded = data.copy()
+                self.softwareBias.apply(data)
+            if data is not None:
+                # Put force readings in the shared ring buffer for the live plot
+                self.data_stream.write(data)
+                # Filtered forces and derived channels, computed on the whole block
+                if self.processor is not None:
+                    processed = self.processor.process(data)
+                    if self.processed_stream is not None:
+                        self.processed_stream.write(processed)
+
+            ### CONTACT DETECTION ###
+            events = []
+            if data is not None and self.detector is not None:
+                events = self.detector.process(data, now())
+                for event in events:
+                    print("Contact: %s at %.3f s, detected after %.1f ms" % (event['event'], event['time'], 1e3*event['latency']))
+                if self.autoTrigger is not None and self.autoTrigger.is_set():
+                    self.autoTrial(events, data[-1,0])
             
             ### BIAS ###
             # If bias button pressed on GUI then bias the ATI, unless a trial is running in which case bias done after trial
-            if self.biasEvent.is_set() and not self.dataRecordingEvent.is_set():
-                self.serial_port.write(b'SB\r\n') #bias sensor again to ensure correct biasing conditions
-                self.serial_port.write(b'QS\r\n') #start reading data
-                time.sleep(1)
-                #read whatever the sensor gives after sending the previous command, before start reading the data
-                i=0;
-                while (i==0):
-                    lineATI=self.serial_port.readline()
-                    dec=lineATI.decode(encoding='latin-1')
-                    for character in dec:
-                        if character.isdigit():
-                            i=1;
-                            print('sensor biased')
-                self.biasEvent.clear()  
+            if self.biasEvent.is_set() and not self.dataRecordingEvent.is_set() and self.biasCommands is None:
+                if self.softwareBias is not None:
+                    offset, spread = self.softwareBias.capture()
+                    print('sensor biased in software, offset %s, noise %s' % (np.round(offset, 4), None if spread is None else np.round(spread, 4)))
+                    self.biasEvent.clear()
+                else:
+                    self.startBias()
+            if self.biasCommands is not None:
+                self.checkBias()
 
             ### DATA RECORDING ###
-            if self.dataRecordingEvent.is_set() and not self.stopEvent.is_set():
+            if self.dataRecordingEvent.is_set() and not self.stopEvent.is_set() and data is not None:
                 if not self.fileIsCreated:
-                    # Create file for data recording
+                    # Create file for data recording, the file prepared for this trial is used if there is one
+                    self.txtfilepath, processedfilepath = self.trialPaths(self.repeatEvent.is_set())
                     if self.repeatEvent.is_set():
-                        self.fileIsCreated = True
                         self.repeatNumber = self.repeatNumber + 1 
-                        self.txtfilepath = "%s/%s_%s_ft_%i_%i.csv" % (folderName,experimentName,fileName,self.fileNumber,self.repeatNumber)   
                     else:
                         self.fileNumber = self.fileNumber+1
-                        self.fileIsCreated = True
-                        self.txtfilepath = "%s/%s_%s_ft_%i.csv" % (folderName,experimentName,fileName,self.fileNumber)          
-                    self.fileHandle = open(self.txtfilepath,"w",newline='')
-                    self.writer = csv.writer(self.fileHandle,delimiter=',')
+                    self.fileIsCreated = True
                     print("Writing file header...\n")    
-                    self.writer.writerow(["Time","fx","fy","fz","tx","ty","tz"]) 
-                else:
-                    # Start storing data in the np array
-                    self.fileIsClosed = False
-                    self.trial_data[self.iteration,0] = timestamp
-                    self.trial_data[self.iteration,1:] = data
-                    
-                self.iteration = self.iteration+1
+                    self.fileWriter.open(self.txtfilepath,self.header,self.fileType,self.metadata)
+                    self.fileWriter.update_metadata(dict(self.metadata, **clock_metadata()))
+                    if self.softwareBias is not None:
+                        rawColumns = self.header[1:] if self.fileType is CompressedTrialFile else None
+                        self.fileWriter.update_metadata(self.softwareBias.metadata(rawColumns))
+                    if self.processor is not None:
+                        self.processedWriter.open(processedfilepath,ForceProcessor.header,self.fileType,self.processedMetadata)
+                        self.processedWriter.update_metadata(dict(self.processedMetadata, **clock_metadata()))
+                    if self.detector is not None:
+                        self.fileWriter.update_metadata({'contact': self.detector.metadata()})
+                    self.trialEvents = []
+                    if self.autoStart is not None:
+                        # Trial started by a grasp, the data of the margin before it is recorded first
+                        self.trial_data.append(self.recent.since(self.autoStart))
+                        recorded = recorded[recorded[:,0] >= self.autoStart]
+                        if processed is not None:
+                            self.processed_data.append(self.recentProcessed.since(self.autoStart))
+                            processed = processed[processed[:,0] >= self.autoStart]
+                        self.autoStart = None
+                    stats.reset()
+                # Start storing data in the buffer, full chunks are handed to the writer
+                self.fileIsClosed = False
+                self.trial_data.append(recorded)
+                for block in self.trial_data.take_full():
+                    self.fileWriter.write(block)
+                if processed is not None:
+                    self.processed_data.append(processed)
+                    for block in self.processed_data.take_full():
+                        self.processedWriter.write(block)
+                # Event markers of the trial, saved as they come so that they are kept if the trial is not closed
+                if events:
+                    self.trialEvents.extend(events)
+                    self.fileWriter.update_metadata({'events': self.trialEvents})
+            if data is not None and self.detector is not None:
+                self.recent.add(recorded)
+                if processed is not None:
+                    self.recentProcessed.add(processed)
+
+            ### STATISTICS ###
+            if data is not None:
+                # The last row is stamped when its batch was read from the port, the rows before it are stamped
+                # backwards with the nominal period, so the intervals are taken between reads
+                stats.add_batch(data[-1,0], len(data))
+                stats.add_queue_latency(now() - data[-1,0])
+            stats.set_malformed(self.reader.dropped + self.reader.partial)
+            stats.set_fill(self.reader.blocks.qsize() + self.fileWriter.requests.qsize())
+            stats.set_write_errors(self.fileWriter.errorCount + (self.processedWriter.errorCount if self.processor is not None else 0))
+            stats.publish(now(), self.fileWriter.latency, cpu)
 
             ### END OF TRIAL ###
             if self.stopEvent.is_set() and not self.fileIsClosed:
-               self.writer.writerows(self.trial_data)
-               self.fileHandle.close()
-               self.trial_data = np.zeros((50000,7))*np.NAN
-               self.iteration = 0
+               for block in self.trial_data.take_all():
+                   self.fileWriter.write(block)
+               self.fileWriter.update_metadata({'stats': stats.summary()})
+               if self.detector is not None:
+                   self.fileWriter.update_metadata({'contact': self.detector.summary()})
+               self.fileWriter.close()
+               if self.processor is not None:
+                   for block in self.processed_data.take_all():
+                       self.processedWriter.write(block)
+                   self.processedWriter.close()
                self.fileIsCreated = False
                self.fileIsClosed = True
                print("Finished acquiring data")
+               print("Dropped frames: %i malformed, %i partial" % (self.reader.dropped, self.reader.partial))
+               stats.report()
+               cpu.report()
+               if self.detector is not None:
+                   self.detector.report()
+                   self.detector.latency.reset()
+               self.autoStop = None
+               self.prepareTrialFiles()
+               if self.trialClosed is not None:
+                   self.trialClosed.release()
 
                
-        # clean up
+        # clean up, data of a trial still running is written
+        cpu.report()
+        self.reader.stop()
+        for block in self.trial_data.take_all():
+            self.fileWriter.write(block)
+        if self.fileIsCreated:
+            self.fileWriter.update_metadata({'stats': stats.summary()})
+        self.fileWriter.stop()
+        if self.processor is not None:
+            for block in self.processed_data.take_all():
+                self.processedWriter.write(block)
+            self.processedWriter.stop()
         if self.serial_port:
             print('here')
             self.serial_port.write(b'\r\n')
             self.serial_port.close()
 
+    def trialPaths(self, repeat):
+        ''' Paths of the raw and processed files of the next trial, a repeat of the last trial or a new trial '''
+        if repeat:
+            number = "%i_%i" % (self.fileNumber, self.repeatNumber + 1)
+        else:
+            number = "%i" % (self.fileNumber + 1)
+        return ("%s_ft_%s.%s" % (self.filePrefix, number, self.fileType.extension),
+                "%s_ftlp_%s.%s" % (self.filePrefix, number, self.fileType.extension))
+
+    def prepareTrialFiles(self):
+        ''' Creates the files and the first buffer chunks of the next trial while waiting for it, a repeat if the repeat event is set '''
+        if self.filePrefix is None:
+            return
+        path, processedPath = self.trialPaths(self.repeatEvent.is_set())
+        self.fileWriter.prepare(path, self.header, self.fileType, self.metadata)
+        self.trial_data.reserve()
+        if self.processor is not None:
+            self.processedWriter.prepare(processedPath, ForceProcessor.header, self.fileType, self.processedMetadata)
+            self.processed_data.reserve()
+
+    def autoTrial(self, events, lastTime):
+        '''
+        Starts a new trial on a grasp, with the data of the last pre_event seconds, and stops it once post_event seconds
+        of data were read after the release, unless the object is grasped again meanwhile
+        '''
+        recording = self.dataRecordingEvent.is_set() and not self.stopEvent.is_set()
+        changed = False
+        for event in events:
+            if event['event'] == GRASP:
+                self.autoStop = None
+                if not recording and self.setEvent.is_set() and not self.fileIsCreated:
+                    self.autoStart = event['time'] - self.pre_event
+                    if self.trialClosed is not None:
+                        while self.trialClosed.acquire(False):
+                            pass
+                    self.repeatEvent.clear()
+                    self.stopEvent.clear()
+                    self.dataRecordingEvent.set()
+                    recording = changed = True
+                    print("Contact: trial started by the grasp")
+            elif event['event'] == RELEASE and recording:
+                self.autoStop = event['time'] + self.post_event
+        if self.autoStop is not None and lastTime >= self.autoStop:
+            self.autoStop = None
+            self.repeatEvent.clear()
+            self.stopEvent.set()
+            changed = True
+            print("Contact: trial stopped after the release")
+        # The camera waits for a change of state to start or stop recording
+        if changed and self.stateChange is not None:
+            self.stateChange.notify()
+
     def join(self, timeout=None):
         self.alive.clear()
         multiprocessing.Process.join(self, timeout)
+
+    def startBias(self):
+        ''' Sends the bias commands, the samples keep being read while the controller answers '''
+        while self.reader.get_reply(0) is not None:
+            pass
+        self.serial_port.write(b'SB\r\n') #bias sensor again to ensure correct biasing conditions
+        self.serial_port.write(b'QS\r\n') #start reading data
+        self.biasCommands = ['SB', 'QS']
+        self.biasDeadline = now() + self.bias_timeout
+
+    def checkBias(self):
+        ''' Called on every pass while biasing, ends the bias once both commands are acknowledged or on timeout '''
+        reply = self.reader.get_reply(0)
+        while reply is not None and self.biasCommands:
+            if reply[1].upper().startswith(self.biasCommands[0]):
+                self.biasCommands.pop(0)
+            reply = self.reader.get_reply(0) if self.biasCommands else None
+        if not self.biasCommands:
+            print('sensor biased')
+        elif now() > self.biasDeadline:
+            print('sensor bias not acknowledged by the controller (waiting for %s)' % ', '.join(self.biasCommands))
+        else:
+            return
+        self.biasCommands = None
+        self.biasEvent.clear()
     
     def ftSensorInit(self):
         # This function start the communication with the ATI force controller,
         # it then sends information to the controller to set the frequency of
         # the data sampling that is desired and then queries data.
+        # Each command is sent once the previous one is acknowledged, instead of waiting a fixed time.
         
         self.serial_port.Terminator = 'CR'; #set terminator        
-        # We set a sleep time here to allow the system to be correctly initialized
-        self.serial_port.write(b'SB\r\n') #bias sensor
-        self.serial_port.write(b'SF 1650\r\n') #set sampling frequency so that we get 200 Hz
-        time.sleep(1)
-        #read whatever the sensor gives after sending the two previous commands
-        i=0
-        while (i==0):
-            lineATI=self.serial_port.readline()
-            dec=lineATI.decode(encoding='latin-1')
-            for character in dec:
-                if character.isdigit():
-                    i=1
-                    
+        self.sendCommand('SB') #bias sensor
+        self.sendCommand('SF 1650') #set sampling frequency so that we get 200 Hz
         print("Biasing F/T sensor\n");
 
         # Defining the reference frame of the ATI sensor to match with the viewing plate
-        self.serial_port.write(b'TF 0\r\n')
-        time.sleep(1)
-        self.serial_port.write(b'TC 2, Inst, 225, -130, 0, 1800, 0, 1199\r\n')
-        time.sleep(1)
-        self.serial_port.write(b'TF 2\r\n')
-        time.sleep(1)
-        self.serial_port.write(b'SB\r\n') #bias sensor again to ensure correct biasing conditions
-        self.serial_port.write(b'QS\r\n') #start reading data
-        time.sleep(1)
-        
-        #read whatever the sensor gives after sending the previous command, before start reading the data
-        i=0
-        while (i==0):
-            lineATI=self.serial_port.readline()
-            dec=lineATI.decode(encoding='latin-1')
-            for character in dec:
-                if character.isdigit():
-                    i=1
+        self.sendCommand('TF 0')
+        self.sendCommand('TC 2, Inst, 225, -130, 0, 1800, 0, 1199')
+        self.sendCommand('TF 2')
+        self.sendCommand('SB') #bias sensor again to ensure correct biasing conditions
+        # Samples streamed before the bias are discarded
+        while self.reader.get(0) is not None:
+            pass
+        self.sendCommand('QS') #start reading data
+
+    def sendCommand(self, command):
+        ''' Sends a command to the controller and waits for its echo, returns False if it did not come in time '''
+        self.serial_port.write(command.encode() + b'\r\n')
+        name = command.split()[0].upper()
+        deadline = now() + self.command_timeout
+        while now() < deadline:
+            reply = self.reader.get_reply(deadline - now())
+            if reply is not None and reply[1].upper().startswith(name):
+                return True
+        print("No answer of the controller to %s after %.1f s" % (command, self.command_timeout))
+        return False
                 
-    def ati_mini40_data_bank(self):
-        # This function reads data from the ATI sensor and transforms it to Ne and Nm
-        
-        lineATI=self.serial_port.readline() #reading serial port
-        
-        dec=lineATI.decode()
-      
-        sp=dec.split(',')
-    
-        if (len(sp) == 7):
-            # If the data is the correct length, compute the forces and torques
-            fx = int(sp[1])/200
-            fy = int(sp[2])/200
-            fz = int(sp[3])/200
-            tx = int(sp[4])/8000
-            ty = int(sp[5])/8000
-            tz = int(sp[6])/8000      
-        else:                
-            fx = 'Nan'
-            fy = 'Nan'
-            fz = 0
-            tx = 'Nan'
-            ty = 'Nan'
-            tz = 'Nan'
-        data = [fx,fy,fz,tx,ty,tz]
-        return data    
\ No newline at end of file
+    def ati_mini40_data_bank(self, timeout=0.05):
+        # This function returns the next block of data parsed by the reader thread, in Ne and Nm,
+        # or None if nothing arrived before the timeout
+        return self.reader.get(timeout)
@@ -0,0 +1,444 @@
+'''
+Background writer used by the acquisition processes to stream the data of a trial to disk.
+The acquisition loop hands over filled chunks of its trial buffer, the writer thread appends them
+to the trial file and flushes/fsyncs it on a schedule so that a crash only loses the last few seconds.
+Closing a file only queues the request, the acquisition loop never waits for the disk. The file of the
+next trial can be prepared ahead of time, so that the next trial starts in a file that is already created.
+The time taken by each write, flush and fsync and the depth of the request queue are measured, and
+saved with the rows written in the metadata of the trial when the file is closed.
+An error in a request (disk full, a value JSON cannot store, ...) is reported and counted, and the thread goes on
+with the next requests: the blocks of a trial whose file could not be created are discarded and counted.
+Trials can be written as CSV or in a binary format: a header describing the columns (names, units,
+types), the sample rate and the clock source, followed by fixed size records that np.memmap can read.
+The compressed format has the same header followed by blocks of delta encoded integers compressed with zlib:
+whole controller counts for the columns with a divisor, the bits of the float values otherwise, so that the
+decoded values are bit-exact.
+'''
+import threading
+import queue
+import csv
+import os
+import time
+import json
+import struct
+import zlib
+import lzma
+import argparse
+import numpy as np
+from Instrumented_Object_GUI_Stats import Histogram
+
+# Binary trial files: magic, format version and header size, then the JSON header padded to HEADER_ALIGN bytes
+BINARY_MAGIC = b'INOB'
+BINARY_VERSION = 1
+BINARY_PREFIX = struct.Struct('<4sII')
+HEADER_ALIGN = 64
+# Compressed trial files: version of the header, and rows and compressed size at the start of each block
+COMPRESSED_VERSION = 2
+BLOCK_PREFIX = struct.Struct('<II')
+# Encoding of a column in a block, followed by the encoding of each column
+ENCODE_BITS = 0
+ENCODE_COUNTS = 1
+CODECS = {'zlib': (lambda data: zlib.compress(data, 1), zlib.decompress), 'lzma': (lzma.compress, lzma.decompress)}
+
+class CSVTrialFile:
+    ''' CSV trial file, one header line followed by one line per sample '''
+    extension = 'csv'
+
+    def __init__(self, path, header, metadata=None):
+        self.path = path
+        self.fileHandle = open(path, "w", newline='')
+        self.writer = csv.writer(self.fileHandle, delimiter=',')
+        if header:
+            self.writer.writerow(header)
+
+    def write(self, block):
+        self.writer.writerows(block)
+
+    def close(self):
+        self.fileHandle.close()
+
+class BinaryTrialFile:
+    '''
+    Binary trial file, the samples are stored as records of typed columns after the header.
+    metadata can give the "units", the "dtypes" of the columns (float64 by default), the
+    "sample_rate" and the "clock" used for the timestamps, any other entry is kept in the header.
+    '''
+    extension = 'inob'
+
+    def __init__(self, path, header, metadata=None):
+        self.path = path
+        metadata = dict(metadata or {})
+        dtypes = metadata.pop('dtypes', ['<f8']*len(header))
+        units = metadata.pop('units', ['']*len(header))
+        info = {'columns': [{'name': n, 'unit': u, 'dtype': np.dtype(d).str} for n, u, d in zip(header, units, dtypes)],
+                'sample_rate': metadata.pop('sample_rate', None),
+                'clock': metadata.pop('clock', 'time.time'),
+                'metadata': metadata}
+        self.dtype = record_dtype(info)
+        self.fileHandle = open(path, "wb")
+        self.fileHandle.write(encode_header(info))
+
+    def write(self, block):
+        block = np.asarray(block)
+        if block.ndim != 2 or block.shape[1] != len(self.dtype.names):
+            # Raw bytes of the wrong width would shift all the records after them
+            raise ValueError("Block of shape %s written to a file of %i columns" % (block.shape, len(self.dtype.names)))
+        if all(self.dtype.fields[n][0] == block.dtype for n in self.dtype.names):
+            # All the columns have the type of the block, the rows are already the records
+            self.fileHandle.write(np.ascontiguousarray(block).tobytes())
+        else:
+            records = np.empty(block.shape[0], dtype=self.dtype)
+            for i, name in enumerate(self.dtype.names):
+                records[name] = block[:,i]
+            self.fileHandle.write(records.tobytes())
+
+    def close(self):
+        self.fileHandle.close()
+
+class CompressedTrialFile:
+    '''
+    Compressed binary trial file, the rows are stored in blocks after the header, one block per write.
+    metadata can give the "divisors" of the columns recorded as controller counts (value = counts/divisor),
+    the "codec" ('zlib' by default, or 'lzma'), and the "units", "sample_rate" and "clock" of the binary files.
+    The values are decoded as float64.
+    '''
+    extension = 'inob'
+
+    def __init__(self, path, header, metadata=None):
+        self.path = path
+        metadata = dict(metadata or {})
+        metadata.pop('dtypes', None)
+        units = metadata.pop('units', ['']*len(header))
+        self.divisors = metadata.pop('divisors', [None]*len(header))
+        self.codec = metadata.pop('codec', 'zlib')
+        info = {'columns': [{'name': n, 'unit': u, 'dtype': '<f8', 'divisor': d} for n, u, d in zip(header, units, self.divisors)],
+                'sample_rate': metadata.pop('sample_rate', None),
+                'clock': metadata.pop('clock', 'time.time'),
+                'encoding': 'delta', 'codec': self.codec,
+                'metadata': metadata}
+        self.fileHandle = open(path, "wb")
+        self.fileHandle.write(encode_header(info, COMPRESSED_VERSION))
+
+    def write(self, block):
+        self.fileHandle.write(encode_block(block, self.divisors, self.codec))
+
+    def close(self):
+        self.fileHandle.close()
+
+def encode_block(block, divisors, codec='zlib'):
+    '''
+    Encodes a block of rows: each column as 64 bit integers, the counts if all its values are whole counts of
+    its divisor and the float bits otherwise, then the differences between consecutive rows in zigzag order
+    (0,-1,1,-2,...) with the bytes grouped by significance, so that the high bytes are zero and compress well
+    '''
+    block = np.asarray(block, dtype=np.float64).reshape(len(block), -1)
+    n, columns = block.shape
+    values = np.empty((columns, n), dtype=np.int64)
+    encodings = np.full(columns, ENCODE_BITS, dtype=np.uint8)
+    for i in range(columns):
+        column = np.ascontiguousarray(block[:,i])
+        if divisors[i]:
+            counts = np.rint(column*divisors[i])
+            # Counts are only exact integers below 2**53, and a negative zero has no count
+            if (np.all(np.abs(counts) < 2**53) and np.array_equal(counts/divisors[i], column)
+                    and not np.any(np.signbit(column) & (column == 0))):
+                values[i] = counts
+                encodings[i] = ENCODE_COUNTS
+                continue
+        values[i] = column.view(np.int64)
+    # Integer overflows wrap around, and wrap back when the differences are summed
+    values[:,1:] = np.diff(values, axis=1)
+    values = (values << 1) ^ (values >> 63)
+    shuffled = values.view(np.uint8).reshape(columns, n, 8).transpose(0, 2, 1)
+    payload = CODECS[codec][0](np.ascontiguousarray(shuffled).tobytes())
+    return BLOCK_PREFIX.pack(n, len(payload)) + encodings.tobytes() + payload
+
+def decode_blocks(data, offset, columns, divisors, codec='zlib'):
+    '''
+    Decodes the blocks found from offset in the bytes of a compressed trial file into an (N,columns) array.
+    Returns the array and the end of the last complete block, an incomplete last block is ignored
+    '''
+    decompress = CODECS[codec][1]
+    scale = np.array([d or 1 for d in divisors], dtype=np.float64)
+    blocks = []
+    position = offset
+    while position + BLOCK_PREFIX.size + columns <= len(data):
+        n, size = BLOCK_PREFIX.unpack_from(data, position)
+        start = position + BLOCK_PREFIX.size + columns
+        if start + size > len(data):
+            break
+        encodings = np.frombuffer(data, dtype=np.uint8, count=columns, offset=position + BLOCK_PREFIX.size)
+        shuffled = np.frombuffer(decompress(data[start:start+size]), dtype=np.uint8).reshape(columns, 8, n)
+        zigzag = np.ascontiguousarray(shuffled.transpose(0, 2, 1)).view(np.uint64).reshape(columns, n)
+        values = np.cumsum((zigzag >> np.uint64(1)).view(np.int64) ^ -(zigzag & np.uint64(1)).view(np.int64), axis=1)
+        rows = values.view(np.float64).T.copy()
+        counts = encodings == ENCODE_COUNTS
+        rows[:,counts] = values[counts].T/scale[counts]
+        blocks.append(rows)
+        position = start + size
+    if not blocks:
+        return np.zeros((0, columns)), position
+    return np.concatenate(blocks), position
+
+def encode_header(info, version=BINARY_VERSION):
+    text = json.dumps(info).encode()
+    size = BINARY_PREFIX.size + len(text)
+    size = size + (-size) % HEADER_ALIGN
+    return BINARY_PREFIX.pack(BINARY_MAGIC, version, size) + text.ljust(size - BINARY_PREFIX.size)
+
+def record_dtype(info):
+    return np.dtype([(c['name'], c['dtype']) for c in info['columns']])
+
+def read_trial_header(path):
+    ''' Returns the header of a binary trial file as a dict, with the size of the header in "offset" '''
+    with open(path, "rb") as fileHandle:
+        magic, version, size = BINARY_PREFIX.unpack(fileHandle.read(BINARY_PREFIX.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError("%s is not a binary trial file" % path)
+        if version > COMPRESSED_VERSION:
+            raise ValueError("%s uses an unknown format version %i" % (path, version))
+        info = json.loads(fileHandle.read(size - BINARY_PREFIX.size).decode())
+    info['offset'] = size
+    return info
+
+def load_trial(path):
+    '''
+    Maps a binary trial file in memory, returns the records (access columns by name, e.g. data["fz"])
+    and the header. An incomplete last record left by a crash is ignored. Compressed files are decoded in memory,
+    and the software bias of the trial is removed from the columns recorded without it ("bias_columns" of the
+    metadata), so that the values are those of the CSV and binary files.
+    '''
+    info = read_trial_header(path)
+    dtype = record_dtype(info)
+    if info.get('encoding') == 'delta':
+        with open(path, "rb") as fileHandle:
+            data = fileHandle.read()
+        rows, end = decode_blocks(data, info['offset'], len(dtype.names), [c['divisor'] for c in info['columns']], info['codec'])
+        records = np.empty(len(rows), dtype=dtype)
+        for i, name in enumerate(dtype.names):
+            records[name] = rows[:,i]
+        metadata = read_trial_metadata(path)
+        for name, offset in zip(metadata.get('bias_columns', []), metadata.get('software_bias', [])):
+            records[name] -= offset
+        return records, info
+    n = (os.path.getsize(path) - info['offset']) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype), info
+    return np.memmap(path, dtype=dtype, mode='r', offset=info['offset'], shape=(n,)), info
+
+def trial_has_records(path):
+    ''' False for a trial file without any complete line or record, a file prepared for a trial that never started for instance '''
+    if path.endswith('.' + BinaryTrialFile.extension):
+        if os.path.getsize(path) < BINARY_PREFIX.size:
+            return False
+        return os.path.getsize(path) > read_trial_header(path)['offset']
+    with open(path, "rb") as fileHandle:
+        fileHandle.readline()
+        return fileHandle.readline().endswith(b'\n')
+
+def convert_to_csv(path, csvPath=None):
+    ''' Converts a binary trial file to CSV, next to it by default. Returns the path of the CSV file '''
+    data, info = load_trial(path)
+    if csvPath is None:
+        csvPath = os.path.splitext(path)[0] + '.csv'
+    trialFile = CSVTrialFile(csvPath, list(data.dtype.names))
+    step = 10000
+    for start in range(0, len(data), step):
+        trialFile.writer.writerows(data[start:start+step].tolist())
+    trialFile.close()
+    return csvPath
+
+def trial_metadata_path(path):
+    ''' Path of the JSON file storing the metadata of the trial file path '''
+    return os.path.splitext(path)[0] + '.json'
+
+def read_trial_metadata(path):
+    try:
+        with open(trial_metadata_path(path)) as fileHandle:
+            return json.load(fileHandle)
+    except FileNotFoundError:
+        return {}
+
+def update_trial_metadata(path, values):
+    ''' Adds or replaces entries of the metadata of the trial file path '''
+    metadata = read_trial_metadata(path)
+    metadata.update(values)
+    with open(trial_metadata_path(path), "w") as fileHandle:
+        json.dump(metadata, fileHandle, indent=1)
+
+class TrialWriter(threading.Thread):
+
+    def __init__(self, flush_interval=1.0, fsync_interval=5.0, errors=None):
+        threading.Thread.__init__(self, daemon=True)
+        # Time in seconds between two flushes / fsyncs of the file while a trial is running
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.requests = queue.Queue()
+        self.trialFile = None
+        # File created ahead of time by prepare and the arguments it was created with, until it is opened
+        self.prepared = None
+        self.preparedArgs = None
+        self.rows = 0
+        # Time spent in each write, flush and fsync of the current file, and peak number of queued requests
+        self.latency = Histogram()
+        self.peakQueue = 0
+        # Queue where the errors are reported (the error queue of the process), number of errors since the start
+        # and rows discarded because no file was open
+        self.errors = errors
+        self.errorCount = 0
+        self.trialErrors = 0
+        self.discarded = 0
+
+    def open(self, path, header, fileType=CSVTrialFile, metadata=None):
+        ''' Queues the start of a trial file, the file prepared for the same path is used if there is one '''
+        self.requests.put(('open', (fileType, path, header, metadata)))
+
+    def prepare(self, path, header, fileType=CSVTrialFile, metadata=None):
+        '''
+        Queues the creation of the file of the next trial, it is removed if it is never opened.
+        Existing files are left untouched, the file is then created when the trial starts as without prepare
+        '''
+        self.requests.put(('prepare', (fileType, path, header, metadata)))
+
+    def write(self, block):
+        ''' Queues a block of rows, the block must not be modified afterwards '''
+        if len(block):
+            self.requests.put(('write', block))
+
+    def update_metadata(self, values):
+        ''' Queues an update of the metadata file of the current trial file '''
+        self.requests.put(('metadata', values))
+
+    def close(self):
+        ''' Queues the end of the file and returns right away '''
+        self.requests.put(('close', None))
+
+    def stop(self, timeout=None):
+        ''' Writes what is left in the queue and stops the thread '''
+        self.requests.put(('stop', None))
+        self.join(timeout)
+
+    def run(self):
+        lastFlush = lastSync = time.time()
+        while True:
+            try:
+                request, arg = self.requests.get(timeout=self.flush_interval)
+            except queue.Empty:
+                request, arg = None, None
+            self.peakQueue = max(self.peakQueue, self.requests.qsize())
+            try:
+                if request == 'open':
+                    self.closeFile()
+                    self.rows = 0
+                    self.latency.reset()
+                    self.peakQueue = 0
+                    self.trialErrors = self.errorCount
+                    lastFlush = lastSync = time.time()
+                    if self.prepared is not None and self.preparedArgs == arg:
+                        self.trialFile, self.prepared = self.prepared, None
+                    else:
+                        self.discardPrepared()
+                        fileType, path, header, metadata = arg
+                        self.trialFile = fileType(path, header, metadata)
+                elif request == 'write' and self.trialFile is None:
+                    self.discarded = self.discarded + len(arg)
+                elif request == 'write':
+                    start = time.perf_counter()
+                    self.trialFile.write(arg)
+                    self.latency.add(time.perf_counter() - start)
+                    self.rows = self.rows + len(arg)
+                elif request == 'metadata' and self.trialFile is not None:
+                    update_trial_metadata(self.trialFile.path, arg)
+                elif request == 'prepare':
+                    self.discardPrepared()
+                    fileType, path, header, metadata = arg
+                    if not os.path.exists(path):
+                        self.prepared = fileType(path, header, metadata)
+                        self.preparedArgs = arg
+                elif request == 'close':
+                    self.closeFile()
+                elif request == 'stop':
+                    self.closeFile()
+                    self.discardPrepared()
+
+                # Flush and fsync on schedule while a file is open
+                now = time.time()
+                if self.trialFile is not None and now - lastFlush >= self.flush_interval:
+                    start = time.perf_counter()
+                    self.trialFile.fileHandle.flush()
+                    lastFlush = now
+                    if now - lastSync >= self.fsync_interval:
+                        os.fsync(self.trialFile.fileHandle.fileno())
+                        lastSync = now
+                    self.latency.add(time.perf_counter() - start)
+            except Exception as e:
+                # The thread must keep draining the queue whatever went wrong, or the trial piles up in memory
+                path = arg[1] if request in ('open', 'prepare') else getattr(self.trialFile, 'path', '')
+                self.reportError("Error in %s of %s: %s: %s" % (request, path, type(e).__name__, e))
+            if request == 'stop':
+                return
+
+    def reportError(self, message):
+        print(message)
+        self.errorCount = self.errorCount + 1
+        if self.errors is not None:
+            self.errors.put(message)
+
+    def discardPrepared(self):
+        prepared, self.prepared = self.prepared, None
+        if prepared is None:
+            return
+        prepared.close()
+        os.remove(prepared.path)
+
+    def closeFile(self):
+        # The file is forgotten first, so that a failure to close it does not fail the next trials as well
+        trialFile, self.trialFile = self.trialFile, None
+        if trialFile is None:
+            return
+        trialFile.fileHandle.flush()
+        os.fsync(trialFile.fileHandle.fileno())
+        trialFile.close()
+        update_trial_metadata(trialFile.path, {'writer_stats': {'rows': self.rows, 'peak_queue': self.peakQueue,
+                                                                'write_latency': self.latency.summary(),
+                                                                'errors': self.errorCount - self.trialErrors}})
+        print("Wrote %i rows to %s" % (self.rows, trialFile.path))
+
+TRIAL_FILE_TYPES = {'csv': CSVTrialFile, 'binary': BinaryTrialFile, 'compressed': CompressedTrialFile}
+
+def recover_trial_file(path):
+    '''
+    Repairs a trial file left truncated by a crash, the incomplete last line (CSV), record (binary)
+    or block (compressed) is removed. Returns the number of complete lines or records kept.
+    '''
+    if path.endswith('.' + BinaryTrialFile.extension):
+        info = read_trial_header(path)
+        if info.get('encoding') == 'delta':
+            with open(path, "rb+") as fileHandle:
+                rows, end = decode_blocks(fileHandle.read(), info['offset'], len(info['columns']),
+                                          [c['divisor'] for c in info['columns']], info['codec'])
+                fileHandle.truncate(end)
+            return len(rows)
+        itemsize = record_dtype(info).itemsize
+        n = (os.path.getsize(path) - info['offset']) // itemsize
+        with open(path, "rb+") as fileHandle:
+            fileHandle.truncate(info['offset'] + n*itemsize)
+        return n
+    with open(path, "rb+") as fileHandle:
+        data = fileHandle.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            fileHandle.truncate(end)
+    return data[:end].count(b'\n')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Repair or convert recorded trial files')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--recover', action='store_true', help='remove the incomplete end of files truncated by a crash')
+    parser.add_argument('--to-csv', action='store_true', help='convert binary trial files to CSV')
+    args = parser.parse_args()
+    for path in args.files:
+        if args.recover:
+            print("%s: %i lines kept" % (path, recover_trial_file(path)))
+        if args.to_csv:
+            print("%s: converted to %s" % (path, convert_to_csv(path)))
@@ -0,0 +1,181 @@
+'''
+Headless acquisition, without the Qt GUI: the ATI, IMU and camera processes are started from a session
+file and trials are run from a script, or from commands typed on stdin. The trial files are named and
+written exactly as with the GUI. Nothing is plotted, the live health of the processes is printed on demand.
+
+Session file (JSON):
+    {"participant": "P01", "experiment": "E1", "folder": "/home/pi/data", "camera": "1280x720/60fps",
+     "file_format": "csv", "software_bias": null, "port": "/dev/ttyUSB0", "backend": null,
+     "contact": {"channel": "F", "onset": 1.0, "release": 0.5, "lift": 5.0}, "pre_event": 1.0, "post_event": 1.0,
+     "imu_channels": ["euler", "linear_acceleration"]}
+"contact" enables the detection of the grasp events (see Instrumented_Object_GUI_Contact.py), null by default.
+"imu_channels" are the IMU_CHANNELS read from the BNO055 (and "calibration"), euler and linear acceleration by default.
+
+Commands, one per line ('#' starts a comment):
+    start             start a new trial
+    repeat            start a repeat of the last trial
+    stop              stop the trial
+    trial SECONDS     start a new trial, record for SECONDS and stop it
+    protocol FILE     run the trials of a protocol file back to back (see Instrumented_Object_GUI_Scheduler.py)
+    bias              bias the ATI sensor
+    auto on|off       start a trial on each grasp and stop it after the release (needs "contact")
+    wait SECONDS      wait
+    status            print the live health of the processes
+    quit              stop the processes and exit
+
+Usage: python Instrumented_Object_Headless.py session.json [script.txt]
+'''
+import sys
+import json
+import time
+import argparse
+from Instrumented_Object_GUI_Session import AcquisitionSession, CAMERA_PRESETS
+from Instrumented_Object_GUI_Scheduler import TrialScheduler, load_protocol
+from Instrumented_Object_GUI_IMU import DEFAULT_CHANNELS
+
+def load_session(path):
+    with open(path) as fileHandle:
+        config = json.load(fileHandle)
+    for key in ('participant', 'experiment', 'folder'):
+        if not config.get(key):
+            raise ValueError("%s: no %s given" % (path, key))
+    config.setdefault('camera', CAMERA_PRESETS[0])
+    return config
+
+class HeadlessRunner:
+
+    def __init__(self, config, ready_timeout=30.0, stop_timeout=2.0, session=None):
+        ''' Runs the commands on session, an AcquisitionSession made from the session file config by default '''
+        if session is None:
+            session = AcquisitionSession(software_bias=config.get('software_bias'),
+                                         file_format=config.get('file_format', 'csv'),
+                                         port=config.get('port', "/dev/ttyUSB0"),
+                                         backend=config.get('backend'),
+                                         contact=config.get('contact'),
+                                         pre_event=config.get('pre_event', 1.0),
+                                         post_event=config.get('post_event', 1.0),
+                                         imu_channels=tuple(config.get('imu_channels', DEFAULT_CHANNELS)))
+        self.session = session
+        self.config = config
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.recording = False
+
+    def open(self):
+        ''' Starts the processes, sends the setup and waits for the first samples of the sensors '''
+        self.session.start()
+        self.session.setup(self.config['participant'], self.config['experiment'], self.config['folder'],
+                           self.config['camera'])
+        deadline = time.monotonic() + self.ready_timeout
+        while not (self.session.ATIStream.seq[0] and self.session.IMUStream.seq[0]):
+            if not self.session.ATIError_q.empty():
+                raise RuntimeError("ATI: %s" % self.session.ATIError_q.get())
+            if time.monotonic() > deadline:
+                raise RuntimeError("No samples from the sensors after %.0f s" % self.ready_timeout)
+            time.sleep(0.05)
+        print("Sensors ready")
+
+    def start(self, repeat=False):
+        if self.recording:
+            self.stop()
+        self.session.start_trial(repeat)
+        self.recording = True
+        print("Recording %s" % ("repeat" if repeat else "trial"))
+
+    def stop(self):
+        # Trials started by a grasp are not known to the runner
+        if not self.recording and (self.session.stopEvent.is_set() or not self.session.dataRecordingEvent.is_set()):
+            return
+        self.session.stop_trial()
+        # Each process acknowledges once it closed the files of the trial
+        if not self.session.wait_stopped(self.stop_timeout):
+            print("The processes did not close the trial within %.1f s" % self.stop_timeout)
+        self.session.dataRecordingEvent.clear()
+        self.recording = False
+        print("Trial stopped")
+
+    def status(self):
+        for name, board in (('ATI', self.session.ATIHealth), ('IMU', self.session.IMUHealth), ('Camera', self.session.cameraHealth)):
+            h = board.read()
+            print("%s: %.0f Hz, interval p99 %.1f ms, %.0f dropped, write p99 %.2f ms, %.0f write errors, CPU %.0f%%" %
+                  (name, h['rate'], h['interval_p99_ms'], h['malformed'], h['write_latency_p99_ms'], h['write_errors'], h['cpu']))
+
+    def report_errors(self):
+        ''' Prints the errors reported by the processes, a trial file that could not be written for instance '''
+        for message in self.session.errors():
+            print("Error from %s" % message)
+
+    def run_command(self, line):
+        ''' Runs one command line, returns False on quit '''
+        words = line.split('#')[0].split()
+        if not words:
+            return True
+        command, args = words[0].lower(), words[1:]
+        try:
+            if command == 'start':
+                self.start()
+            elif command == 'repeat':
+                self.start(repeat=True)
+            elif command == 'stop':
+                self.stop()
+            elif command == 'trial':
+                duration = float(args[0])
+                self.start()
+                time.sleep(duration)
+                self.stop()
+            elif command == 'protocol':
+                self.stop()
+                scheduler = TrialScheduler(self.session, load_protocol(args[0]), self.stop_timeout)
+                scheduler.start()
+                try:
+                    scheduler.join()
+                except KeyboardInterrupt:
+                    scheduler.cancel()
+                    scheduler.join()
+            elif command == 'auto':
+                if args[0] not in ('on', 'off'):
+                    raise ValueError(args[0])
+                if args[0] == 'on' and self.config.get('contact') is None:
+                    print("No contact settings in the session file")
+                else:
+                    self.session.set_auto(args[0] == 'on')
+            elif command == 'bias':
+                self.session.bias()
+            elif command == 'wait':
+                time.sleep(float(args[0]))
+            elif command == 'status':
+                self.status()
+            elif command == 'quit':
+                return False
+            else:
+                print("Unknown command %s" % command)
+        except (IndexError, ValueError, OSError):
+            print("Bad arguments for %s: %s" % (command, ' '.join(args)))
+        self.report_errors()
+        return True
+
+    def run(self, lines):
+        for line in lines:
+            if not self.run_command(line):
+                break
+
+    def close(self):
+        self.stop()
+        self.session.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run trials without the GUI')
+    parser.add_argument('session', help='JSON session file')
+    parser.add_argument('script', nargs='?', help='file of commands, read from stdin if not given')
+    args = parser.parse_args()
+
+    runner = HeadlessRunner(load_session(args.session))
+    try:
+        runner.open()
+        if args.script:
+            with open(args.script) as fileHandle:
+                runner.run(fileHandle)
+        else:
+            runner.run(sys.stdin)
+    finally:
+        runner.close()
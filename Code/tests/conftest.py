@@ -0,0 +1,8 @@
+'''
+The acquisition and analysis modules are scripts of the Code folder, the tests import them from there.
+Run from the Code folder: python -m pytest -q tests
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,117 @@
+import time
+import numpy as np
+import pytest
+from ATI_Mini40_data_bank import split_ati_frames, parse_ati_counts, parse_ati_frames, ATISerialReader, SCALE
+
+def frames_text(counts):
+    return ''.join('0,%d,%d,%d,%d,%d,%d\r\n' % tuple(r) for r in counts.tolist()).encode()
+
+def test_bulk_parse_of_a_batch():
+    counts = np.random.RandomState(0).randint(-20000, 20000, (500, 6))
+    buffer = bytearray(frames_text(counts))
+    frames = split_ati_frames(buffer)
+    assert len(buffer) == 0
+    data, dropped = parse_ati_frames(frames)
+    assert dropped == 0
+    assert np.array_equal(data, counts/SCALE)
+
+def test_partial_frame_is_left_in_the_buffer():
+    buffer = bytearray(b'0,1,2,3,4,5,6\r\n0,7,8,9,10,11,12\r\n0,13,14')
+    frames = split_ati_frames(buffer)
+    assert frames == [b'0,1,2,3,4,5,6', b'0,7,8,9,10,11,12']
+    assert bytes(buffer) == b'0,13,14'
+    buffer += b',15,16,17\r\n'
+    assert split_ati_frames(buffer) == [b'0,13,14,15,16,17']
+
+def test_prompt_before_a_frame_is_removed():
+    buffer = bytearray(b'QS\r\n>0,1,2,3,4,5,6\r\n')
+    counts, dropped = parse_ati_counts(split_ati_frames(buffer))
+    # The echo of the command is not a data frame
+    assert dropped == 1
+    assert counts.tolist() == [[1, 2, 3, 4, 5, 6]]
+
+def test_corrupted_frame_falls_back_to_frame_by_frame_parsing():
+    frames = [b'0,1,2,3,4,5,6', b'0,7,8,x9,10,11,12', b'0,13,14,15,16,17,18', b'0,1,2,3', b'0,19,20,21,22,23,24']
+    counts, dropped = parse_ati_counts(frames)
+    assert dropped == 2
+    assert counts.tolist() == [[1, 2, 3, 4, 5, 6], [13, 14, 15, 16, 17, 18], [19, 20, 21, 22, 23, 24]]
+
+def test_no_valid_frame():
+    counts, dropped = parse_ati_counts([b'garbage', b'0,1'])
+    assert counts.shape == (0, 6)
+    assert dropped == 2
+
+def test_stamps_of_batches_read_close_together_increase():
+    reader = ATISerialReader(None, sample_period=1/200)
+    stamps = []
+    # 3 samples read 1 ms after the previous batch, then the same read time again, then after a pause
+    for timestamp, n in ((10.0, 2), (10.001, 3), (10.001, 1), (11.0, 4)):
+        reader.buffer += frames_text(np.zeros((n, 6), dtype=int))
+        stamps.extend(reader.parse(timestamp)[:,0])
+    intervals = np.diff(stamps)
+    assert np.all(intervals > 0)
+    assert np.allclose(stamps[:2], [9.995, 10.0])
+    # Spread between the reads, the pause is not spread
+    assert np.allclose(stamps[2:5], 10.0 + np.arange(1, 4)/3000)
+    assert np.allclose(stamps[-4:], 11.0 - np.arange(3, -1, -1)/200)
+
+@pytest.mark.parametrize('rate', [200, 1000])
+def test_stamps_of_the_simulated_controller_increase(rate):
+    serial = pytest.importorskip('serial')
+    from Instrumented_Object_GUI_Sim import ATISimulator
+    simulator = ATISimulator(rate)
+    port = serial.Serial(simulator.start(), timeout=0.05)
+    reader = ATISerialReader(port, 1/rate)
+    reader.start()
+    try:
+        port.write(b'QS\r\n')
+        blocks = []
+        deadline = time.monotonic() + 1.5
+        while time.monotonic() < deadline:
+            block = reader.get(0.1)
+            if block is not None:
+                blocks.append(block)
+    finally:
+        reader.stop(1)
+        port.close()
+        simulator.terminate()
+    stamps = np.concatenate(blocks)[:,0]
+    intervals = np.diff(stamps)
+    assert len(stamps) > rate
+    assert np.all(intervals > 0)
+    assert np.all(intervals <= 0.2)
+    assert abs(np.median(intervals) - 1/rate) < 0.2/rate
+
+def test_fields_out_of_range_are_malformed():
+    # Too large for int64: the bulk parse saturates it, int() does not
+    frames = [b'0,1,2,3,4,5,6', b'0,1,2,3,4,5,99999999999999999999', b'0,7,8,9,10,11,%d' % (2**31 + 1)]
+    counts, dropped = parse_ati_counts(frames)
+    assert dropped == 2
+    assert counts.tolist() == [[1, 2, 3, 4, 5, 6]]
+    counts, dropped = parse_ati_counts([b'0,1,x,3,4,5,6', b'0,1,2,3,4,5,99999999999999999999', b'0,-1,-2,-3,-4,-5,-6'])
+    assert dropped == 2
+    assert counts.tolist() == [[-1, -2, -3, -4, -5, -6]]
+
+class BrokenPort:
+    in_waiting = 0
+
+    def read(self, size):
+        raise OSError("device disconnected")
+
+def test_reader_keeps_the_error_that_stopped_it():
+    reader = ATISerialReader(BrokenPort())
+    reader.start()
+    reader.join(1)
+    assert not reader.is_alive()
+    assert reader.error == "OSError: device disconnected"
+
+def test_reader_keeps_the_frame_after_a_prompt():
+    reader = ATISerialReader(None)
+    # The controller echoes the bias command and writes its prompt before the next frame
+    reader.buffer += b'0,1,2,3,4,5,6\r\nSB\r\n>0,7,8,9,10,11,12\r\n>QS\r\n>0,13,14,15,16,17,18\r\n'
+    block = reader.parse(5.0)
+    assert np.allclose(block[:,1:]*SCALE, [[1, 2, 3, 4, 5, 6], [7, 8, 9, 10, 11, 12], [13, 14, 15, 16, 17, 18]])
+    assert reader.dropped == 0
+    assert reader.get_reply(0) == (5.0, 'SB')
+    assert reader.get_reply(0) == (5.0, 'QS')
+    assert reader.get_reply(0) is None
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from Instrumented_Object_GUI_Writer import BinaryTrialFile, load_trial, read_trial_header, convert_to_csv, HEADER_ALIGN
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+
+def test_records_are_mapped_as_written(tmp_path):
+    path = str(tmp_path / 'E1_P01_ft_0.inob')
+    rows = np.random.RandomState(0).standard_normal((300, 7))
+    trialFile = BinaryTrialFile(path, HEADER, {'units': ["s"] + ["N"]*3 + ["Nm"]*3, 'sample_rate': 200,
+                                               'clock': 'monotonic', 'participant': 'P01'})
+    trialFile.write(rows[:100])
+    trialFile.write(rows[100:])
+    trialFile.close()
+    records, info = load_trial(path)
+    assert isinstance(records, np.memmap)
+    assert info['offset'] % HEADER_ALIGN == 0
+    assert info['sample_rate'] == 200 and info['clock'] == 'monotonic'
+    assert info['metadata'] == {'participant': 'P01'}
+    assert [c['unit'] for c in info['columns']] == ["s"] + ["N"]*3 + ["Nm"]*3
+    assert np.array_equal(np.column_stack([records[name] for name in HEADER]), rows)
+    assert read_trial_header(path)['offset'] == info['offset']
+
+def test_typed_columns_and_incomplete_last_record(tmp_path):
+    path = str(tmp_path / 'E1_P01_Camera_0.inob')
+    header = ["index", "timestamp", "flag"]
+    trialFile = BinaryTrialFile(path, header, {'dtypes': ['<i8', '<i8', '<u1']})
+    frames = np.array([[0, 1000, 0], [1, 34333, 1], [2, 67666, 2]])
+    trialFile.write(frames)
+    trialFile.close()
+    # A crash in the middle of a record
+    with open(path, "ab") as fileHandle:
+        fileHandle.write(b'\x01\x02\x03')
+    records, info = load_trial(path)
+    assert records.dtype.itemsize == 17
+    assert records['timestamp'].tolist() == [1000, 34333, 67666]
+    assert records['flag'].dtype == np.uint8 and records['flag'].tolist() == [0, 1, 2]
+    csvPath = convert_to_csv(path)
+    with open(csvPath) as fileHandle:
+        assert fileHandle.read().splitlines() == ["index,timestamp,flag", "0,1000,0", "1,34333,1", "2,67666,2"]
+
+def test_file_without_records(tmp_path):
+    path = str(tmp_path / 'E1_P01_ft_1.inob')
+    BinaryTrialFile(path, HEADER).close()
+    records, info = load_trial(path)
+    assert len(records) == 0 and records.dtype.names == tuple(HEADER)
+    assert os.path.getsize(path) == info['offset']
@@ -0,0 +1,44 @@
+import numpy as np
+from Instrumented_Object_GUI_Buffer import TrialBuffer
+
+def rows(start, n, columns=3):
+    return np.arange(start*columns, (start + n)*columns, dtype=np.float64).reshape(n, columns)
+
+def test_growth_keeps_the_chunks_in_place():
+    buffer = TrialBuffer(3, chunk_rows=10)
+    buffer.append(rows(0, 4))
+    first = buffer.chunks[0]
+    buffer.append(rows(4, 23))
+    buffer.append(rows(27, 1)[0])
+    assert len(buffer) == 28
+    assert len(buffer.chunks) == 3 and buffer.fill == 8
+    # Growing adds chunks, the data already stored is not copied
+    assert buffer.chunks[0] is first
+    assert np.array_equal(buffer.to_array(), rows(0, 28))
+
+def test_full_chunks_are_handed_over_and_the_rest_at_the_end():
+    buffer = TrialBuffer(3, chunk_rows=10)
+    buffer.append(rows(0, 25))
+    full = buffer.take_full()
+    assert len(full) == 2 and len(buffer) == 5
+    assert buffer.take_full() == []
+    buffer.append(rows(25, 5))
+    # The last chunk is full as well
+    assert np.array_equal(np.concatenate(buffer.take_full()), rows(20, 10))
+    assert len(buffer) == 0 and buffer.chunks == []
+    buffer.append(rows(30, 3))
+    rest = buffer.take_all()
+    assert np.array_equal(np.concatenate(full + rest), np.concatenate([rows(0, 20), rows(30, 3)]))
+    assert len(buffer) == 0 and buffer.to_array().shape == (0, 3)
+
+def test_reserved_chunks_are_used_first():
+    buffer = TrialBuffer(2, chunk_rows=4, dtype=np.int64)
+    buffer.reserve(2)
+    spare = list(buffer.spare)
+    buffer.append(np.ones((6, 2)))
+    assert buffer.spare == []
+    assert set(map(id, buffer.chunks)) == set(map(id, spare))
+    assert buffer.to_array().dtype == np.int64
+    # Released at the end of the trial
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.chunks == []
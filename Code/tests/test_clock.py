@@ -0,0 +1,42 @@
+import numpy as np
+from Instrumented_Object_GUI_Clock import ClockOffsetEstimator, device_to_host
+
+def readings(estimator, device, offset, drift, rng, preempted=()):
+    ''' Feeds readings of a device clock in us against a host clock, the bracket of some readings is preempted '''
+    for k, ticks in enumerate(device):
+        host = offset + (1 + drift)*1e-6*ticks
+        before = host - rng.uniform(20e-6, 40e-6)
+        after = host + rng.uniform(20e-6, 40e-6)
+        if k in preempted:
+            after = after + 0.005
+        estimator.add(ticks, before, after)
+
+def test_offset_and_drift_of_the_device_clock():
+    rng = np.random.RandomState(0)
+    estimator = ClockOffsetEstimator()
+    # GPU clock in us, large values, 40 ppm fast, one reading per 100 ms
+    device = 5e9 + 1e5*np.arange(300)
+    readings(estimator, device, 2638.27, 40e-6, rng, preempted=(50, 120, 121))
+    assert estimator.rejected == 3
+    assert abs(1e6*estimator.drift - 40) < 1
+    frames = device[-1] + np.array([0, 16667, 33333])
+    expected = 2638.27 + (1 + 40e-6)*1e-6*frames
+    assert np.allclose(estimator.to_host(frames), expected, rtol=0, atol=50e-6)
+    metadata = estimator.metadata()
+    assert metadata['samples'] == 297 and metadata['residual'] < 50e-6
+    assert np.allclose(device_to_host(frames, metadata), estimator.to_host(frames), rtol=0, atol=1e-9)
+
+def test_window_follows_a_change_of_drift():
+    rng = np.random.RandomState(1)
+    estimator = ClockOffsetEstimator(window=100)
+    readings(estimator, 1e5*np.arange(200), 10.0, 20e-6, rng)
+    # The drift changes, the last window of readings gives the new one
+    start = 1e5*200
+    readings(estimator, start + 1e5*np.arange(1, 101), 10.0 + (20e-6 - 80e-6)*1e-6*start, 80e-6, rng)
+    assert abs(1e6*estimator.drift - 80) < 2
+
+def test_single_reading():
+    estimator = ClockOffsetEstimator()
+    estimator.add(1e6, 5.0, 5.00002)
+    assert estimator.drift == 0.0
+    assert abs(estimator.to_host(2e6) - 6.00001) < 1e-9
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pytest
+from ATI_Mini40_data_bank import SCALE, SoftwareBias
+from Instrumented_Object_GUI_Writer import (CSVTrialFile, BinaryTrialFile, CompressedTrialFile, TrialWriter, encode_block,
+                                            decode_blocks, load_trial, recover_trial_file)
+from Instrumented_Object_Analysis_Session import RecordedSession, TrialCache
+from Instrumented_Object_Analysis_Index import StudyIndex
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+DIVISORS = [None] + SCALE.tolist()
+
+def ati_rows(n, start=0, seed=0):
+    rng = np.random.RandomState(seed)
+    rows = np.empty((n, 7))
+    rows[:,0] = 1000.0 + (start + np.arange(n))/200 + 1e-4*rng.random_sample(n)
+    rows[:,1:] = np.cumsum(rng.randint(-30, 31, (n, 6)), axis=0)/SCALE
+    return rows
+
+def same_bits(a, b):
+    return np.array_equal(np.ascontiguousarray(a).view(np.int64), np.ascontiguousarray(b).view(np.int64))
+
+@pytest.mark.parametrize('codec', ['zlib', 'lzma'])
+def test_round_trip_is_bit_exact(codec):
+    rows = ati_rows(500)
+    data = encode_block(rows, DIVISORS, codec)
+    decoded, end = decode_blocks(data, 0, 7, DIVISORS, codec)
+    assert end == len(data)
+    assert same_bits(decoded, rows)
+
+def test_values_that_are_not_counts_are_kept_as_float_bits():
+    rows = ati_rows(8)
+    rows[1,1] = np.nan
+    rows[2,2] = np.inf
+    rows[3,3] = -1e300
+    rows[4,4] = -0.0
+    rows[5,5] = 0.1234567
+    data = encode_block(rows, DIVISORS)
+    decoded, end = decode_blocks(data, 0, 7, DIVISORS)
+    assert same_bits(decoded, rows)
+
+def test_file_of_several_blocks_and_recovery_of_a_truncated_block(tmp_path):
+    path = str(tmp_path / 'E1_P01_ft_0.inob')
+    trial = CompressedTrialFile(path, HEADER, {'divisors': DIVISORS, 'units': ["s"] + ["N"]*3 + ["Nm"]*3})
+    blocks = [ati_rows(400, 400*k, seed=k) for k in range(3)]
+    for block in blocks:
+        trial.write(block)
+    trial.close()
+    records, info = load_trial(path)
+    assert same_bits(np.column_stack([records[name] for name in HEADER]), np.concatenate(blocks))
+    # A crash in the middle of the last block
+    size = os.path.getsize(path)
+    with open(path, "rb+") as fileHandle:
+        fileHandle.truncate(size - 100)
+    records, info = load_trial(path)
+    assert len(records) == 800
+    assert same_bits(records['fz'], np.concatenate(blocks[:2])[:,3])
+    assert recover_trial_file(path) == 800
+    assert os.path.getsize(path) < size - 100
+    records, info = load_trial(path)
+    assert len(records) == 800
+
+def test_software_biased_trial_loads_the_same_in_all_formats(tmp_path):
+    raw = ati_rows(600)
+    bias = SoftwareBias(0.5, 200)
+    bias.add(raw[:100])
+    bias.capture()
+    biased = bias.apply(raw.copy())
+    metadata = {'units': ["s"] + ["N"]*3 + ["Nm"]*3, 'divisors': DIVISORS}
+    # As recorded by the ATI process: the compressed files keep the counts without the bias
+    for experiment, fileType in (('E1', CSVTrialFile), ('E2', BinaryTrialFile), ('E3', CompressedTrialFile)):
+        compressed = fileType is CompressedTrialFile
+        path = str(tmp_path / ('%s_P01_ft_0.%s' % (experiment, fileType.extension)))
+        writer = TrialWriter()
+        writer.start()
+        writer.open(path, HEADER, fileType, dict(metadata))
+        writer.update_metadata(bias.metadata(HEADER[1:] if compressed else None))
+        writer.write(raw if compressed else biased)
+        writer.stop(5)
+    session = RecordedSession(str(tmp_path), TrialCache(str(tmp_path / 'cache')))
+    assert len(session) == 3
+    for trial in session:
+        assert np.array_equal(trial['ft'].to_array(), biased)
+    index = StudyIndex(str(tmp_path / 'study.sqlite'))
+    index.update([str(tmp_path)], workers=1)
+    peaks = [row['channel_peak'] for row in index.find(channel='fz')]
+    index.close()
+    assert len(peaks) == 3 and len(set(peaks)) == 1
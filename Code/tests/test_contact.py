@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from Instrumented_Object_GUI_Contact import ContactDetector, RecentRows, GRASP, LIFT, RELEASE
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+
+def force_rows(fz, rate=200):
+    rows = np.zeros((len(fz), 7))
+    rows[:,0] = np.arange(len(fz))/rate
+    rows[:,3] = fz
+    return rows
+
+def detect(rows, block=7, **settings):
+    detector = ContactDetector(HEADER, 'fz', **settings)
+    events = []
+    for start in range(0, len(rows), block):
+        events.extend(detector.process(rows[start:start+block], rows[min(start+block, len(rows)) - 1, 0]))
+    return events
+
+def grasp(rate=200):
+    # Rest, ramp to 10 N in 0.5 s, hold, back to rest
+    return np.concatenate([np.zeros(100), np.linspace(0, 10, 101), np.full(200, 10.0), np.linspace(10, 0, 101), np.zeros(100)])
+
+def test_grasp_lift_release_with_interpolated_times():
+    events = detect(force_rows(grasp()))
+    assert [e['event'] for e in events] == [GRASP, LIFT, RELEASE]
+    # 1 N and 5 N are reached 0.05 and 0.25 s into the ramp up from 0.5 s, 0.5 N 0.475 s into the ramp down from 2.005 s
+    assert abs(events[0]['time'] - (0.5 + 0.05)) < 1e-9
+    assert abs(events[1]['time'] - (0.5 + 0.25)) < 1e-9
+    assert abs(events[2]['time'] - (2.005 + 0.475)) < 1e-9
+    assert all(e['latency'] >= 0 for e in events)
+
+def test_events_do_not_depend_on_the_blocks():
+    rows = force_rows(grasp())
+    times = [[e['time'] for e in detect(rows, block)] for block in (1, 3, 10, 64, len(rows))]
+    assert all(np.allclose(t, times[0]) for t in times)
+
+def test_noise_around_a_threshold_makes_one_event():
+    rng = np.random.RandomState(0)
+    # The force hovers around the onset threshold, within the hysteresis band
+    fz = np.concatenate([np.zeros(50), rng.uniform(0.6, 1.4, 400), np.zeros(50)])
+    events = detect(force_rows(fz))
+    assert [e['event'] for e in events] == [GRASP, RELEASE]
+
+def test_lift_is_detected_again_after_the_force_went_down():
+    fz = np.concatenate([np.zeros(10), np.full(20, 6.0), np.full(20, 4.8), np.full(20, 6.0), np.full(20, 4.0), np.full(20, 6.0), np.zeros(10)])
+    events = [e['event'] for e in detect(force_rows(fz))]
+    # 4.8 N is within the band below the lift threshold, 4 N re-arms the lift
+    assert events == [GRASP, LIFT, LIFT, RELEASE]
+
+def test_resultant_force_channel():
+    rows = force_rows(np.zeros(40))
+    rows[10:30,1:4] = [0.6, 0.0, 0.8]
+    detector = ContactDetector(HEADER, 'F', onset=0.9, release=0.5, lift=None)
+    assert [e['event'] for e in detector.process(rows, 1.0)] == [GRASP, RELEASE]
+
+def test_thresholds_must_leave_a_hysteresis_band():
+    with pytest.raises(ValueError):
+        ContactDetector(HEADER, 'fz', onset=1.0, release=1.0)
+    with pytest.raises(ValueError):
+        ContactDetector(HEADER, 'fz', onset=1.0, release=0.5, lift=0.8)
+
+def test_recent_rows_since_a_time():
+    recent = RecentRows(7, 50)
+    rows = force_rows(np.arange(120.0))
+    for start in range(0, 120, 17):
+        recent.add(rows[start:start+17])
+    kept = recent.since(0.4)
+    assert np.array_equal(kept[:,3], np.arange(80.0, 120.0))
+    assert len(recent.since(0)) == 50
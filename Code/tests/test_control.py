@@ -0,0 +1,44 @@
+import time
+import multiprocessing
+from Instrumented_Object_GUI_Control import StateNotifier, CPUMonitor
+
+def wait_for_change(notifier, seen, woken):
+    woken.put((notifier.wait(seen, 5.0), time.monotonic()))
+
+def test_notify_wakes_a_waiting_process():
+    notifier = StateNotifier()
+    woken = multiprocessing.Queue()
+    process = multiprocessing.Process(target=wait_for_change, args=(notifier, 0, woken))
+    process.start()
+    time.sleep(0.2)
+    notified = time.monotonic()
+    notifier.notify()
+    version, wakeTime = woken.get(timeout=5)
+    process.join(5)
+    assert version == 1
+    assert wakeTime - notified < 1.0
+
+def test_change_before_the_wait_is_not_missed():
+    notifier = StateNotifier()
+    notifier.notify()
+    start = time.monotonic()
+    assert notifier.wait(0, 5.0) == 1
+    assert time.monotonic() - start < 1.0
+
+def test_wait_returns_the_same_version_on_timeout():
+    notifier = StateNotifier()
+    notifier.notify()
+    start = time.monotonic()
+    assert notifier.wait(1, 0.1) == 1
+    assert time.monotonic() - start >= 0.1
+
+def test_cpu_use_of_busy_and_idle_loops(capsys):
+    monitor = CPUMonitor('Test')
+    end = time.monotonic() + 0.2
+    while time.monotonic() < end:
+        pass
+    assert monitor.usage() > 50
+    monitor.report()
+    assert "Test process CPU use" in capsys.readouterr().out
+    time.sleep(0.2)
+    assert monitor.usage() < 50
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from Instrumented_Object_GUI_Filter import butter_sos, SOSFilter, ForceProcessor
+
+def sosfilt_reference(sos, x):
+    ''' Sample by sample transposed direct form II, like scipy.signal.sosfilt, starting from rest '''
+    y = np.array(x, dtype=np.float64)
+    for b0, b1, b2, a0, a1, a2 in sos:
+        z1 = np.zeros(y.shape[1])
+        z2 = np.zeros(y.shape[1])
+        out = np.empty_like(y)
+        for k in range(len(y)):
+            out[k] = b0*y[k] + z1
+            z1 = b1*y[k] - a1*out[k] + z2
+            z2 = b2*y[k] - a2*out[k]
+        y = out
+    return y
+
+def signal(n, channels=3, seed=0):
+    rng = np.random.RandomState(seed)
+    t = np.arange(n)/200
+    return np.sin(2*np.pi*3*t)[:,None] + 0.3*rng.standard_normal((n, channels))
+
+@pytest.mark.parametrize('order', [1, 2, 4, 5])
+def test_blocks_of_any_size_match_the_sample_by_sample_filter(order):
+    sos = butter_sos(order, 20.0, 200)
+    x = signal(1000)
+    sosFilter = SOSFilter(sos, 3, max_block=64)
+    sosFilter.reset()
+    sizes = np.random.RandomState(1).randint(1, 150, 200)
+    bounds = np.concatenate([[0], np.cumsum(sizes)])
+    bounds = bounds[bounds < len(x)].tolist() + [len(x)]
+    y = np.concatenate([sosFilter.process(x[a:b]) for a, b in zip(bounds[:-1], bounds[1:])])
+    assert np.allclose(y, sosfilt_reference(sos, x), rtol=0, atol=1e-10)
+
+def test_design_and_output_match_scipy():
+    signalModule = pytest.importorskip('scipy.signal')
+    # scipy orders the sections and spreads the gain differently, the filter is the same
+    reference = signalModule.butter(4, 20.0, fs=200, output='sos')
+    x = signal(500)
+    for sos in (butter_sos(4, 20.0, 200), reference):
+        sosFilter = SOSFilter(sos, 3)
+        sosFilter.reset()
+        assert np.allclose(sosFilter.process(x), signalModule.sosfilt(reference, x, axis=0), atol=1e-10)
+
+def test_unit_gain_and_steady_state_start():
+    sosFilter = SOSFilter(butter_sos(4, 20.0, 200), 2)
+    level = np.tile([3.0, -1.5], (300, 1))
+    # The first block sets the state to the steady state of its first row, there is no start transient
+    assert np.allclose(sosFilter.process(level), level, atol=1e-9)
+
+def test_cutoff_out_of_range():
+    with pytest.raises(ValueError):
+        butter_sos(4, 120.0, 200)
+
+def test_resultant_force_and_rate():
+    processor = ForceProcessor(200, 20.0, 4)
+    block = np.zeros((400, 7))
+    block[:,0] = np.arange(400)/200
+    block[:,1:4] = [3.0, 4.0, 12.0]
+    output = processor.process(block)
+    assert np.allclose(output[:,7], 13.0)
+    assert np.allclose(output[:,8], 0.0, atol=1e-6)
+
+def test_force_rate_does_not_depend_on_the_timestamps():
+    n = 600
+    block = np.zeros((n, 7))
+    block[:,0] = np.arange(n)/200
+    # Force rising by 40 N/s
+    block[:,3] = 0.2*np.arange(n)
+    jittered = block.copy()
+    # Reads stamped late, early and at the same time as the previous sample
+    jittered[:,0] = jittered[:,0] + np.random.RandomState(0).uniform(-0.004, 0.004, n)
+    jittered[100:110,0] = jittered[100,0]
+    outputs = []
+    for rows in (block, jittered):
+        processor = ForceProcessor(200, 20.0, 4)
+        outputs.append(np.concatenate([processor.process(rows[a:a+37]) for a in range(0, n, 37)]))
+    assert np.array_equal(outputs[0][:,8], outputs[1][:,8])
+    assert np.allclose(outputs[1][100:,8], 40.0)
@@ -0,0 +1,36 @@
+from fractions import Fraction
+import numpy as np
+from Instrumented_Object_GUI_Frames import FrameTimestampOutput, FRAME_HEADER, FRAME_AFTER_DROP, FRAME_DUPLICATE
+from Instrumented_Object_GUI_Writer import TrialWriter, load_trial, read_trial_metadata
+
+class Frame:
+    complete = True
+    frame_type = 1
+
+class Camera:
+    ''' The framerate of a PiCamera is a Fraction subclass '''
+    resolution = (640, 480)
+    framerate = Fraction(30, 1)
+    frame = Frame()
+
+def test_frame_file_of_a_fraction_framerate(tmp_path):
+    camera = Camera()
+    writer = TrialWriter()
+    writer.start()
+    framePath = str(tmp_path / 'frames.inob')
+    FrameTimestampOutput.prepare(writer, framePath, camera.framerate, camera.resolution)
+    output = FrameTimestampOutput(camera, str(tmp_path / 'video.h264'), framePath, camera.framerate, writer, ledOn=0, ledOff=0)
+    output.addFrame(0, 0)
+    output.addFrame(1, 33333)
+    output.addFrame(1, 33333)
+    output.addFrame(4, 133333)
+    output.close()
+    writer.stop(5)
+    records, info = load_trial(framePath)
+    assert info['sample_rate'] == 30.0
+    assert info['metadata']['resolution'] == [640, 480]
+    assert list(records.dtype.names) == FRAME_HEADER
+    assert records['timestamp'].tolist() == [0, 33333, 33333, 133333]
+    assert records['flag'].tolist() == [0, 0, FRAME_DUPLICATE, FRAME_AFTER_DROP]
+    assert output.dropped == 2
+    assert read_trial_metadata(framePath)['writer_stats']['rows'] == 4
@@ -0,0 +1,82 @@
+import json
+import threading
+import pytest
+from Instrumented_Object_Headless import HeadlessRunner, load_session
+from Instrumented_Object_GUI_Session import CAMERA_PRESETS
+from Instrumented_Object_GUI_Stats import HealthBoard
+
+class FakeSession:
+    ''' Records the calls made by the runner on an AcquisitionSession '''
+
+    def __init__(self):
+        self.calls = []
+        self.stopEvent = threading.Event()
+        self.dataRecordingEvent = threading.Event()
+        self.ATIHealth = HealthBoard()
+        self.IMUHealth = HealthBoard()
+        self.cameraHealth = HealthBoard()
+        self.reported = []
+
+    def start_trial(self, repeat=False):
+        self.calls.append(('start', repeat))
+        self.stopEvent.clear()
+        self.dataRecordingEvent.set()
+
+    def stop_trial(self, next_repeat=None):
+        self.calls.append(('stop',))
+        self.stopEvent.set()
+
+    def wait_stopped(self, timeout=5.0):
+        return True
+
+    def bias(self):
+        self.calls.append(('bias',))
+
+    def set_auto(self, enabled):
+        self.calls.append(('auto', enabled))
+
+    def errors(self):
+        reported, self.reported = self.reported, []
+        return reported
+
+def runner(config=None):
+    session = FakeSession()
+    return HeadlessRunner(config or {}, session=session), session
+
+def test_session_file(tmp_path):
+    path = tmp_path / 'session.json'
+    path.write_text(json.dumps({'participant': 'P01', 'experiment': 'E1', 'folder': str(tmp_path)}))
+    assert load_session(str(path))['camera'] == CAMERA_PRESETS[0]
+    path.write_text(json.dumps({'participant': 'P01', 'folder': str(tmp_path)}))
+    with pytest.raises(ValueError):
+        load_session(str(path))
+
+def test_script_of_commands(capsys):
+    headless, session = runner({'contact': {'onset': 1.0}})
+    headless.run(["# a comment", "", "start", "repeat  # stops the trial first", "stop", "stop",
+                  "trial 0.01", "bias", "auto on", "AUTO off", "wait 0", "quit", "start"])
+    assert session.calls == [('start', False), ('stop',), ('start', True), ('stop',), ('start', False), ('stop',),
+                             ('bias',), ('auto', True), ('auto', False)]
+    assert not headless.recording
+
+def test_bad_commands_are_reported_and_skipped(capsys):
+    headless, session = runner()
+    session.reported.append("ATI: Error in write of trial.csv: OSError: disk full")
+    for line in ("trial", "wait soon", "auto maybe", "auto on", "jump"):
+        assert headless.run_command(line)
+    out = capsys.readouterr().out
+    assert out.count("Bad arguments") == 3
+    assert "No contact settings" in out
+    assert "Unknown command jump" in out
+    assert "Error from ATI: Error in write of trial.csv" in out
+    assert session.calls == []
+    assert headless.run_command("QUIT") is False
+
+def test_stop_of_a_trial_started_by_a_grasp():
+    headless, session = runner()
+    # Started by the ATI process, not by the runner
+    session.dataRecordingEvent.set()
+    headless.run_command("stop")
+    assert session.calls == [('stop',)]
+    headless.run_command("stop")
+    assert session.calls == [('stop',)]
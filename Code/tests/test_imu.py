@@ -0,0 +1,60 @@
+import struct
+import numpy as np
+from Instrumented_Object_GUI_IMU import BNO055BurstReader, imu_header, IMU_CHANNELS, CALIBRATION_REGISTER
+
+class FakeI2C:
+    ''' Serves a register map like adafruit_bus_device.I2CDevice and records the transactions '''
+
+    def __init__(self, registers):
+        self.registers = registers
+        self.transactions = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write_then_readinto(self, out_buffer, in_buffer):
+        self.transactions.append((out_buffer[0], len(in_buffer)))
+        in_buffer[:] = self.registers[out_buffer[0]:out_buffer[0]+len(in_buffer)]
+
+class FakeSensor:
+
+    def __init__(self, registers):
+        self.i2c_device = FakeI2C(registers)
+
+# Raw int16 values of each channel, with negative values and the int16 limits
+RAW = {'gyro': [16, -32, 32767], 'euler': [5760, -16, 1], 'quaternion': [16384, -8192, 0, -32768],
+       'linear_acceleration': [981, -100, 2]}
+
+def register_map(calibration=0b11100100):
+    registers = bytearray(0x40)
+    for channel, values in RAW.items():
+        struct.pack_into('<%ih' % len(values), registers, IMU_CHANNELS[channel][0], *values)
+    registers[CALIBRATION_REGISTER] = calibration
+    return registers
+
+def test_all_channels_are_decoded_from_one_transaction():
+    channels = ('gyro', 'euler', 'quaternion', 'linear_acceleration', 'calibration')
+    sensor = FakeSensor(register_map())
+    reader = BNO055BurstReader(sensor, channels)
+    row = reader.read()
+    # One read from the gyro to the calibration status
+    assert sensor.i2c_device.transactions == [(0x14, CALIBRATION_REGISTER + 1 - 0x14)]
+    expected = []
+    for channel in channels[:-1]:
+        expected.extend(np.array(RAW[channel])*IMU_CHANNELS[channel][2])
+    assert np.allclose(row[:-1], expected, rtol=0, atol=1e-12)
+    assert row[-1] == 0b11100100
+    assert len(row) == len(reader.header) == len(reader.units) == 14
+    assert imu_header(channels) == ["Time"] + reader.header
+
+def test_channels_in_any_order_read_the_block_they_span():
+    sensor = FakeSensor(register_map())
+    reader = BNO055BurstReader(sensor, ('linear_acceleration', 'euler'))
+    row = reader.read()
+    assert sensor.i2c_device.transactions == [(0x1A, 0x2E - 0x1A)]
+    assert reader.header == ["linA1","linA2","linA3","Eula1","Eula2","Eula3"]
+    assert np.allclose(row, [9.81, -1.0, 0.02, 360.0, -1.0, 1/16])
+    assert reader.units == ["m/s^2"]*3 + ["deg"]*3
@@ -0,0 +1,37 @@
+import numpy as np
+from Instrumented_Object_Analysis_LED_Sync import ArrayFrameSource, roi_brightness, find_edges
+
+def pulse_video(frames, on, off, dark=40, lit=200, noise=3.0, seed=0):
+    ''' Frames of a dark region with the led lit from frame on (included) to frame off (excluded) '''
+    rng = np.random.RandomState(seed)
+    video = dark + noise*rng.standard_normal((frames, 8, 8))
+    video[on:off] = lit + noise*rng.standard_normal((off - on, 8, 8))
+    return np.clip(video, 0, 255).astype(np.uint8)
+
+def test_single_short_pulse_in_long_video():
+    # One minute at 60 fps, the pulse lasts 30 frames, half a percent of the video
+    video = pulse_video(3600, 30, 60)
+    on, off = find_edges(roi_brightness(ArrayFrameSource(video), (0, 0, 8, 8)))
+    assert abs(on - 29.5) < 0.1
+    assert abs(off - 59.5) < 0.1
+
+def test_partly_lit_frames_give_fractional_edges():
+    brightness = np.full(600, 40.0)
+    brightness[100:130] = 200.0
+    # Frames 99 and 130 are partly lit, the edges are interpolated where the brightness crosses 120
+    brightness[99] = 40 + 0.75*160
+    brightness[130] = 40 + 0.5*160
+    on, off = find_edges(brightness)
+    assert abs(on - (98 + 80/120)) < 1e-9
+    assert abs(off - 130.0) < 1e-9
+
+def test_no_pulse():
+    video = pulse_video(1200, 0, 0)
+    assert find_edges(roi_brightness(ArrayFrameSource(video), (0, 0, 8, 8))) == (None, None)
+
+def test_pulse_not_switched_off():
+    brightness = np.full(1000, 40.0)
+    brightness[900:] = 200.0
+    on, off = find_edges(brightness)
+    assert abs(on - 899.5) < 1e-9
+    assert off is None
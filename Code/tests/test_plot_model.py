@@ -0,0 +1,41 @@
+import numpy as np
+from Instrumented_Object_GUI_Plot import PlotModel, decimate
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+
+def stream(n, seed=0):
+    rows = np.random.RandomState(seed).standard_normal((n, len(HEADER)))
+    rows[:,0] = np.arange(n)/200
+    return rows
+
+def test_kept_reductions_match_a_fresh_reduction():
+    rows = stream(9000)
+    plot = PlotModel(HEADER, 10, 200)
+    sizes = np.random.RandomState(1).randint(1, 40, 1000)
+    position = 0
+    for size in sizes:
+        plot.append(rows[position:position+size])
+        position = position + size
+        if position >= len(rows):
+            break
+        x, y = plot.channel("fz", 300)
+        fresh = PlotModel(HEADER, 10, 200)
+        fresh.append(rows[:position])
+        xf, yf = fresh.channel("fz", 300)
+        assert np.array_equal(x, xf) and np.array_equal(y, yf)
+    assert len(x) <= 2*300 + 2*10
+
+def test_reduction_keeps_the_peaks():
+    rows = stream(2001)
+    rows[1234,3] = 50.0
+    rows[1500,3] = -50.0
+    plot = PlotModel(HEADER, 10, 200)
+    plot.append(rows)
+    x, y = plot.channel("fz", 100)
+    assert y.max() == 50.0 and y.min() == -50.0
+    assert x[-1] == 0.0 and x[0] == -10.0
+
+def test_no_reduction_for_narrow_windows():
+    rows = stream(100)
+    x, y = decimate(rows[:,0], rows[:,3], 80)
+    assert np.array_equal(y, rows[:,3])
@@ -0,0 +1,65 @@
+import json
+import time
+import pytest
+from Instrumented_Object_GUI_Scheduler import TrialScheduler, load_protocol, protocol_recordings
+
+class FakeSession:
+    '''
+    Records the calls of the scheduler, each start and stop takes latency seconds and the processes
+    take close_time seconds to close each trial
+    '''
+
+    def __init__(self, latency=0.0, close_time=0.0):
+        self.latency = latency
+        self.close_time = close_time
+        self.calls = []
+
+    def start_trial(self, repeat=False):
+        self.calls.append(('start', repeat, time.monotonic()))
+        time.sleep(self.latency)
+
+    def stop_trial(self, next_repeat=None):
+        self.calls.append(('stop', next_repeat, time.monotonic()))
+        time.sleep(self.latency)
+
+    def wait_stopped(self, timeout=5.0):
+        time.sleep(self.close_time)
+        return True
+
+def test_protocol_file(tmp_path):
+    path = tmp_path / 'protocol.json'
+    path.write_text(json.dumps([{"duration": 10, "repeats": 2, "interval": 5}, {"duration": 30}]))
+    protocol = load_protocol(str(path))
+    assert protocol == [{'duration': 10.0, 'repeats': 2, 'interval': 5.0}, {'duration': 30.0, 'repeats': 0, 'interval': 0.0}]
+    assert protocol_recordings(protocol) == [(0, False, 10.0, 5.0), (0, True, 10.0, 5.0), (0, True, 10.0, 5.0), (1, False, 30.0, 0.0)]
+    path.write_text(json.dumps([{"repeats": 1}]))
+    with pytest.raises(ValueError):
+        load_protocol(str(path))
+
+def test_recordings_keep_to_the_protocol_times():
+    # Starting and stopping take time, the delays must not add up
+    session = FakeSession(latency=0.01, close_time=0.01)
+    protocol = [{'duration': 0.05, 'repeats': 3, 'interval': 0.03}, {'duration': 0.05, 'interval': 0.03}]
+    scheduler = TrialScheduler(session, protocol)
+    start = time.monotonic()
+    scheduler.start()
+    scheduler.join(5)
+    starts = [call for call in session.calls if call[0] == 'start']
+    stops = [call for call in session.calls if call[0] == 'stop']
+    assert [repeat for name, repeat, t in starts] == [False, True, True, True, False]
+    # Each stop tells the processes if the next recording is a repeat
+    assert [repeat for name, repeat, t in stops] == [True, True, True, False, False]
+    for k in range(5):
+        assert abs(starts[k][2] - start - 0.08*k) < 0.02
+        assert abs(stops[k][2] - start - 0.08*k - 0.05) < 0.02
+    assert len(scheduler.times) == 5 and scheduler.late == 0
+
+def test_cancel_stops_the_recording():
+    session = FakeSession()
+    scheduler = TrialScheduler(session, [{'duration': 10, 'repeats': 5}])
+    scheduler.start()
+    time.sleep(0.05)
+    scheduler.cancel()
+    scheduler.join(1)
+    assert not scheduler.is_alive()
+    assert [call[0] for call in session.calls] == ['start', 'stop']
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import Instrumented_Object_Analysis_Session as analysis
+from Instrumented_Object_Analysis_Session import RecordedSession, TrialCache, parse_trial_name, parse_csv
+from Instrumented_Object_GUI_Writer import BinaryTrialFile
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+
+def write_csv(path, rows, tail=''):
+    with open(path, "w") as fileHandle:
+        fileHandle.write(','.join(HEADER) + '\n')
+        for row in rows:
+            fileHandle.write(','.join('%r' % float(v) for v in row) + '\n')
+        fileHandle.write(tail)
+
+def rows(n, start=0):
+    return np.column_stack([np.arange(start, start + n)/200] + [np.arange(n)*k for k in range(1, 7)]).astype(float)
+
+def test_trial_names():
+    assert parse_trial_name('/data/E1_P_01_ft_3.csv') == ('E1', 'P_01', 'ft', 3, 0)
+    assert parse_trial_name('E1_P01_Camera_3_2.inob') == ('E1', 'P01', 'Camera', 3, 2)
+    assert parse_trial_name('E1_P01_3.h264') is None
+    assert parse_trial_name('E1_P01_ft_3.txt') is None
+
+def test_padding_and_cut_line_are_removed(tmp_path):
+    path = str(tmp_path / 'E1_P01_ft_1.csv')
+    data = rows(5)
+    write_csv(path, np.vstack([data, np.full((3, 7), np.nan)]), tail='0.5,1,2')
+    header, parsed = parse_csv(path)
+    assert header == HEADER
+    assert np.array_equal(parsed, data)
+
+def test_trials_are_grouped_and_ordered(tmp_path):
+    os.makedirs(str(tmp_path / 'later'))
+    write_csv(str(tmp_path / 'E1_P01_ft_2.csv'), rows(3))
+    write_csv(str(tmp_path / 'E1_P01_ftlp_2.csv'), rows(3))
+    write_csv(str(tmp_path / 'E1_P01_ft_2_1.csv'), rows(4))
+    write_csv(str(tmp_path / 'later' / 'E1_P01_ft_1.csv'), rows(2))
+    open(str(tmp_path / 'E1_P01_2.h264'), "wb").close()
+    open(str(tmp_path / 'notes.txt'), "w").close()
+    session = RecordedSession(str(tmp_path), TrialCache(str(tmp_path / 'cache')))
+    assert [(t.trial, t.repeat) for t in session] == [(1, 0), (2, 0), (2, 1)]
+    first, second, repeat = session.trials
+    assert second.sensors == ['ft', 'ftlp'] and second.name == 'E1_P01_2'
+    assert second.video == str(tmp_path / 'E1_P01_2.h264')
+    assert repeat.video is None and repeat.name == 'E1_P01_2_1'
+    assert session.find(trial=2, repeat=1) == [repeat]
+    assert len(repeat['ft']) == 4
+
+def test_columns_are_parsed_once_and_loaded_lazily(tmp_path, monkeypatch):
+    path = str(tmp_path / 'E1_P01_ft_1.csv')
+    write_csv(path, rows(6))
+    cache = TrialCache(str(tmp_path / 'cache'))
+    data = RecordedSession(str(tmp_path), cache).trials[0]['ft']
+    assert data.loaded == {}
+    assert np.array_equal(data['fz'], rows(6)[:,3])
+    assert list(data.loaded) == ['fz']
+    parsed = []
+    monkeypatch.setattr(analysis, 'parse_csv', lambda p: parsed.append(p) or parse_csv(p))
+    reopened = RecordedSession(str(tmp_path), cache).trials[0]['ft']
+    assert isinstance(reopened['fx'], np.memmap)
+    assert np.array_equal(reopened.to_array(), rows(6))
+    assert parsed == []
+    # A file that changed is parsed again
+    write_csv(path, rows(8))
+    assert len(RecordedSession(str(tmp_path), cache).trials[0]['ft']) == 8
+    assert parsed == [path]
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    paths = [str(tmp_path / ('E1_P01_ft_%i.csv' % i)) for i in range(3)]
+    for path in paths:
+        write_csv(path, rows(1000))
+    cache = TrialCache(str(tmp_path / 'cache'), max_bytes=2*7*8*1000 + 4000)
+    for path in paths[:2]:
+        cache.columns(path)
+    os.utime(os.path.join(cache.entry(paths[0]), 'columns.json'), (0, 0))
+    cache.columns(paths[2])
+    assert not os.path.exists(cache.entry(paths[0]))
+    assert os.path.exists(cache.entry(paths[1])) and os.path.exists(cache.entry(paths[2]))
+
+def test_binary_trials_are_mapped(tmp_path):
+    path = str(tmp_path / 'E1_P01_IMU_1.inob')
+    trialFile = BinaryTrialFile(path, HEADER)
+    trialFile.write(rows(10))
+    trialFile.close()
+    data = RecordedSession(str(tmp_path), TrialCache(str(tmp_path / 'cache'))).trials[0]['IMU']
+    assert data.columns == HEADER
+    assert np.array_equal(data.to_array(), rows(10))
+    assert not os.listdir(str(tmp_path / 'cache'))
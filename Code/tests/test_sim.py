@@ -0,0 +1,63 @@
+import io
+import numpy as np
+import pytest
+from Instrumented_Object_GUI_Sim import SimBNO055, FakeCamera, FakeLED, grasp_profile
+from Instrumented_Object_GUI_IMU import BNO055BurstReader
+from Instrumented_Object_GUI_Backend import default_backend, open_imu, open_camera, make_led
+from Instrumented_Object_Analysis_Video import scan_h264
+
+def test_grasp_profile():
+    t = np.array([0.0, 0.1, 0.2, 1.0, 2.2, 2.3, 2.4, 4.0, 5.0, 6.0])
+    force = grasp_profile(t)
+    assert np.allclose(force, [0, 5, 10, 10, 10, 5, 0, 0, 0, 10])
+    ramp = grasp_profile(np.linspace(0, 0.2, 50))
+    assert np.all(np.diff(ramp) > 0)
+
+def test_simulated_bno055_through_the_burst_reader():
+    sensor = SimBNO055()
+    euler, acceleration, gyro, quaternion = values = sensor.values()
+    # The values of one instant, the registers are computed at each read
+    sensor.values = lambda: values
+    row = BNO055BurstReader(sensor, ('gyro', 'euler', 'quaternion', 'linear_acceleration', 'calibration')).read()
+    assert np.allclose(row[0:3], gyro, atol=np.pi/(180*16))
+    assert np.allclose(row[3:6], euler, atol=1/16)
+    assert np.allclose(row[6:10], quaternion, atol=1/(1 << 14))
+    assert np.allclose(row[10:13], acceleration, atol=0.01)
+    assert row[13] == 0xFF
+    assert abs(np.linalg.norm(quaternion) - 1) < 1e-9
+
+def test_fake_camera_stream(tmp_path):
+    camera = FakeCamera(frame_size=100, intra_period=5)
+    output = io.BytesIO()
+    frames = []
+    class Output:
+        def write(self, data):
+            output.write(data)
+            frames.append(camera.frame)
+    camera.start_recording(Output())
+    camera.wait_recording(0.5)
+    camera.stop_recording()
+    camera.close()
+    complete = [f for f in frames if f.complete and f.timestamp is not None]
+    assert 10 <= len(complete) <= 20
+    assert np.all(np.diff([f.timestamp for f in complete]) > 0)
+    path = str(tmp_path / 'video.h264')
+    with open(path, "wb") as fileHandle:
+        fileHandle.write(output.getvalue())
+    # Every frame is found in the stream, with the headers before the key frames
+    positions, sizes, keys = scan_h264(path)
+    assert len(positions) == len(complete)
+    assert keys.tolist() == [f.frame_type == 1 for f in complete]
+
+def test_backend_selection(monkeypatch):
+    monkeypatch.setenv('INOB_BACKEND', 'sim')
+    assert default_backend() == 'sim'
+    assert isinstance(open_imu(), SimBNO055)
+    assert isinstance(open_camera(), FakeCamera)
+    led = make_led(17)
+    led.on()
+    assert isinstance(led, FakeLED) and led.is_lit
+    monkeypatch.setenv('INOB_BACKEND', 'hardware')
+    with pytest.raises(ValueError):
+        default_backend()
+    assert isinstance(open_imu('sim'), SimBNO055)
@@ -0,0 +1,67 @@
+import time
+import pytest
+from ATI_Mini40_data_bank import ATISerialReader
+from Instrumented_Object_GUI_Control import StartupTimer
+from Instrumented_Object_GUI_Utils import ATIMonitorThread
+
+class SilentReader:
+    ''' Reader of a controller that never answers '''
+
+    def get_reply(self, timeout=None):
+        time.sleep(min(timeout, 0.05))
+        return None
+
+class Port:
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data)
+
+def init_only(port, reader, command_timeout):
+    ''' ATIMonitorThread with just what the initialisation of the controller uses '''
+    monitor = ATIMonitorThread.__new__(ATIMonitorThread)
+    monitor.serial_port = port
+    monitor.reader = reader
+    monitor.command_timeout = command_timeout
+    return monitor
+
+def test_initialisation_of_the_simulated_controller():
+    serial = pytest.importorskip('serial')
+    from Instrumented_Object_GUI_Sim import ATISimulator
+    simulator = ATISimulator()
+    port = serial.Serial(simulator.start(), timeout=0.05)
+    reader = ATISerialReader(port)
+    reader.start()
+    try:
+        monitor = init_only(port, reader, 1.0)
+        start = time.monotonic()
+        monitor.ftSensorInit()
+        elapsed = time.monotonic() - start
+        block = reader.get(1.0)
+    finally:
+        reader.stop(1)
+        port.close()
+        simulator.terminate()
+    # Acknowledged commands do not wait for the timeout, the old fixed sleeps took 5 s
+    assert elapsed < 1.0
+    assert block is not None and block.shape[1] == 7
+
+def test_command_without_answer(capsys):
+    monitor = init_only(Port(), SilentReader(), 0.2)
+    start = time.monotonic()
+    assert monitor.sendCommand('SF 1650') is False
+    assert 0.2 <= time.monotonic() - start < 1.0
+    assert monitor.serial_port.written == [b'SF 1650\r\n']
+    assert "No answer of the controller to SF 1650" in capsys.readouterr().out
+
+def test_startup_steps(capsys):
+    startup = StartupTimer('Test', start=time.monotonic() - 0.5)
+    startup.mark('port')
+    time.sleep(0.05)
+    startup.mark('writer')
+    assert [step for step, duration in startup.steps] == ['port', 'writer']
+    assert startup.steps[0][1] >= 0.5 and startup.steps[1][1] >= 0.05
+    startup.report()
+    assert "Test startup: port" in capsys.readouterr().out
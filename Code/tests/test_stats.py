@@ -0,0 +1,18 @@
+import numpy as np
+from Instrumented_Object_GUI_Stats import Histogram, MonitorStats
+
+def test_percentile_is_at_most_the_max():
+    histogram = Histogram()
+    histogram.add(np.full(100, 0.005))
+    assert histogram.percentile(99) <= histogram.max == 0.005
+    assert histogram.percentile(50) <= 0.005
+
+def test_batches_give_the_intervals_between_reads():
+    stats = MonitorStats('ATI')
+    for k, (timestamp, size) in enumerate([(1.000, 4), (1.020, 4), (1.050, 6)]):
+        stats.add_batch(timestamp, size)
+    summary = stats.summary()
+    assert summary['samples'] == 14
+    assert summary['interval']['count'] == 2
+    assert abs(summary['interval']['max'] - 0.030) < 1e-9
+    assert summary['batch_size']['max'] == 6
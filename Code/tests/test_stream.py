@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from Instrumented_Object_GUI_Stream import SharedRingBuffer, StreamReader, DROP_OLDEST, KEEP_LATEST, DECIMATE
+
+@pytest.fixture
+def ring():
+    ring = SharedRingBuffer(8, 2)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+def rows(start, n):
+    return np.column_stack([np.arange(start, start + n), -np.arange(start, start + n)]).astype(float)
+
+def test_wraparound_keeps_the_latest_rows_contiguous(ring):
+    for start in range(0, 30, 3):
+        ring.write(rows(start, 3))
+        latest = ring.latest(8)
+        assert np.array_equal(latest[:,0], np.arange(max(0, start + 3 - 8), start + 3))
+    assert ring.seq[0] == 30
+
+def test_read_since_returns_the_new_rows_in_order(ring):
+    seq = 0
+    ring.write(rows(0, 5))
+    block, seq, lost = ring.read_since(seq)
+    assert block[:,0].tolist() == [0, 1, 2, 3, 4] and seq == 5 and lost == 0
+    ring.write(rows(5, 6))
+    block, seq, lost = ring.read_since(seq)
+    assert block[:,0].tolist() == [5, 6, 7, 8, 9, 10] and seq == 11 and lost == 0
+    block, seq, lost = ring.read_since(seq)
+    assert len(block) == 0 and seq == 11
+
+def test_slow_reader_counts_the_lost_rows(ring):
+    ring.write(rows(0, 20))
+    block, seq, lost = ring.read_since(0)
+    assert lost == 12
+    assert block[:,0].tolist() == list(range(12, 20))
+
+def test_block_larger_than_the_ring(ring):
+    ring.write(rows(0, 3))
+    ring.write(rows(3, 19))
+    assert ring.seq[0] == 22
+    assert ring.latest(8)[:,0].tolist() == list(range(14, 22))
+
+def test_reader_attached_by_name(ring):
+    reader = SharedRingBuffer(8, 2, name=ring.shm.name, create=False)
+    ring.write(rows(0, 10))
+    assert reader.latest(3)[:,0].tolist() == [7, 8, 9]
+    reader.close()
+
+def test_drop_oldest_bounds_each_read(ring):
+    reader = StreamReader(ring, DROP_OLDEST, max_rows=3)
+    ring.write(rows(0, 5))
+    assert reader.read()[:,0].tolist() == [2, 3, 4]
+    assert reader.dropped == 2 and reader.lost == 0
+    ring.write(rows(5, 12))
+    assert reader.read()[:,0].tolist() == [14, 15, 16]
+    assert reader.lost == 4 and reader.dropped == 7
+    assert len(reader.read()) == 0
+
+def test_keep_latest_and_skip(ring):
+    reader = StreamReader(ring, KEEP_LATEST)
+    ring.write(rows(0, 4))
+    assert reader.read()[:,0].tolist() == [3]
+    assert reader.dropped == 3
+    ring.write(rows(4, 4))
+    reader.skip()
+    assert len(reader.read()) == 0
+    ring.write(rows(8, 1))
+    assert reader.read()[:,0].tolist() == [8]
+    assert reader.dropped == 3
+
+def test_decimation_is_regular_across_reads(ring):
+    reader = StreamReader(ring, DECIMATE, factor=3)
+    taken = []
+    for n in (2, 5, 1, 4):
+        start = int(ring.seq[0])
+        ring.write(rows(start, n))
+        taken.extend(reader.read()[:,0].tolist())
+    # One row out of 3 whatever the size of the reads
+    assert taken == [0, 3, 6, 9]
+    assert reader.dropped == 12 - 4
+
+def test_unknown_policy(ring):
+    with pytest.raises(ValueError):
+        StreamReader(ring, 'newest')
@@ -0,0 +1,41 @@
+import os
+from Instrumented_Object_Analysis_Index import StudyIndex
+from Instrumented_Object_Analysis_Session import RecordedSession, TrialCache
+from Instrumented_Object_GUI_Writer import BinaryTrialFile, CSVTrialFile, trial_has_records
+
+def write_trial(folder, name, peak):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), "w") as fileHandle:
+        fileHandle.write("Time,fx,fy,fz,tx,ty,tz\n")
+        for i in range(10):
+            fileHandle.write("%g,0,0,%g,0,0,0\n" % (0.005*i, peak*i/9))
+
+def test_update_of_one_folder_keeps_the_others(tmp_path):
+    folders = [str(tmp_path / participant) for participant in ('P01', 'P02', 'P03')]
+    for k, folder in enumerate(folders):
+        for trial in range(2):
+            write_trial(folder, "E1_P0%i_ft_%i.csv" % (k + 1, trial), 5.0*(k + 1))
+    index = StudyIndex(str(tmp_path / 'study.sqlite'))
+    assert index.update(folders, workers=1) == 6
+    assert index.update(folders[:1], workers=1) == 0
+    assert len(index.find()) == 6
+    # Only the removed file of the folder updated is forgotten
+    os.remove(os.path.join(folders[0], "E1_P01_ft_1.csv"))
+    index.update(folders[:1], workers=1)
+    assert len(index.find()) == 5
+    assert [row['participant'] for row in index.find(channel='fz', above=12)] == ['P03', 'P03']
+    index.close()
+
+def test_files_prepared_for_a_trial_never_recorded_are_skipped(tmp_path):
+    folder = str(tmp_path / 'P01')
+    write_trial(folder, "E1_P01_ft_0.csv", 5.0)
+    # Left behind by a crash: created ahead of the next trial, only the header was written
+    BinaryTrialFile(os.path.join(folder, "E1_P01_ft_1.inob"), ["Time", "fz"]).close()
+    CSVTrialFile(os.path.join(folder, "E1_P01_IMU_1.csv"), ["Time", "x"]).close()
+    assert trial_has_records(os.path.join(folder, "E1_P01_ft_0.csv"))
+    assert not trial_has_records(os.path.join(folder, "E1_P01_ft_1.inob"))
+    session = RecordedSession(folder, TrialCache(str(tmp_path / 'cache')))
+    assert [trial.name for trial in session] == ["E1_P01_0"]
+    index = StudyIndex(str(tmp_path / 'study.sqlite'))
+    assert index.update([folder], workers=1) == 1
+    index.close()
@@ -0,0 +1,65 @@
+import numpy as np
+from Instrumented_Object_Analysis_Video import VideoIndex, find_start_codes, scan_h264
+from Instrumented_Object_GUI_Sim import FakeCamera
+
+def write_stream(path, frames, intra_period=3):
+    '''
+    Writes an Annex B stream made by the simulated encoder, with a two slice frame when frames gives 2
+    slices, returns the position of each frame and its key frame flag
+    '''
+    camera = FakeCamera(frame_size=50)
+    positions, keys = [], []
+    data = b''
+    for index, slices in enumerate(frames):
+        positions.append(len(data))
+        key = index % intra_period == 0
+        keys.append(key)
+        if key:
+            data = data + camera.nal(7, 20) + camera.nal(8, 4)
+        data = data + camera.nal(5 if key else 1, 50)
+        for s in range(1, slices):
+            # first_mb_in_slice is not 0, a 3 byte start code
+            second = camera.nal(5 if key else 1, 30)
+            data = data + second[1:5] + bytes([second[5] & 0x7F]) + second[6:]
+    with open(path, "wb") as fileHandle:
+        fileHandle.write(data)
+    return np.array(positions), np.array(keys), len(data)
+
+def test_scan_of_the_frames_and_headers(tmp_path):
+    path = str(tmp_path / 'video.h264')
+    positions, keys, size = write_stream(path, [1, 1, 2, 1, 2, 1, 1])
+    found, sizes, foundKeys = scan_h264(path)
+    assert found.tolist() == positions.tolist()
+    assert foundKeys.tolist() == keys.tolist()
+    assert sizes.tolist() == np.diff(np.concatenate([positions, [size]])).tolist()
+
+def test_start_codes_across_chunks():
+    data = np.zeros(40, dtype=np.uint8)
+    data[[7, 9, 17, 31]] = 1
+    data[8] = 5
+    expected = find_start_codes(data).tolist()
+    assert expected == [5, 15, 29]
+    for chunk in (1, 3, 8, 16):
+        assert find_start_codes(data, chunk).tolist() == expected
+
+def test_empty_and_truncated_videos(tmp_path):
+    path = str(tmp_path / 'empty.h264')
+    open(path, "wb").close()
+    assert all(len(result) == 0 for result in scan_h264(path))
+    with open(path, "wb") as fileHandle:
+        fileHandle.write(b'\x00\x00\x00\x01\x65')
+    assert all(len(result) == 0 for result in scan_h264(path))
+
+def test_index_of_a_video_without_sidecar(tmp_path):
+    path = str(tmp_path / 'trial_1.h264')
+    positions, keys, size = write_stream(path, [1]*8, intra_period=4)
+    index = VideoIndex(path)
+    assert index.source == 'scan'
+    assert len(index) == 8
+    assert index.timestamps is None
+    assert index.key_frame(7) == 4
+    assert index.key_frame(3) == 0
+    data, skip = index.segment(6)
+    assert skip == 2
+    with open(path, "rb") as fileHandle:
+        assert data == fileHandle.read()[positions[4]:positions[7]]
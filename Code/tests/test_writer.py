@@ -0,0 +1,106 @@
+import os
+import time
+import queue
+import numpy as np
+from Instrumented_Object_GUI_Writer import (TrialWriter, CSVTrialFile, BinaryTrialFile, load_trial,
+                                            read_trial_metadata, recover_trial_file)
+
+HEADER = ["Time","fx","fy","fz","tx","ty","tz"]
+
+def rows(n, start=0):
+    return np.arange(start*7, (start + n)*7, dtype=np.float64).reshape(n, 7)
+
+def test_errors_are_reported_and_the_writer_goes_on(tmp_path):
+    errors = queue.Queue()
+    writer = TrialWriter(errors=errors)
+    writer.start()
+    # A header JSON cannot store: the trial is lost, its blocks are discarded instead of piling up
+    lost = str(tmp_path / 'lost.inob')
+    writer.open(lost, HEADER, BinaryTrialFile, {'sample_rate': object()})
+    writer.write(rows(10))
+    writer.update_metadata({'note': 'lost'})
+    writer.close()
+    # A block that does not fit the records of the file fails alone
+    path = str(tmp_path / 'kept.inob')
+    writer.open(path, HEADER, BinaryTrialFile)
+    writer.write(rows(5))
+    writer.write(np.zeros((3, 2)))
+    writer.write(rows(5, 5))
+    writer.close()
+    writer.stop(5)
+    assert not writer.is_alive()
+    messages = [errors.get_nowait() for i in range(errors.qsize())]
+    assert len(messages) == 2 and writer.errorCount == 2
+    assert 'open of %s' % lost in messages[0] and 'TypeError' in messages[0]
+    assert writer.discarded == 10
+    records, info = load_trial(path)
+    assert np.array_equal(records['fz'], rows(10)[:,3])
+    stats = read_trial_metadata(path)['writer_stats']
+    assert stats['rows'] == 10 and stats['errors'] == 1
+
+def test_stop_ends_the_thread_when_closing_fails(tmp_path):
+    writer = TrialWriter(errors=queue.Queue())
+    writer.start()
+    path = str(tmp_path / 'trial.csv')
+    writer.open(path, HEADER, CSVTrialFile)
+    writer.write(rows(2))
+    # Metadata JSON cannot store makes the close fail
+    writer.update_metadata({'bad': object()})
+    writer.stop(5)
+    assert not writer.is_alive()
+    assert writer.errorCount >= 1
+    with open(path) as fileHandle:
+        assert len(fileHandle.read().splitlines()) == 3
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_prepared_file_is_used_by_the_trial_it_was_prepared_for(tmp_path):
+    writer = TrialWriter()
+    writer.start()
+    first, second, other = [str(tmp_path / name) for name in ('E1_P01_ft_0.csv', 'E1_P01_ft_1.csv', 'E1_P01_ft_2.csv')]
+    writer.prepare(first, HEADER)
+    wait_for(lambda: os.path.exists(first))
+    inode = os.stat(first).st_ino
+    writer.open(first, HEADER)
+    writer.write(rows(3))
+    writer.update_metadata({'trial': 0})
+    writer.close()
+    # The next trial was prepared, but another file is opened: the prepared one is removed
+    writer.prepare(second, HEADER)
+    wait_for(lambda: os.path.exists(second))
+    writer.open(other, HEADER)
+    writer.close()
+    # Left untouched when it already exists, removed when the writer stops without using it
+    writer.prepare(first, HEADER)
+    writer.prepare(second, HEADER)
+    writer.stop(5)
+    assert os.stat(first).st_ino == inode
+    assert not os.path.exists(second)
+    with open(first) as fileHandle:
+        assert fileHandle.read().splitlines() == [','.join(HEADER)] + [','.join(repr(v) for v in row) for row in rows(3).tolist()]
+    metadata = read_trial_metadata(first)
+    assert metadata['trial'] == 0 and metadata['writer_stats']['rows'] == 3
+    assert read_trial_metadata(other)['writer_stats']['rows'] == 0
+
+def test_recovery_of_truncated_files(tmp_path):
+    csvPath = str(tmp_path / 'trial.csv')
+    binaryPath = str(tmp_path / 'trial.inob')
+    for path, fileType in ((csvPath, CSVTrialFile), (binaryPath, BinaryTrialFile)):
+        trialFile = fileType(path, HEADER)
+        trialFile.write(rows(10))
+        trialFile.close()
+        # A crash in the middle of the last line or record
+        with open(path, "rb+") as fileHandle:
+            fileHandle.truncate(os.path.getsize(path) - 5)
+    assert recover_trial_file(csvPath) == 10
+    assert recover_trial_file(binaryPath) == 9
+    with open(csvPath) as fileHandle:
+        assert len(fileHandle.read().splitlines()) == 10
+    records, info = load_trial(binaryPath)
+    assert np.array_equal(records['fz'], rows(9)[:,3])
+    # Nothing to remove the second time
+    assert recover_trial_file(binaryPath) == 9